@@ -1,12 +1,28 @@
 __version__ = "0.1.2"
-from .insightai import InsightAI  
-from . import prompts
-from . import func_calls
-from . import models
-from . import reg_ex
-from . import groq_models
-from . import openai_models
-from . import log_manager
-from . import output_manager
-from . import utils
-from . import df_ontology
\ No newline at end of file
+
+import importlib
+
+# Submodules (and InsightAI) are imported on first attribute access, so importing the package
+# does not load every provider SDK and display library. `from insightai import InsightAI` and
+# `insightai.models` work as before.
+_SUBMODULES = (
+    'prompts', 'func_calls', 'models', 'reg_ex', 'groq_models', 'openai_models', 'gemini_models',
+    'replay_models', 'log_manager', 'output_manager', 'utils', 'df_ontology', 'llm_cache',
+    'token_counter', 'batch', 'log_store', 'tracing', 'metrics', 'exec_pool',
+    'exec_cache', 'code_validator', 'repair_rules', 'output_capture', 'profiler',
+)
+
+__all__ = ['InsightAI', *_SUBMODULES]
+
+def __getattr__(name):
+    if name == 'InsightAI':
+        value = importlib.import_module('.insightai', __name__).InsightAI
+    elif name in _SUBMODULES:
+        value = importlib.import_module(f'.{name}', __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
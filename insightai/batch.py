@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+try:
+    # Attempt package-relative import
+    from . import models, output_manager, tracing
+except ImportError:
+    # Fall back to script-style import
+    import models, output_manager, tracing
+
+output_handler = output_manager.OutputManager()
+
+BATCH_DIR = 'insightai_batches'
+DEFAULT_POLL_INTERVAL = 30  # Seconds between status checks
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+# Providers exposing the OpenAI-compatible files + batches API
+BATCH_PROVIDERS = ('openai', 'groq')
+
+def build_request_line(custom_id, model, messages, temperature, max_tokens):
+    """One line of a batch job file, in the OpenAI batch input format."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        },
+    }
+
+def build_output_line(custom_id, content=None, prompt_tokens=0, completion_tokens=0, error=None):
+    """One line of a batch output file, in the OpenAI batch output format."""
+    if error is not None:
+        return {"custom_id": custom_id, "response": None, "error": {"message": error}}
+    return {
+        "custom_id": custom_id,
+        "response": {
+            "status_code": 200,
+            "body": {
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        },
+        "error": None,
+    }
+
+def parse_output_line(record):
+    """Return {'content', 'prompt_tokens', 'completion_tokens'} or {'error'} for one output record."""
+    response = record.get('response') or {}
+    if record.get('error') or response.get('status_code') != 200:
+        error = record.get('error') or response.get('body', {}).get('error') or f"status {response.get('status_code')}"
+        return {'error': error.get('message', str(error)) if isinstance(error, dict) else str(error)}
+
+    body = response['body']
+    usage = body.get('usage') or {}
+    return {
+        'content': (body['choices'][0]['message'].get('content') or '').strip(),
+        'prompt_tokens': usage.get('prompt_tokens', 0),
+        'completion_tokens': usage.get('completion_tokens', 0),
+    }
+
+class BatchBackend:
+    """Writes a job file, submits it, polls until it finishes and parses the output.
+
+    Subclasses implement submit(job_path) -> batch_id, status(batch_id) and output_lines(batch_id).
+    """
+    name = 'batch'
+
+    def __init__(self, provider, directory=BATCH_DIR, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.provider = provider
+        self.directory = directory
+        self.poll_interval = poll_interval
+
+    def run(self, job_lines):
+        """Run a job and return {custom_id: parsed output}. Requests missing from the output are omitted."""
+        os.makedirs(self.directory, exist_ok=True)
+        job_path = os.path.join(self.directory, f"batch_{int(time.time() * 1000)}_input.jsonl")
+        with open(job_path, 'w', encoding='utf-8') as f:
+            for line in job_lines:
+                f.write(json.dumps(line) + '\n')
+
+        batch_id = self.submit(job_path)
+        output_handler.print_wrapper(f"Submitted batch {batch_id} with {len(job_lines)} request(s) to {self.name}.")
+
+        status = self.status(batch_id)
+        while status not in FINAL_STATUSES:
+            time.sleep(self.poll_interval)
+            status = self.status(batch_id)
+        if status != 'completed':
+            output_handler.print_wrapper(f"Batch {batch_id} ended with status '{status}'.")
+
+        outputs = {}
+        for line in self.output_lines(batch_id):
+            if line.strip():
+                record = json.loads(line)
+                outputs[record['custom_id']] = parse_output_line(record)
+        return outputs
+
+    def submit(self, job_path):
+        raise NotImplementedError
+
+    def status(self, batch_id):
+        raise NotImplementedError
+
+    def output_lines(self, batch_id):
+        raise NotImplementedError
+
+class ProviderBatchBackend(BatchBackend):
+    """Batch API of an OpenAI-compatible provider (OpenAI, Groq), using the pooled client."""
+    def __init__(self, provider, directory=BATCH_DIR, poll_interval=DEFAULT_POLL_INTERVAL):
+        super().__init__(provider, directory, poll_interval)
+        self.name = f"{provider} batch API"
+
+    def _client(self):
+        client = models.get_client(self.provider)
+        if client is None:
+            raise EnvironmentError(f"No API key set for {self.provider}; cannot submit a batch job.")
+        return client
+
+    def submit(self, job_path):
+        client = self._client()
+        with open(job_path, 'rb') as f:
+            job_file = client.files.create(file=f, purpose='batch')
+        batch = client.batches.create(
+            input_file_id=job_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h',
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        return self._client().batches.retrieve(batch_id).status
+
+    def output_lines(self, batch_id):
+        client = self._client()
+        batch = client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, getattr(batch, 'error_file_id', None)):
+            if file_id:
+                lines.extend(client.files.content(file_id).text.splitlines())
+        return lines
+
+class LocalBatchBackend(BatchBackend):
+    """File-based stand-in for a provider batch API, for testing and providers without one.
+
+    Jobs are identified by a hash of the job file. A job is answered by running each request
+    through the provider's regular llm_call and writing `<batch_id>_output.jsonl` in the batch
+    API's output format. If that file already exists it is used as-is, so recorded outputs can
+    be dropped into the batch directory.
+    """
+    def __init__(self, provider, directory=BATCH_DIR, poll_interval=DEFAULT_POLL_INTERVAL):
+        super().__init__(provider, directory, poll_interval)
+        self.name = f"local batch backend ({self.directory})"
+        self._jobs = {}
+
+    def _output_path(self, batch_id):
+        return os.path.join(self.directory, f"{batch_id}_output.jsonl")
+
+    def submit(self, job_path):
+        with open(job_path, 'rb') as f:
+            batch_id = 'local_' + hashlib.sha1(f.read()).hexdigest()[:16]
+        input_path = os.path.join(self.directory, f"{batch_id}_input.jsonl")
+        if os.path.abspath(job_path) != os.path.abspath(input_path):
+            shutil.move(job_path, input_path)
+        self._jobs[batch_id] = input_path
+        return batch_id
+
+    def status(self, batch_id):
+        if not os.path.exists(self._output_path(batch_id)):
+            self._process(batch_id)
+        return 'completed'
+
+    def _process(self, batch_id):
+        provider_function = models.get_provider_function(self.provider, 'llm_call')
+        output_path = self._output_path(batch_id)
+        with open(self._jobs[batch_id], 'r', encoding='utf-8') as job_file, \
+                open(output_path + '.tmp', 'w', encoding='utf-8') as output_file:
+            for line in job_file:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                body = request['body']
+                try:
+                    result = provider_function(body['messages'], body['model'], body['temperature'], body['max_tokens'])
+                    output = build_output_line(request['custom_id'], result[0], result[2], result[3])
+                except Exception as e:
+                    output = build_output_line(request['custom_id'], error=str(e))
+                output_file.write(json.dumps(output) + '\n')
+        os.replace(output_path + '.tmp', output_path)
+
+    def output_lines(self, batch_id):
+        with open(self._output_path(batch_id), 'r', encoding='utf-8') as f:
+            return f.read().splitlines()
+
+def get_backend(provider):
+    """Pick the batch backend from INSIGHTAI_BATCH_BACKEND ('provider' or 'local')."""
+    backend = os.getenv('INSIGHTAI_BATCH_BACKEND', 'provider').lower()
+    directory = os.getenv('INSIGHTAI_BATCH_DIR', BATCH_DIR)
+    poll_interval = float(os.getenv('INSIGHTAI_BATCH_POLL_INTERVAL', DEFAULT_POLL_INTERVAL))
+
+    if backend not in ('provider', 'local'):
+        raise ValueError(f"Unknown batch backend: {backend}")
+    if backend == 'local' or provider not in BATCH_PROVIDERS:
+        return LocalBatchBackend(provider, directory, poll_interval)
+    return ProviderBatchBackend(provider, directory, poll_interval)
+
+@tracing.traced()
+def run_batch(log_and_call_manager, agent, requests):
+    """Send many independent calls for one agent as a single batch job.
+
+    `requests` is a list of (chain_id, messages). Returns the response contents in the same order.
+    Cached responses are served without being submitted, and requests that fail inside the batch
+    are retried with a regular llm_call. Each response is logged against its own chain.
+    """
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    start_time = time.time()
+    models.current_agent.set(agent)
+    model, provider, max_tokens, temperature = models.init(agent)
+
+    contents = [None] * len(requests)
+    lookups = {}
+    job_lines = []
+    for index, (chain_id, messages) in enumerate(requests):
+        cache, cache_key, cached = models._cache_lookup(
+            log_and_call_manager, chain_id, provider, model, temperature, max_tokens, messages
+        )
+        if cached is not None:
+            result = models._cached_result(cached, messages, start_time)
+            contents[index] = models._finish_call(log_and_call_manager, agent, chain_id, timestamp, model, provider,
+                                                  result, cache, cache_key, cached, clean_sql=True)
+        else:
+            custom_id = f"request-{index}"
+            lookups[custom_id] = (index, cache, cache_key)
+            job_lines.append(build_request_line(custom_id, model, messages, temperature, max_tokens))
+
+    if not job_lines:
+        return contents
+
+    outputs = get_backend(provider).run(job_lines)
+    elapsed_time = time.time() - start_time
+
+    for custom_id, (index, cache, cache_key) in lookups.items():
+        chain_id, messages = requests[index]
+        output = outputs.get(custom_id)
+        if output is None or 'error' in output:
+            error = output['error'] if output else 'no result returned'
+            output_handler.print_wrapper(f"Batch request {custom_id} failed ({error}); calling {provider} directly.")
+            contents[index] = models.llm_call(log_and_call_manager, messages, agent=agent, chain_id=chain_id)
+            continue
+
+        prompt_tokens, completion_tokens = output['prompt_tokens'], output['completion_tokens']
+        tokens_per_second = completion_tokens / elapsed_time if elapsed_time > 0 else 0
+        result = (output['content'], messages, prompt_tokens, completion_tokens,
+                  prompt_tokens + completion_tokens, elapsed_time, tokens_per_second)
+        contents[index] = models._finish_call(log_and_call_manager, agent, chain_id, timestamp, model, provider,
+                                              result, cache, cache_key, None, clean_sql=True)
+
+    return contents
@@ -0,0 +1,520 @@
+import ast
+import collections
+import difflib
+import os
+import re
+
+import pandas as pd
+
+try:
+    # Attempt package-relative import
+    from . import utils
+except ImportError:
+    # Fall back to script-style import
+    import utils
+
+FIX_CUTOFF = 0.8  # Minimum difflib ratio for replacing a misspelled column name automatically
+SUGGEST_CUTOFF = 0.5  # Minimum ratio for naming a column as a suggestion in a reported problem
+MAX_LISTED_COLUMNS = 30
+ACCESSOR_SAMPLE_ROWS = 100
+
+# DataFrame methods whose result has the same columns as the frame they are called on; the
+# first group also keeps the dtypes
+SAME_DTYPES = {'copy', 'head', 'tail', 'sort_values', 'sort_index', 'dropna', 'drop_duplicates',
+               'query', 'sample', 'nlargest', 'nsmallest'}
+SAME_COLUMNS = SAME_DTYPES | {'fillna', 'ffill', 'bfill', 'round', 'abs', 'clip', 'replace', 'where', 'mask'}
+
+# Series methods that build a boolean mask for selecting rows
+MASK_METHODS = {'isin', 'notna', 'notnull', 'isna', 'isnull', 'between', 'duplicated', 'contains',
+                'startswith', 'endswith', 'any', 'all'}
+
+# DataFrame methods taking column names: (position of the argument or None, keyword names)
+COLUMN_ARGUMENTS = {
+    'groupby': (0, ('by',)),
+    'sort_values': (0, ('by',)),
+    'set_index': (0, ('keys',)),
+    'drop_duplicates': (0, ('subset',)),
+    'dropna': (None, ('subset',)),
+    'drop': (None, ('columns',)),
+    'value_counts': (0, ('subset',)),
+    'nlargest': (1, ('columns',)),
+    'nsmallest': (1, ('columns',)),
+    'pivot': (None, ('index', 'columns', 'values')),
+    'pivot_table': (None, ('index', 'columns', 'values')),
+    'melt': (None, ('id_vars', 'value_vars')),
+}
+
+ACCESSORS = ('str', 'dt', 'cat')
+DATAFRAME_ATTRIBUTES = frozenset(dir(pd.DataFrame))
+
+Fix = collections.namedtuple('Fix', 'lineno old new')
+Problem = collections.namedtuple('Problem', 'lineno message')
+ValidationResult = collections.namedtuple('ValidationResult', 'code fixes problems')
+
+class CodeValidationError(Exception):
+    """Generated code that would fail on the DataFrame, found before running it."""
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__('\n'.join(f"line {problem.lineno}: {problem.message}" for problem in problems))
+
+def validation_enabled():
+    return os.getenv('INSIGHTAI_VALIDATE_CODE', '1').lower() not in ('0', 'false', 'no')
+
+def _normalize(name):
+    return re.sub(r'[^0-9a-z]', '', str(name).lower())
+
+def match_column(name, columns, cutoff=FIX_CUTOFF):
+    """Return the single column `name` most likely refers to, or None if there is no clear match.
+
+    A column equal to `name` apart from case, spaces and punctuation wins outright. Otherwise
+    the closest difflib match is used if it scores at least `cutoff` and beats the runner-up.
+    """
+    candidates = [column for column in columns if isinstance(column, str)]
+    normalized = [column for column in candidates if _normalize(column) == _normalize(name)]
+    if normalized:
+        return normalized[0] if len(normalized) == 1 else None
+
+    matches = difflib.get_close_matches(name, candidates, n=2, cutoff=cutoff)
+    if not matches:
+        return None
+    if len(matches) == 2:
+        scores = [difflib.SequenceMatcher(None, name, match).ratio() for match in matches]
+        if scores[0] == scores[1]:
+            return None
+    return matches[0]
+
+class _Frame:
+    """What is known about a DataFrame variable: its columns, and which of them still hold original data."""
+    def __init__(self, columns, original):
+        self.columns = set(columns)
+        self.original = set(original)
+
+    def copy(self, keep_dtypes=True):
+        return _Frame(self.columns, self.original if keep_dtypes else ())
+
+    def add(self, column):
+        self.columns.add(column)
+        self.original.discard(column)
+
+    def remove(self, column):
+        self.columns.discard(column)
+        self.original.discard(column)
+
+def _string_list(node):
+    """The strings of a str constant or a list/tuple of str constants, or None for anything else."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node]
+    if isinstance(node, (ast.List, ast.Tuple)) and node.elts and all(
+            isinstance(element, ast.Constant) and isinstance(element.value, str) for element in node.elts):
+        return list(node.elts)
+    return None
+
+def _selects_rows(node):
+    """Whether a key selects rows by a boolean mask or a slice, keeping every column."""
+    if isinstance(node, ast.Slice):
+        return True
+    if isinstance(node, (ast.Compare, ast.BoolOp)):
+        return True
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr, ast.BitXor)):
+        return True
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Invert):
+        return True
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in MASK_METHODS
+
+def _keyword(call, name):
+    for keyword in call.keywords:
+        if keyword.arg == name:
+            return keyword.value
+    return None
+
+def _is_true(node):
+    return isinstance(node, ast.Constant) and node.value is True
+
+class _Validator:
+    def __init__(self, code, df, frame_name):
+        self.tree = ast.parse(code)
+        self.df = df
+        self.frames = {frame_name: _Frame(df.columns, df.columns)}
+        # Groupby keys and sort keys may also name index levels
+        self.index_names = {name for name in df.index.names if name is not None}
+        self.functions = {node.name for node in ast.walk(self.tree)
+                          if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+        self.parents = {child: node for node in ast.walk(self.tree) for child in ast.iter_child_nodes(node)}
+        self.fixes = []
+        self.problems = []
+        self.edits = []
+
+    def run(self):
+        self._statements(self.tree.body, guarded=False)
+        return self.fixes, self.problems, self.edits
+
+    # Statements are visited in order, so columns created by earlier statements are known to later ones
+    def _statements(self, body, guarded):
+        for statement in body:
+            if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                # Not followed into; the name it binds is handled like any other assignment
+                self._forget([statement.name])
+            elif isinstance(statement, (ast.For, ast.AsyncFor, ast.While)):
+                header = statement.iter if isinstance(statement, (ast.For, ast.AsyncFor)) else statement.test
+                self._simple(header, guarded)
+                if isinstance(statement, (ast.For, ast.AsyncFor)):
+                    self._forget(self._bound_names(statement.target))
+                self._statements(statement.body, guarded)
+                self._statements(statement.orelse, guarded)
+            elif isinstance(statement, ast.If):
+                self._simple(statement.test, guarded)
+                # A branch may be there precisely because a column can be missing
+                self._statements(statement.body, True)
+                self._statements(statement.orelse, True)
+            elif isinstance(statement, (ast.With, ast.AsyncWith)):
+                for item in statement.items:
+                    self._simple(item.context_expr, guarded)
+                    if item.optional_vars is not None:
+                        self._forget(self._bound_names(item.optional_vars))
+                self._statements(statement.body, guarded)
+            elif isinstance(statement, (ast.Try, getattr(ast, 'TryStar', ast.Try))):
+                # Code that expects KeyError or AttributeError is left alone
+                self._statements(statement.body, True)
+                for handler in statement.handlers:
+                    if handler.name:
+                        self._forget([handler.name])
+                    self._statements(handler.body, True)
+                self._statements(statement.orelse, True)
+                self._statements(statement.finalbody, guarded)
+            else:
+                self._simple(statement, guarded)
+
+    def _simple(self, node, guarded):
+        self._check_references(node, guarded)
+        self._apply_definitions(node)
+        if isinstance(node, ast.stmt):
+            self._apply_assignment(node)
+
+    def _bound_names(self, target):
+        return [node.id for node in ast.walk(target) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store)]
+
+    def _forget(self, names):
+        for name in names:
+            self.frames.pop(name, None)
+
+    def _walk(self, node, guarded=False):
+        """Yield (node, guarded) for the expressions in a statement, without entering nested scopes."""
+        yield node, guarded
+        if isinstance(node, (ast.Lambda, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            return
+        # Only one side of a conditional expression or short-circuit runs
+        child_guarded = guarded or isinstance(node, (ast.IfExp, ast.BoolOp))
+        for child in ast.iter_child_nodes(node):
+            yield from self._walk(child, child_guarded)
+
+    def _frame_of(self, node):
+        if isinstance(node, ast.Name):
+            return self.frames.get(node.id)
+        return None
+
+    def _check_references(self, node, guarded):
+        for child, child_guarded in self._walk(node, guarded):
+            if isinstance(child, ast.Subscript):
+                self._check_subscript(child, child_guarded)
+            elif isinstance(child, ast.Attribute):
+                self._check_attribute(child, child_guarded)
+            elif isinstance(child, ast.Call):
+                self._check_call(child, child_guarded)
+
+    def _check_subscript(self, node, guarded):
+        reads = isinstance(node.ctx, ast.Load) or isinstance(self.parents.get(node), ast.AugAssign)
+        key = utils.subscript_key(node)
+        frame = self._frame_of(node.value)
+        if frame is not None and reads:
+            # df['col'] or df[['a', 'b']]; a tuple would be a MultiIndex key
+            if not isinstance(key, ast.Tuple):
+                for element in _string_list(key) or ():
+                    self._check_column(frame, element, guarded, node.value.id)
+            return
+
+        target = node.value
+        if isinstance(target, ast.Attribute) and target.attr == 'loc' and reads:
+            # df.loc[rows, 'col']
+            frame = self._frame_of(target.value)
+            if frame is not None and isinstance(key, ast.Tuple) and len(key.elts) == 2:
+                for element in _string_list(key.elts[1]) or ():
+                    self._check_column(frame, element, guarded, target.value.id)
+        elif isinstance(target, ast.Call) and isinstance(target.func, ast.Attribute) and target.func.attr == 'groupby':
+            # df.groupby(...)['col']
+            frame = self._frame_of(target.func.value)
+            if frame is not None and not isinstance(key, ast.Tuple):
+                for element in _string_list(key) or ():
+                    self._check_column(frame, element, guarded, target.func.value.id)
+
+    def _check_attribute(self, node, guarded):
+        if node.attr in ACCESSORS and isinstance(node.ctx, ast.Load):
+            self._check_accessor(node, guarded)
+
+        frame = self._frame_of(node.value)
+        if frame is None or not isinstance(node.ctx, ast.Load) or node.attr in DATAFRAME_ATTRIBUTES:
+            return
+        parent = self.parents.get(node)
+        if isinstance(parent, ast.Call) and parent.func is node:
+            # An unknown method fails too, but that is not a column problem
+            return
+        if node.attr in frame.columns or node.attr in self.index_names:
+            return
+        if guarded:
+            return
+        fixed = match_column(node.attr, [column for column in frame.columns
+                                         if isinstance(column, str) and column.isidentifier()
+                                         and column not in DATAFRAME_ATTRIBUTES])
+        if fixed is not None:
+            self._fix(node, node.attr, fixed, attribute=True)
+        else:
+            self._report(node, node.attr, frame, node.value.id, attribute=True)
+
+    def _check_call(self, node, guarded):
+        if not isinstance(node.func, ast.Attribute) or node.func.attr not in COLUMN_ARGUMENTS:
+            return
+        frame = self._frame_of(node.func.value)
+        if frame is None:
+            return
+        if node.func.attr == 'drop' and _keyword(node, 'errors') is not None:
+            return
+        position, keywords = COLUMN_ARGUMENTS[node.func.attr]
+        arguments = [_keyword(node, name) for name in keywords]
+        if position is not None and len(node.args) > position:
+            arguments.append(node.args[position])
+        for argument in arguments:
+            for element in (_string_list(argument) if argument is not None else None) or ():
+                self._check_column(frame, element, guarded, node.func.value.id, index_names=True)
+
+    def _check_accessor(self, node, guarded):
+        # df['col'].str / df.col.dt on a column that still holds the original data
+        value = node.value
+        if isinstance(value, ast.Subscript) and isinstance(value.ctx, ast.Load):
+            frame, key = self._frame_of(value.value), utils.subscript_key(value)
+            column = key.value if isinstance(key, ast.Constant) and isinstance(key.value, str) else None
+        elif isinstance(value, ast.Attribute):
+            frame, column = self._frame_of(value.value), value.attr
+        else:
+            return
+        if guarded or frame is None or column is None or column not in frame.original:
+            return
+        series = self.df[column]
+        if not isinstance(series, pd.Series):
+            return
+        try:
+            getattr(series.iloc[:ACCESSOR_SAMPLE_ROWS], node.attr)
+        except AttributeError:
+            self.problems.append(Problem(node.lineno, f"column '{column}' has dtype {series.dtype}, which has no "
+                                                      f".{node.attr} accessor"))
+
+    def _check_column(self, frame, element, guarded, frame_name, index_names=False):
+        name = element.value
+        if name in frame.columns or (index_names and name in self.index_names) or guarded:
+            return
+        fixed = match_column(name, frame.columns)
+        if fixed is not None:
+            self._fix(element, name, fixed)
+        else:
+            self._report(element, name, frame, frame_name)
+
+    def _fix(self, node, old, new, attribute=False):
+        if node.lineno != node.end_lineno:
+            return
+        if attribute:
+            # Replace just the attribute name at the end of `df.name`
+            start = node.end_col_offset - len(old.encode('utf-8'))
+            self.edits.append((node.lineno, start, node.end_col_offset, new))
+        else:
+            self.edits.append((node.lineno, node.col_offset, node.end_col_offset, repr(new)))
+        self.fixes.append(Fix(node.lineno, old, new))
+
+    def _report(self, node, name, frame, frame_name, attribute=False):
+        columns = sorted(map(str, frame.columns))
+        suggestions = difflib.get_close_matches(name, columns, n=3, cutoff=SUGGEST_CUTOFF)
+        reference = f"{frame_name}.{name}" if attribute else f"column '{name}'"
+        message = f"{reference} is not a column of {frame_name}."
+        if suggestions:
+            message += f" Did you mean {', '.join(repr(suggestion) for suggestion in suggestions)}?"
+        listed = columns[:MAX_LISTED_COLUMNS] + (['...'] if len(columns) > MAX_LISTED_COLUMNS else [])
+        message += f" Columns: {', '.join(listed)}"
+        self.problems.append(Problem(node.lineno, message))
+
+    def _apply_definitions(self, node):
+        """Record columns created, deleted or renamed in place by a statement."""
+        for child, _ in self._walk(node):
+            if isinstance(child, ast.Subscript) and isinstance(child.ctx, (ast.Store, ast.Del)):
+                target = child.value
+                key = utils.subscript_key(child)
+                if isinstance(target, ast.Attribute) and target.attr in ('loc', 'iloc'):
+                    target = target.value
+                    key = key.elts[1] if isinstance(key, ast.Tuple) and len(key.elts) == 2 else None
+                frame = self._frame_of(target)
+                if frame is None:
+                    continue
+                strings = _string_list(key) if key is not None else None
+                if strings is None:
+                    if isinstance(child.ctx, ast.Store) and (child.value is target or key is not None):
+                        # df[name] = ... may create any column
+                        self.frames.pop(target.id, None)
+                    continue
+                for element in strings:
+                    if isinstance(child.ctx, ast.Store):
+                        frame.add(element.value)
+                    else:
+                        frame.remove(element.value)
+            elif isinstance(child, ast.Attribute) and isinstance(child.ctx, ast.Store):
+                if self._frame_of(child.value) is not None and child.attr not in ('index',):
+                    # df.columns = [...] and the like
+                    self.frames.pop(child.value.id, None)
+            elif isinstance(child, ast.Call):
+                self._apply_call(child)
+
+    def _apply_call(self, node):
+        if isinstance(node.func, ast.Name) and node.func.id in self.functions:
+            # A function defined in the code may add columns to any frame it can reach
+            self.frames.clear()
+            return
+        if not isinstance(node.func, ast.Attribute):
+            return
+        frame = self._frame_of(node.func.value)
+        if frame is None:
+            return
+        method = node.func.attr
+        name = node.func.value.id
+        if method == 'insert' and len(node.args) >= 2:
+            for element in _string_list(node.args[1]) or ():
+                frame.add(element.value)
+        elif method == 'pop' and node.args:
+            for element in _string_list(node.args[0]) or ():
+                frame.remove(element.value)
+        elif _is_true(_keyword(node, 'inplace')):
+            derived = self._derive_call(node, frame)
+            if derived is None:
+                self.frames.pop(name, None)
+            else:
+                self.frames[name] = derived
+        elif method in ('update', 'eval'):
+            self.frames.pop(name, None)
+
+    def _apply_assignment(self, statement):
+        targets = []
+        if isinstance(statement, ast.Assign):
+            targets = statement.targets
+        elif isinstance(statement, (ast.AnnAssign, ast.AugAssign)):
+            targets = [statement.target]
+        names = [target.id for target in targets if isinstance(target, ast.Name)]
+        derived = None
+        if isinstance(statement, ast.Assign) and names and len(names) == len(targets):
+            derived = self._derive(statement.value)
+            if isinstance(statement.value, ast.Name) and statement.value.id in self.frames:
+                # Two names for one object: changes through either are not tracked
+                self.frames.pop(statement.value.id)
+                derived = None
+        for name in set(self._bound_names(statement)):
+            self.frames.pop(name, None)
+        for name in names:
+            if derived is not None:
+                self.frames[name] = derived.copy()
+
+    def _derive(self, node):
+        """Columns of the DataFrame an expression produces, or None if unknown."""
+        if isinstance(node, ast.Name):
+            frame = self.frames.get(node.id)
+            return frame.copy() if frame is not None else None
+        if isinstance(node, ast.Subscript):
+            key = utils.subscript_key(node)
+            value, rows, columns = node.value, None, key
+            if isinstance(value, ast.Attribute) and value.attr == 'loc':
+                value = value.value
+                if isinstance(key, ast.Tuple) and len(key.elts) == 2:
+                    rows, columns = key.elts
+                else:
+                    rows, columns = key, None
+            frame = self._derive(value)
+            if frame is None or (rows is not None and not _selects_rows(rows)):
+                return None
+            if columns is None:
+                return frame
+            if isinstance(columns, ast.List):
+                strings = _string_list(columns)
+                if strings is None:
+                    return None
+                names = {element.value for element in strings}
+                return _Frame(names, frame.original & names)
+            if rows is None and _selects_rows(columns):
+                # df[mask] or df[start:stop]
+                return frame
+            if isinstance(columns, ast.Slice) and columns.lower is None and columns.upper is None:
+                return frame
+            # A single column is a Series; anything else is unknown
+            return None
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            frame = self._derive(node.func.value)
+            if frame is None:
+                return None
+            return self._derive_call(node, frame)
+        return None
+
+    def _derive_call(self, node, frame):
+        method = node.func.attr
+        if method in SAME_COLUMNS:
+            return frame.copy(keep_dtypes=method in SAME_DTYPES)
+        if method == 'drop':
+            columns = _keyword(node, 'columns')
+            if columns is None and node.args and isinstance(_keyword(node, 'axis'), ast.Constant) \
+                    and _keyword(node, 'axis').value in (1, 'columns'):
+                columns = node.args[0]
+            strings = _string_list(columns) if columns is not None else None
+            if strings is None:
+                return None
+            derived = frame.copy()
+            for element in strings:
+                derived.remove(element.value)
+            return derived
+        if method == 'rename':
+            mapping = _keyword(node, 'columns')
+            if not isinstance(mapping, ast.Dict) or not all(
+                    isinstance(key, ast.Constant) and isinstance(value, ast.Constant)
+                    for key, value in zip(mapping.keys, mapping.values)):
+                return None
+            derived = frame.copy()
+            for key, value in zip(mapping.keys, mapping.values):
+                if key.value in derived.columns:
+                    original = key.value in derived.original
+                    derived.remove(key.value)
+                    derived.columns.add(value.value)
+                    if original:
+                        derived.original.add(value.value)
+            return derived
+        if method == 'assign':
+            if any(keyword.arg is None for keyword in node.keywords):
+                return None
+            derived = frame.copy()
+            for keyword in node.keywords:
+                derived.add(keyword.arg)
+            return derived
+        return None
+
+def _apply_edits(code, edits):
+    # AST column offsets count UTF-8 bytes
+    lines = code.splitlines(keepends=True)
+    for lineno, start, end, text in sorted(edits, reverse=True):
+        line = lines[lineno - 1].encode('utf-8')
+        lines[lineno - 1] = (line[:start] + text.encode('utf-8') + line[end:]).decode('utf-8')
+    return ''.join(lines)
+
+def validate_code(code, df, frame_name='df'):
+    """Check generated code's column references against `df` before running it.
+
+    References to missing columns via df['col'], df.col, df.loc[:, 'col'], groupby(...)[...] and
+    column arguments such as groupby('col') or sort_values(by=...) are fixed in place when a
+    single existing column is a close match, and reported otherwise. .str/.dt/.cat accessors on
+    columns whose dtype lacks them are reported. References inside if/try blocks are not
+    checked, and a frame is no longer checked once the code changes it in a way that is not
+    followed. Returns a ValidationResult with the (possibly fixed) code.
+    """
+    try:
+        fixes, problems, edits = _Validator(code, df, frame_name).run()
+    except SyntaxError:
+        # Left for exec to report with its usual traceback
+        return ValidationResult(code, [], [])
+    return ValidationResult(_apply_edits(code, edits) if edits else code, fixes, problems)
@@ -0,0 +1,197 @@
+import ast
+import collections
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    # Attempt package-relative import
+    from . import utils
+except ImportError:
+    # Fall back to script-style import
+    import utils
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB of cached frames and output
+DEFAULT_SAMPLE_ROWS = 100000  # Rows hashed for a DataFrame fingerprint; 0 hashes every row
+
+CachedExecution = collections.namedtuple('CachedExecution', 'stdout df figures')
+
+def normalize_code(code):
+    """Code with comments, blank lines and formatting removed, so cosmetic edits hash alike."""
+    try:
+        return ast.dump(ast.parse(code))
+    except SyntaxError:
+        return '\n'.join(line.rstrip() for line in code.strip().splitlines() if line.strip())
+
+def fingerprint_dataframe(df, sample_rows=DEFAULT_SAMPLE_ROWS):
+    """Fast fingerprint of a DataFrame: its schema plus a hash of evenly spaced sample rows.
+
+    Frames up to `sample_rows` rows are hashed in full. For larger ones, changes that touch no
+    sampled row (and no column, dtype or length) are not detected. Returns None if the values
+    cannot be hashed.
+    """
+    if df is None:
+        return 'none'
+    digest = hashlib.sha256()
+    digest.update(repr((df.shape, list(map(str, df.columns)), list(map(str, df.dtypes)),
+                        type(df.index).__name__)).encode('utf-8'))
+    sample = df
+    if sample_rows and len(df) > sample_rows:
+        sample = df.iloc[np.linspace(0, len(df) - 1, sample_rows).astype(np.int64)]
+    try:
+        digest.update(pd.util.hash_pandas_object(sample, index=True).values.tobytes())
+    except TypeError:
+        # Unhashable cell values such as lists or dicts
+        return None
+    return digest.hexdigest()
+
+def _same_column(before, after):
+    return before.dtype == after.dtype and before.equals(after)
+
+def frame_delta(base, result):
+    """Describe `result` relative to `base` as (kind, data), keeping only what changed.
+
+    'none' means there is no result frame, 'full' stores the whole frame (rows changed) and
+    'delta' stores the added or modified columns, the dropped column names and the column order.
+    """
+    if result is None:
+        return 'none', None
+    if (base is None or not result.index.equals(base.index)
+            or not result.columns.is_unique or not base.columns.is_unique):
+        return 'full', utils.snapshot_dataframe(result)
+
+    changed = [column for column in result.columns
+               if column not in base.columns or not _same_column(base[column], result[column])]
+    dropped = [column for column in base.columns if column not in result.columns]
+    return 'delta', {
+        'columns': utils.snapshot_dataframe(result[changed]),
+        'dropped': dropped,
+        'order': list(result.columns),
+    }
+
+def apply_delta(base, delta):
+    """Rebuild the result frame of frame_delta from a frame equal to its `base`."""
+    kind, data = delta
+    if kind == 'none':
+        return None
+    if kind == 'full':
+        return utils.snapshot_dataframe(data)
+
+    df = utils.snapshot_dataframe(base).drop(columns=data['dropped'])
+    for column in data['columns'].columns:
+        df[column] = data['columns'][column]
+    return df[data['order']]
+
+def _delta_size(delta):
+    kind, data = delta
+    if kind == 'none':
+        return 0
+    frame = data if kind == 'full' else data['columns']
+    return int(frame.memory_usage(index=True, deep=False).sum())
+
+def new_files(directory, since):
+    """Files in `directory` modified at or after `since`, e.g. figures saved by generated code."""
+    if not os.path.isdir(directory):
+        return []
+    paths = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.stat().st_mtime >= since:
+            paths.append(entry.path)
+    return sorted(paths)
+
+class ExecCache:
+    """In-memory LRU cache of code executions, bounded by the size of what it holds.
+
+    Entries are keyed by the normalized code plus a fingerprint of the input DataFrame, and
+    hold the captured stdout, the frame delta and the paths of figures the code saved. Frames
+    are held as Copy-on-Write snapshots where pandas supports it, so cached columns share
+    memory with the live frame until either side changes them.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, sample_rows=DEFAULT_SAMPLE_ROWS):
+        self.max_bytes = max_bytes
+        self.sample_rows = sample_rows
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, code, df):
+        """Cache key for running `code` on `df`, or None if the frame cannot be fingerprinted."""
+        fingerprint = fingerprint_dataframe(df, self.sample_rows)
+        if fingerprint is None:
+            return None
+        return hashlib.sha256(f"{normalize_code(code)}\0{fingerprint}".encode('utf-8')).hexdigest()
+
+    def get(self, key, base_df):
+        """Return a CachedExecution rebuilt on `base_df`, or None if missing or its figures are gone."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not all(os.path.exists(path) for path in entry[2]):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        stdout, delta, figures, size = entry
+        return CachedExecution(stdout, apply_delta(base_df, delta), list(figures))
+
+    def put(self, key, base_df, stdout, result_df, figures=()):
+        """Store an execution and evict least recently used entries if over the size budget."""
+        delta = frame_delta(base_df, result_df)
+        size = _delta_size(delta) + len(stdout.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (stdout, delta, tuple(figures), size)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        self._size -= self._entries.pop(key)[3]
+
+    def clear(self):
+        """Remove every cached execution."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _build_cache(max_bytes=None, sample_rows=None):
+    return ExecCache(
+        max_bytes if max_bytes is not None else int(os.getenv('INSIGHTAI_EXEC_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+        sample_rows if sample_rows is not None else int(os.getenv('INSIGHTAI_EXEC_CACHE_SAMPLE_ROWS', DEFAULT_SAMPLE_ROWS)),
+    )
+
+def enable_cache(max_bytes=None, sample_rows=None):
+    """Turn on the execution cache for this process and return it."""
+    global _cache
+    with _cache_lock:
+        _cache = _build_cache(max_bytes, sample_rows)
+    return _cache
+
+def disable_cache():
+    """Turn off the execution cache for this process."""
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+def get_cache():
+    """Return the active cache, creating it on first use if INSIGHTAI_EXEC_CACHE is set."""
+    global _cache
+    if _cache is None and os.getenv('INSIGHTAI_EXEC_CACHE', '').lower() in ('1', 'true', 'yes'):
+        with _cache_lock:
+            if _cache is None:
+                _cache = _build_cache()
+    return _cache
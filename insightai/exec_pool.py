@@ -0,0 +1,452 @@
+import atexit
+import collections
+import gc
+import multiprocessing
+import os
+import pickle
+import queue
+import sys
+import re
+import threading
+import time
+import traceback
+import uuid
+from contextlib import redirect_stdout
+from multiprocessing import shared_memory
+
+try:
+    # Attempt package-relative import
+    from . import output_capture, profiler
+except ImportError:
+    # Fall back to script-style import
+    import output_capture, profiler
+
+FIGURE_DIR = 'visualization'
+DEFAULT_MAX_TASKS = 100  # Executions before a worker is replaced, bounding leaks from generated code
+MEMORY_POLL_INTERVAL = 0.05  # Seconds between RSS checks of a worker with a memory limit
+CANCEL_POLL_INTERVAL = 0.05  # Seconds between checks of a cancellable run's cancel event
+
+# Imported by each worker before it reports ready, so executions start warm
+WARM_MODULES = ('numpy', 'pandas', 'matplotlib.pyplot', 'seaborn', 'sklearn')
+
+# profile is a profiler.CodeProfile when the run was profiled
+ExecResult = collections.namedtuple('ExecResult', 'stdout df figures profile', defaults=(None,))
+
+class CodeExecutionError(Exception):
+    """Generated code raised in a worker process. Carries the worker's formatted traceback."""
+    def __init__(self, exception_type, exception_value, traceback_text=''):
+        super().__init__(f"{exception_type}: {exception_value}")
+        self.exception_type = exception_type
+        self.exception_value = exception_value
+        self.traceback = traceback_text
+
+class WorkerCrashed(CodeExecutionError):
+    """The worker process died while running the code, e.g. from a segfault or os._exit()."""
+    def __init__(self, exitcode):
+        super().__init__('WorkerCrashed', f"the execution worker exited unexpectedly (exit code {exitcode})")
+        self.exitcode = exitcode
+
+class ExecutionTimeout(CodeExecutionError):
+    """The code ran past its wall-clock limit and its worker was killed."""
+    def __init__(self, timeout):
+        super().__init__('ExecutionTimeout', f"execution exceeded the {timeout:g} second time limit")
+        self.timeout = timeout
+
+class ExecutionMemoryExceeded(CodeExecutionError):
+    """The code's worker went over its memory limit (or raised MemoryError) and was stopped."""
+    def __init__(self, memory_limit, used=None, traceback_text=''):
+        used_text = f"used {used / 2**20:.0f} MB, " if used else "ran out of memory, "
+        super().__init__('ExecutionMemoryExceeded',
+                         f"execution {used_text}over the {memory_limit / 2**20:.0f} MB memory limit", traceback_text)
+        self.memory_limit = memory_limit
+        self.used = used
+
+class ExecutionCancelled(Exception):
+    """The run was cancelled through its cancel event; its worker, if it had started, was killed."""
+
+_SIZE_UNITS = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+
+def parse_size(value):
+    """Bytes from an int or a string such as '512MB' or '2G'. None and 0 mean no limit."""
+    if value is None or isinstance(value, (int, float)):
+        return int(value) if value else None
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?)(?:I?B)?\s*', str(value).upper())
+    if not match:
+        raise ValueError(f"Invalid memory size: {value!r}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)]) or None
+
+_memory_warned = False
+
+def process_rss(pid):
+    """Resident memory of a process in bytes, not counting shared pages, or None where it cannot be read.
+
+    Shared pages include the shared memory blocks of the input DataFrame and the mapped code of
+    loaded libraries, so reading the frame does not count against a worker's memory limit.
+    """
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            resident, shared = f.read().split()[1:3]
+        return (int(resident) - int(shared)) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    try:
+        info = psutil.Process(pid).memory_info()
+    except psutil.Error:
+        return None
+    # 'shared' is only reported on Linux
+    return info.rss - getattr(info, 'shared', 0)
+
+def _warn_memory_unreadable():
+    global _memory_warned
+    if not _memory_warned:
+        print("Cannot read worker memory use (no /proc and psutil is not installed); "
+              "exec_memory_limit is only enforced through MemoryError.", file=sys.stderr)
+        _memory_warned = True
+
+def _attach(name):
+    # Workers share the parent's resource tracker, so the creator's registration already covers the block
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+def share_frame(df):
+    """Put a DataFrame in shared memory. Returns (handle to send, blocks to unlink when done).
+
+    The frame is pickled with protocol 5, which hands out the column data as out-of-band
+    buffers instead of copying it into the pickle. Each buffer is written once into its own
+    shared memory block; the pickle that remains only describes the frame's structure.
+    """
+    if df is None:
+        return None, []
+    buffers = []
+    payload = pickle.dumps(df, protocol=5, buffer_callback=buffers.append)
+    blocks, layout = [], []
+    try:
+        for buffer in buffers:
+            raw = buffer.raw()
+            shm = shared_memory.SharedMemory(create=True, size=max(raw.nbytes, 1))
+            blocks.append(shm)
+            shm.buf[:raw.nbytes] = raw
+            layout.append((shm.name, raw.nbytes))
+    except BaseException:
+        release_blocks(blocks, unlink=True)
+        raise
+    return (payload, layout), blocks
+
+def load_frame(handle, copy=False):
+    """Rebuild a frame from share_frame's handle. Returns (df, attached blocks).
+
+    Without `copy` the frame reads its data straight from shared memory, so the blocks must
+    stay open while it is in use. With `copy` the data is copied out and the blocks can be
+    closed right away.
+    """
+    if handle is None:
+        return None, []
+    payload, layout = handle
+    blocks = [_attach(name) for name, _ in layout]
+    if copy:
+        buffers = [bytearray(shm.buf[:size]) for shm, (_, size) in zip(blocks, layout)]
+    else:
+        buffers = [shm.buf[:size] for shm, (_, size) in zip(blocks, layout)]
+    return pickle.loads(payload, buffers=buffers), blocks
+
+def release_blocks(blocks, unlink=False):
+    """Close (and optionally unlink) blocks. Returns False if a block is still referenced and stays mapped."""
+    released = True
+    for shm in blocks:
+        try:
+            shm.close()
+        except BufferError:
+            released = False
+        if unlink:
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+    return released
+
+def _warm_up():
+    try:
+        import matplotlib
+        matplotlib.use('Agg')  # Workers have no display; figures are saved to files
+    except ImportError:
+        pass
+    for module in WARM_MODULES:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+def _save_figures(figure_dir, job_id):
+    if 'matplotlib.pyplot' not in sys.modules:
+        return []
+    plt = sys.modules['matplotlib.pyplot']
+    paths = []
+    for number in plt.get_fignums():
+        os.makedirs(figure_dir, exist_ok=True)
+        path = os.path.join(figure_dir, f"figure_{job_id}_{number}.png")
+        plt.figure(number).savefig(path)
+        paths.append(path)
+    plt.close('all')
+    return paths
+
+def _run_job(job, figure_dir, conn):
+    """Execute one job. Returns (message, keep running)."""
+    df, blocks = load_frame(job['frame'])
+    # Memory limits apply to what the code allocates, above what the worker holds at this point
+    conn.send({'status': 'started', 'memory': process_rss(os.getpid())})
+    local_vars = output_capture.exec_namespace(df)
+    output = output_capture.BoundedOutput()
+    profile = None
+    try:
+        with redirect_stdout(output):
+            if job.get('profile'):
+                profile = profiler.profile_exec(job['code'], local_vars).to_dict()
+            else:
+                exec(job['code'], local_vars)
+        figures = _save_figures(figure_dir, job['id'])
+        handle, result_blocks = share_frame(local_vars.get('df'))
+        # The parent unlinks the result blocks once it has copied the frame out
+        release_blocks(result_blocks)
+        message = {'status': 'ok', 'stdout': output.getvalue(), 'summarized': output.summarized, 'frame': handle,
+                   'figures': figures, 'profile': profile}
+    except Exception as error:
+        _save_figures(figure_dir, job['id'])
+        message = {
+            'status': 'error',
+            'stdout': output.getvalue(),
+            'summarized': output.summarized,
+            'exception_type': type(error).__name__,
+            'exception_value': str(error),
+            'traceback': traceback.format_exc(),
+        }
+
+    # Drop every reference into the parent's blocks before unmapping them
+    del df, local_vars
+    gc.collect()
+    # Generated code that kept a reference alive (e.g. in a module global) pins the mapping; retire the worker
+    if release_blocks(blocks):
+        return message, True
+    _pinned.extend(blocks)
+    return message, False
+
+# Blocks a worker could not unmap; kept referenced until the worker exits
+_pinned = []
+
+def _worker_main(conn, figure_dir, max_tasks):
+    _warm_up()
+    conn.send({'status': 'ready'})
+    tasks = 0
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        message, healthy = _run_job(job, figure_dir, conn)
+        tasks += 1
+        message['retire'] = not healthy or tasks >= max_tasks
+        conn.send(message)
+        if message['retire']:
+            break
+    conn.close()
+    if _pinned:
+        # Skip interpreter teardown, which would try (and loudly fail) to unmap the pinned blocks
+        os._exit(0)
+
+class _Worker:
+    def __init__(self, context, figure_dir, max_tasks):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, figure_dir, max_tasks),
+            name='insightai-exec-worker', daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def wait_ready(self):
+        if not self.ready:
+            self.receive()
+            self.ready = True
+
+    def receive(self):
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            self.process.join(1)
+            raise WorkerCrashed(self.process.exitcode)
+
+    def wait_result(self, timeout=None, memory_limit=None, cancel=None):
+        """Receive the job's result, raising ExecutionTimeout/ExecutionMemoryExceeded when a limit is hit."""
+        deadline = time.monotonic() + timeout if timeout else None
+        # Worker memory when the code started; growth above it is checked against the limit
+        started, baseline = False, 0
+        while True:
+            wait = MEMORY_POLL_INTERVAL if memory_limit else None
+            if cancel is not None:
+                if cancel.is_set():
+                    raise ExecutionCancelled()
+                wait = CANCEL_POLL_INTERVAL if wait is None else min(wait, CANCEL_POLL_INTERVAL)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ExecutionTimeout(timeout)
+                wait = remaining if wait is None else min(wait, remaining)
+            if self.conn.poll(wait):
+                message = self.receive()
+                if message['status'] == 'started':
+                    started, baseline = True, message['memory'] or 0
+                    continue
+                return message
+            if memory_limit and started:
+                used = process_rss(self.process.pid)
+                if used is None:
+                    _warn_memory_unreadable()
+                elif used - baseline > memory_limit:
+                    raise ExecutionMemoryExceeded(memory_limit, used - baseline)
+
+    def stop(self, timeout=1):
+        if timeout:
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                pass
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+class ExecPool:
+    """Pre-warmed worker processes that execute generated code in isolation.
+
+    run() sends the DataFrame through shared memory (see share_frame), executes the code in an
+    idle worker and returns its stdout, the resulting frame and any figures left open, which
+    are saved as PNG files. Workers run in parallel on separate cores, so concurrent sessions
+    do not contend for the GIL, and a worker that crashes or leaks is simply replaced.
+
+    A run can be given a wall-clock timeout and a memory limit. The worker's private resident
+    memory is sampled while it runs, and its growth since the code started is held to the
+    limit; a worker over either limit is killed and replaced, which stops the code for
+    certain, even inside a C extension.
+    """
+    def __init__(self, size=1, figure_dir=None, max_tasks=None, start_method=None):
+        self.figure_dir = figure_dir or os.getenv('INSIGHTAI_FIGURE_DIR', FIGURE_DIR)
+        self.max_tasks = max_tasks or int(os.getenv('INSIGHTAI_EXEC_MAX_TASKS', DEFAULT_MAX_TASKS))
+        # 'spawn' keeps workers free of the parent's threads (log writer, metrics server)
+        self._context = multiprocessing.get_context(start_method or os.getenv('INSIGHTAI_EXEC_START_METHOD', 'spawn'))
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = set()
+        self._closed = False
+        self.size = 0
+        self.resize(size)
+
+    def _spawn(self):
+        worker = _Worker(self._context, self.figure_dir, self.max_tasks)
+        with self._lock:
+            self._workers.add(worker)
+        self._idle.put(worker)
+
+    def _retire(self, worker, replace=True, kill=False):
+        with self._lock:
+            self._workers.discard(worker)
+        worker.stop(timeout=0 if kill else 1)
+        if replace and not self._closed:
+            self._spawn()
+
+    def resize(self, size):
+        """Grow the pool to `size` workers. Pools never shrink while running."""
+        while self.size < size:
+            self._spawn()
+            self.size += 1
+
+    def _take_worker(self, cancel=None):
+        while True:
+            try:
+                return self._idle.get(timeout=CANCEL_POLL_INTERVAL if cancel is not None else None)
+            except queue.Empty:
+                if cancel.is_set():
+                    raise ExecutionCancelled()
+
+    def run(self, code, df=None, timeout=None, memory_limit=None, cancel=None, echo=True, profile=False):
+        """Execute `code` with `df` bound to the name df. Returns ExecResult; raises CodeExecutionError.
+
+        `timeout` is in seconds and `memory_limit` in bytes (or a size string such as '2GB').
+        Setting the threading.Event `cancel` stops the run (killing its worker) with
+        ExecutionCancelled. With `echo` False the worker's stdout is only returned, not written.
+        With `profile` the result carries the per-statement profile of the run.
+        """
+        if self._closed:
+            raise RuntimeError("The execution pool has been shut down")
+        memory_limit = parse_size(memory_limit)
+
+        worker = self._take_worker(cancel)
+        try:
+            handle, blocks = share_frame(df)
+        except BaseException:
+            self._idle.put(worker)
+            raise
+        retire, kill = True, True
+        try:
+            # A fresh worker's warm-up does not count against the timeout
+            worker.wait_ready()
+            worker.conn.send({'id': uuid.uuid4().hex[:12], 'code': code, 'frame': handle, 'profile': profile})
+            try:
+                message = worker.wait_result(timeout, memory_limit, cancel)
+            except WorkerCrashed as error:
+                # Killed by the OS out-of-memory killer before our own check caught it
+                if memory_limit and error.exitcode == -9:
+                    raise ExecutionMemoryExceeded(memory_limit) from error
+                raise
+            retire, kill = message['retire'], False
+        finally:
+            release_blocks(blocks, unlink=True)
+            if retire:
+                self._retire(worker, kill=kill)
+            else:
+                self._idle.put(worker)
+
+        # Echo the output as in-process exec would, so callers capturing stdout see it (also on errors)
+        if echo:
+            sys.stdout.write(message['stdout'])
+            if isinstance(sys.stdout, output_capture.BoundedOutput):
+                sys.stdout.summarized += message['summarized']
+        if message['status'] == 'error':
+            if memory_limit and message['exception_type'] == 'MemoryError':
+                raise ExecutionMemoryExceeded(memory_limit, traceback_text=message['traceback'])
+            raise CodeExecutionError(message['exception_type'], message['exception_value'], message['traceback'])
+
+        result_df, result_blocks = load_frame(message['frame'], copy=True)
+        release_blocks(result_blocks, unlink=True)
+        code_profile = profiler.CodeProfile.from_dict(message['profile']) if message['profile'] else None
+        return ExecResult(message['stdout'], result_df, message['figures'], code_profile)
+
+    def shutdown(self):
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool(size=1):
+    """Return the process-wide execution pool, started on first use and grown to at least `size` workers."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExecPool(size)
+            atexit.register(_pool.shutdown)
+        else:
+            _pool.resize(size)
+    return _pool
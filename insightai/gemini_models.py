@@ -1,25 +1,87 @@
 import os
 import time
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
 
 try:
     # Attempt package-relative import
-    from . import output_manager
+    from . import models, output_manager
 except ImportError:
     # Fall back to script-style import
-    import output_manager
+    import models, output_manager
 
 output_manager = output_manager.OutputManager()
 
+class GeminiClient:
+    """Builds GenerativeModels that call Gemini with one API key and endpoint.
+
+    genai.configure sets process-wide credentials, so clients for different keys would overwrite
+    each other. Each GeminiClient owns its own service client instead and hands it to the models
+    it builds; the gRPC channel behind it is reused across calls.
+    """
+    def __init__(self, api_key, base_url=None, asynchronous=False):
+        client_options = {"api_key": api_key}
+        if base_url:
+            client_options["api_endpoint"] = base_url
+        service = glm.GenerativeServiceAsyncClient if asynchronous else glm.GenerativeServiceClient
+        self.service = service(client_options=client_options)
+        self.asynchronous = asynchronous
+
+    def GenerativeModel(self, **kwargs):
+        model = genai.GenerativeModel(**kwargs)
+        # The SDK only falls back to its process-wide client when these are unset
+        if self.asynchronous:
+            model._async_client = _AsyncTrackedService(self.service)
+        else:
+            model._client = _TrackedService(self.service)
+        return model
+
+    def cancel_streams(self, model):
+        """Cancel the model's streamed calls, releasing any that were not read to the end."""
+        service = model._async_client if self.asynchronous else model._client
+        for stream in getattr(service, 'streams', ()):
+            stream.cancel()
+
+    def close(self):
+        transport = getattr(self.service, 'transport', None)
+        if transport is not None and not self.asynchronous:
+            transport.close()
+
+class _TrackedService:
+    """A model's view of a GenerativeService client that remembers the streamed calls it starts."""
+    def __init__(self, service):
+        self.service = service
+        self.streams = []
+
+    def __getattr__(self, name):
+        return getattr(self.service, name)
+
+    def stream_generate_content(self, *args, **kwargs):
+        stream = self.service.stream_generate_content(*args, **kwargs)
+        self.streams.append(stream)
+        return stream
+
+class _AsyncTrackedService(_TrackedService):
+    async def stream_generate_content(self, *args, **kwargs):
+        stream = await self.service.stream_generate_content(*args, **kwargs)
+        self.streams.append(stream)
+        return stream
+
+def create_client(api_key, base_url, pool_limits):
+    """Create the Gemini client for one key and endpoint. Called by models.client_registry.
+
+    gRPC manages its own channel, so pool_limits does not apply.
+    """
+    return GeminiClient(api_key, base_url)
+
 def init():
-    """Initialize Gemini client with API key."""
+    """Get the Gemini client configured with the API key."""
     API_KEY = os.environ.get('GEMINI_API_KEY')
     if API_KEY is None:
         output_manager.print_wrapper("Warning: GEMINI_API_KEY environment variable not found.")
         return None
         
-    genai.configure(api_key=API_KEY)
-    return genai
+    return models.get_client('gemini')
 
 def convert_openai_to_gemini(messages):
     """Convert OpenAI message format to Gemini format."""
@@ -42,6 +104,44 @@ def convert_openai_to_gemini(messages):
     
     return gemini_messages, system_content
 
+def create_async_client(api_key, base_url, pool_limits):
+    """Create the Gemini client for async calls on the running event loop."""
+    return GeminiClient(api_key, base_url, asynchronous=True)
+
+def ainit():
+    """Get the Gemini client for async calls."""
+    API_KEY = os.environ.get('GEMINI_API_KEY')
+    if API_KEY is None:
+        output_manager.print_wrapper("Warning: GEMINI_API_KEY environment variable not found.")
+        return None
+
+    return models.get_async_client('gemini')
+
+def _build_model(client, messages, model_name, temperature, max_tokens):
+    """Convert the messages and create a GenerativeModel for the request."""
+    gemini_messages, system_instruction = convert_openai_to_gemini(messages)
+    
+    generation_config = {
+        "temperature": temperature,
+        "top_p": 1,
+        "top_k": 1,
+        "max_output_tokens": max_tokens,
+    }
+    
+    model = client.GenerativeModel(
+        model_name=model_name,
+        generation_config=generation_config,
+        system_instruction=system_instruction
+    )
+    return model, gemini_messages
+
+def _reported_usage(response):
+    """Return (prompt_tokens, completion_tokens) from the response's usage metadata, or None if absent."""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None or not usage.candidates_token_count:
+        return None
+    return usage.prompt_token_count, usage.candidates_token_count
+
 def llm_call(messages: str, model_name: str, temperature: str, max_tokens: str):  
     """Make a non-streaming call to Gemini API."""
     client = init()
@@ -49,20 +149,7 @@ def llm_call(messages: str, model_name: str, temperature: str, max_tokens: str):
         raise EnvironmentError("Failed to initialize Gemini client")
 
     try:
-        gemini_messages, system_instruction = convert_openai_to_gemini(messages)
-        
-        generation_config = {
-            "temperature": temperature,
-            "top_p": 1,
-            "top_k": 1,
-            "max_output_tokens": max_tokens,
-        }
-        
-        model = client.GenerativeModel(
-            model_name=model_name,
-            generation_config=generation_config,
-            system_instruction=system_instruction
-        )
+        model, gemini_messages = _build_model(client, messages, model_name, temperature, max_tokens)
         
         start_time = time.time()
         response = model.generate_content(gemini_messages)
@@ -71,9 +158,13 @@ def llm_call(messages: str, model_name: str, temperature: str, max_tokens: str):
         elapsed_time = end_time - start_time
         content = response.text.strip()
         
-        # Count tokens used
-        prompt_tokens = model.count_tokens(str(gemini_messages)).total_tokens
-        completion_tokens = model.count_tokens(content).total_tokens
+        # Count tokens used, only asking the count_tokens endpoint when no usage was reported
+        usage = _reported_usage(response)
+        if usage:
+            prompt_tokens, completion_tokens = usage
+        else:
+            prompt_tokens = model.count_tokens(str(gemini_messages)).total_tokens
+            completion_tokens = model.count_tokens(content).total_tokens
         total_tokens = prompt_tokens + completion_tokens
         tokens_per_second = completion_tokens / elapsed_time if elapsed_time > 0 else 0
 
@@ -87,8 +178,44 @@ def llm_call(messages: str, model_name: str, temperature: str, max_tokens: str):
         output_manager.print_wrapper(f"Error during Gemini API call: {str(e)}")
         raise
 
+async def allm_call(messages: str, model_name: str, temperature: str, max_tokens: str):
+    """Make a non-streaming call to Gemini API without blocking the event loop."""
+    client = ainit()
+    if client is None:
+        raise EnvironmentError("Failed to initialize Gemini client")
+
+    try:
+        model, gemini_messages = _build_model(client, messages, model_name, temperature, max_tokens)
+
+        start_time = time.time()
+        response = await model.generate_content_async(gemini_messages)
+        end_time = time.time()
+
+        elapsed_time = end_time - start_time
+        content = response.text.strip()
+
+        # Count tokens used, only asking the count_tokens endpoint when no usage was reported
+        usage = _reported_usage(response)
+        if usage:
+            prompt_tokens, completion_tokens = usage
+        else:
+            prompt_tokens = (await model.count_tokens_async(str(gemini_messages))).total_tokens
+            completion_tokens = (await model.count_tokens_async(content)).total_tokens
+        total_tokens = prompt_tokens + completion_tokens
+        tokens_per_second = completion_tokens / elapsed_time if elapsed_time > 0 else 0
+
+        return (
+            content, messages, prompt_tokens,
+            completion_tokens, total_tokens,
+            elapsed_time, tokens_per_second
+        )
+
+    except Exception as e:
+        output_manager.print_wrapper(f"Error during Gemini API call: {str(e)}")
+        raise
+
 def llm_stream(log_and_call_manager, chain_id: str, messages: str, model_name: str, 
-               temperature: str, max_tokens: str, tools: str = None):  
+               temperature: str, max_tokens: str, tools: str = None, on_token=None):
     """Make a streaming call to Gemini API."""
     collected_messages = []
     
@@ -97,39 +224,34 @@ def llm_stream(log_and_call_manager, chain_id: str, messages: str, model_name: s
         raise EnvironmentError("Failed to initialize Gemini client")
 
     try:
-        gemini_messages, system_instruction = convert_openai_to_gemini(messages)
-        
-        generation_config = {
-            "temperature": temperature,
-            "top_p": 1,
-            "top_k": 1,
-            "max_output_tokens": max_tokens,
-        }
-        
-        model = client.GenerativeModel(
-            model_name=model_name,
-            generation_config=generation_config,
-            system_instruction=system_instruction
-        )
+        model, gemini_messages = _build_model(client, messages, model_name, temperature, max_tokens)
         
-        start_time = time.time()
+        stats = models.StreamStats(on_token)
         response = model.generate_content(gemini_messages, stream=True)
         
-        for chunk in response:
-            if chunk.text:
-                chunk_message = chunk.text
-                collected_messages.append(chunk_message)
-                output_manager.print_wrapper(chunk_message, end='', flush=True)
+        # A hedge attempt that lost is stopped mid-stream; always cancel the call behind the stream
+        try:
+            for chunk in response:
+                if chunk.text:
+                    chunk_message = chunk.text
+                    stats.emit(chunk_message)
+                    collected_messages.append(chunk_message)
+        finally:
+            client.cancel_streams(model)
                 
         end_time = time.time()
-        elapsed_time = end_time - start_time
+        elapsed_time = end_time - stats.start_time
         output_manager.print_wrapper("")
         
         full_reply_content = ''.join(collected_messages)
         
-        # Count tokens used
-        prompt_tokens = model.count_tokens(str(gemini_messages)).total_tokens
-        completion_tokens = model.count_tokens(full_reply_content).total_tokens
+        # Count tokens used; the final usage metadata covers the whole stream
+        usage = _reported_usage(response)
+        if usage:
+            prompt_tokens, completion_tokens = usage
+        else:
+            prompt_tokens = model.count_tokens(str(gemini_messages)).total_tokens
+            completion_tokens = model.count_tokens(full_reply_content).total_tokens
         total_tokens = prompt_tokens + completion_tokens
         
         tokens_per_second = completion_tokens / elapsed_time if elapsed_time > 0 else 0
@@ -137,9 +259,60 @@ def llm_stream(log_and_call_manager, chain_id: str, messages: str, model_name: s
         return (
             full_reply_content, messages, prompt_tokens, 
             completion_tokens, total_tokens, 
-            elapsed_time, tokens_per_second
+            elapsed_time, tokens_per_second, stats.time_to_first_token
         )
         
     except Exception as e:
         output_manager.print_wrapper(f"\nError during Gemini API call: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+async def allm_stream(log_and_call_manager, chain_id: str, messages: str, model_name: str,
+                      temperature: str, max_tokens: str, tools: str = None, on_token=None):
+    """Make a streaming call to Gemini API without blocking the event loop."""
+    collected_messages = []
+
+    client = ainit()
+    if client is None:
+        raise EnvironmentError("Failed to initialize Gemini client")
+
+    try:
+        model, gemini_messages = _build_model(client, messages, model_name, temperature, max_tokens)
+
+        stats = models.StreamStats(on_token)
+        response = await model.generate_content_async(gemini_messages, stream=True)
+
+        try:
+            async for chunk in response:
+                if chunk.text:
+                    chunk_message = chunk.text
+                    stats.emit(chunk_message)
+                    collected_messages.append(chunk_message)
+        finally:
+            client.cancel_streams(model)
+
+        end_time = time.time()
+        elapsed_time = end_time - stats.start_time
+        output_manager.print_wrapper("")
+
+        full_reply_content = ''.join(collected_messages)
+
+        # Count tokens used; the final usage metadata covers the whole stream
+        usage = _reported_usage(response)
+        if usage:
+            prompt_tokens, completion_tokens = usage
+        else:
+            prompt_tokens = (await model.count_tokens_async(str(gemini_messages))).total_tokens
+            completion_tokens = (await model.count_tokens_async(full_reply_content)).total_tokens
+        total_tokens = prompt_tokens + completion_tokens
+
+        tokens_per_second = completion_tokens / elapsed_time if elapsed_time > 0 else 0
+
+        return (
+            full_reply_content, messages, prompt_tokens,
+            completion_tokens, total_tokens,
+            elapsed_time, tokens_per_second, stats.time_to_first_token
+        )
+
+    except Exception as e:
+        output_manager.print_wrapper(f"\nError during Gemini API call: {str(e)}")
+        raise
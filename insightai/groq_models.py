@@ -1,25 +1,61 @@
 import os
 import time
+import groq
 from groq import Groq
-import tiktoken
+import httpx
 
 try:
-    from . import output_manager
+    from . import models, output_manager
 except ImportError:
-    import output_manager
+    import models, output_manager
 
 output_manager = output_manager.OutputManager()
 
+def create_client(api_key, base_url, pool_limits):
+    """Build a Groq client with a keep-alive connection pool. Called once per key by models.client_registry."""
+    http_client_class = getattr(groq, 'DefaultHttpxClient', httpx.Client)
+    http_client = http_client_class(limits=httpx.Limits(**pool_limits))
+    return Groq(api_key=api_key, base_url=base_url, http_client=http_client)
+
 def init():
-    """Initialize Groq client with API key."""
+    """Get the shared Groq client for the configured API key."""
     API_KEY = os.environ.get('GROQ_API_KEY')
     if not API_KEY:
         output_manager.print_wrapper("Warning: GROQ_API_KEY environment variable not found.")
         return None
     
-    client = Groq()
-    client.api_key = API_KEY
-    return client
+    return models.get_client('groq')
+
+def create_async_client(api_key, base_url, pool_limits):
+    """Build an AsyncGroq client with a keep-alive connection pool bound to the running loop."""
+    http_client_class = getattr(groq, 'DefaultAsyncHttpxClient', httpx.AsyncClient)
+    http_client = http_client_class(limits=httpx.Limits(**pool_limits))
+    return groq.AsyncGroq(api_key=api_key, base_url=base_url, http_client=http_client)
+
+def ainit():
+    """Get the shared async Groq client for the configured API key."""
+    API_KEY = os.environ.get('GROQ_API_KEY')
+    if not API_KEY:
+        output_manager.print_wrapper("Warning: GROQ_API_KEY environment variable not found.")
+        return None
+
+    return models.get_async_client('groq')
+
+def _call_result(response, messages, elapsed_time):
+    if not response or not response.choices:
+        raise ValueError("Empty response from Groq API")
+
+    content = response.choices[0].message.content.strip()
+    prompt_tokens = response.usage.prompt_tokens
+    completion_tokens = response.usage.completion_tokens
+    total_tokens = response.usage.total_tokens
+    tokens_per_second = completion_tokens / elapsed_time if elapsed_time > 0 else 0
+
+    return (
+        content, messages, prompt_tokens, 
+        completion_tokens, total_tokens, 
+        elapsed_time, tokens_per_second
+    )
 
 def llm_call(messages: str, model: str, temperature: str, max_tokens: str):  
     """Make a non-streaming call to Groq API."""
@@ -38,31 +74,82 @@ def llm_call(messages: str, model: str, temperature: str, max_tokens: str):
         end_time = time.time()
         elapsed_time = end_time - start_time
 
-        if not response or not response.choices:
-            raise ValueError("Empty response from Groq API")
+        return _call_result(response, messages, elapsed_time)
+        
+    except Exception as e:
+        output_manager.print_wrapper(f"Error during Groq API call: {str(e)}")
+        raise
 
-        content = response.choices[0].message.content.strip()
-        prompt_tokens = response.usage.prompt_tokens
-        completion_tokens = response.usage.completion_tokens
-        total_tokens = response.usage.total_tokens
-        tokens_per_second = completion_tokens / elapsed_time if elapsed_time > 0 else 0
+async def allm_call(messages: str, model: str, temperature: str, max_tokens: str):
+    """Make a non-streaming call to Groq API with the async client."""
+    client = ainit()
+    if client is None:
+        raise EnvironmentError("Failed to initialize Groq client")
 
-        return (
-            content, messages, prompt_tokens, 
-            completion_tokens, total_tokens, 
-            elapsed_time, tokens_per_second
+    try:
+        start_time = time.time()
+        response = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
         )
-        
+        end_time = time.time()
+        elapsed_time = end_time - start_time
+
+        return _call_result(response, messages, elapsed_time)
+
     except Exception as e:
         output_manager.print_wrapper(f"Error during Groq API call: {str(e)}")
         raise
 
+def _collect_chunk(chunk, stats, collected_messages):
+    """Accumulate one streamed chunk, echoing any content to the console."""
+    if not chunk:
+        return
+
+    # Groq reports usage on the final chunk, under x_groq in older API versions
+    usage = getattr(chunk, 'usage', None) or getattr(getattr(chunk, 'x_groq', None), 'usage', None)
+    if usage:
+        stats.add_usage(usage.prompt_tokens, usage.completion_tokens)
+
+    if not chunk.choices:
+        return
+        
+    choice = chunk.choices[0]
+    
+    # Handle delta content
+    if hasattr(choice, 'delta') and hasattr(choice.delta, 'content'):
+        content = choice.delta.content
+        if content:
+            stats.emit(content)
+            collected_messages.append(content)
+
+def _stream_result(messages, stats, collected_messages):
+    end_time = time.time()
+    elapsed_time = end_time - stats.start_time
+    output_manager.print_wrapper("")
+
+    # Combine collected messages
+    full_reply_content = ''.join(collected_messages)
+
+    # Token counting: provider-reported usage, local tokenization as a fallback
+    prompt_tokens_used, completion_tokens_used = stats.resolve_usage(messages, full_reply_content)
+
+    # Calculate totals
+    total_tokens_used = prompt_tokens_used + completion_tokens_used
+    tokens_per_second = (completion_tokens_used / elapsed_time) if elapsed_time > 0 else 0
+
+    return (
+        full_reply_content, messages, prompt_tokens_used,
+        completion_tokens_used, total_tokens_used,
+        elapsed_time, tokens_per_second, stats.time_to_first_token
+    )
+
 def llm_stream(log_and_call_manager, chain_id: str, messages: str, model: str, 
-               temperature: str, max_tokens: str, tools: str = None):  
+               temperature: str, max_tokens: str, tools: str = None, on_token=None):
     """Make a streaming call to Groq API."""
-    collected_chunks = []
     collected_messages = []
-    full_reply_content = ""
 
     client = init()
     if client is None:
@@ -70,7 +157,7 @@ def llm_stream(log_and_call_manager, chain_id: str, messages: str, model: str,
 
     try:
         # Start streaming request
-        start_time = time.time()
+        stats = models.StreamStats(on_token)
         stream = client.chat.completions.create(
             model=model, 
             messages=messages,
@@ -79,52 +166,46 @@ def llm_stream(log_and_call_manager, chain_id: str, messages: str, model: str,
             stream=True,
         )
 
-        # Process stream
-        for chunk in stream:
-            if not chunk or not chunk.choices:
-                continue
-                
-            collected_chunks.append(chunk)
-            choice = chunk.choices[0]
-            
-            # Handle delta content
-            if hasattr(choice, 'delta') and hasattr(choice.delta, 'content'):
-                content = choice.delta.content
-                if content:
-                    collected_messages.append(content)
-                    output_manager.print_wrapper(content, end='', flush=True)
+        # Process stream; a hedge attempt that lost is stopped mid-stream, so always release the connection
+        try:
+            for chunk in stream:
+                _collect_chunk(chunk, stats, collected_messages)
+        finally:
+            stream.close()
 
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        output_manager.print_wrapper("")
+        return _stream_result(messages, stats, collected_messages)
+        
+    except Exception as e:
+        output_manager.print_wrapper(f"Error during Groq API call: {str(e)}")
+        raise
 
-        # Combine collected messages
-        full_reply_content = ''.join(collected_messages)
+async def allm_stream(log_and_call_manager, chain_id: str, messages: str, model: str,
+                      temperature: str, max_tokens: str, tools: str = None, on_token=None):
+    """Make a streaming call to Groq API with the async client."""
+    collected_messages = []
 
-        # Token counting
-        completion_tokens_used = len(collected_chunks)
-        encoding = tiktoken.encoding_for_model("gpt-4")
-        
-        # Count prompt tokens
-        prompt_tokens_used = 3  # Base tokens
-        for message in messages:
-            prompt_tokens_used += 3  # Per message
-            for key, value in message.items():
-                if isinstance(value, str):
-                    prompt_tokens_used += len(encoding.encode(value))
-                if key == "name":
-                    prompt_tokens_used += 1
-
-        # Calculate totals
-        total_tokens_used = prompt_tokens_used + completion_tokens_used
-        tokens_per_second = (completion_tokens_used / elapsed_time) if elapsed_time > 0 else 0
-
-        return (
-            full_reply_content, messages, prompt_tokens_used,
-            completion_tokens_used, total_tokens_used,
-            elapsed_time, tokens_per_second
+    client = ainit()
+    if client is None:
+        raise EnvironmentError("Failed to initialize Groq client")
+
+    try:
+        stats = models.StreamStats(on_token)
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
         )
-        
+
+        try:
+            async for chunk in stream:
+                _collect_chunk(chunk, stats, collected_messages)
+        finally:
+            await stream.close()
+
+        return _stream_result(messages, stats, collected_messages)
+
     except Exception as e:
         output_manager.print_wrapper(f"Error during Groq API call: {str(e)}")
-        raise
\ No newline at end of file
+        raise
@@ -6,7 +6,6 @@ except ImportError:
     pass
 
 from contextlib import redirect_stdout
-import io
 import re
 import time
 import pandas as pd
@@ -14,14 +13,18 @@ import warnings
 import traceback
 import sys
 import json
+import threading
+import contextvars
+import weakref
+import concurrent.futures
 warnings.filterwarnings('ignore')
 
 try:
     # Attempt package-relative import
-    from . import models, prompts, func_calls, reg_ex, log_manager, output_manager, utils
+    from . import models, prompts, func_calls, reg_ex, log_manager, output_manager, utils, batch, tracing, metrics, exec_pool, exec_cache, code_validator, repair_rules, output_capture, profiler
 except ImportError:
     # Fall back to script-style import
-    import models, prompts, func_calls, reg_ex, log_manager, output_manager, utils
+    import models, prompts, func_calls, reg_ex, log_manager, output_manager, utils, batch, tracing, metrics, exec_pool, exec_cache, code_validator, repair_rules, output_capture, profiler
 
 class InsightAI:
     def __init__(self, df: pd.DataFrame = None,
@@ -32,7 +35,14 @@ class InsightAI:
              df_ontology: bool = False,
              generate_report: bool = False,
              report_questions: int = 5,
-             diagram: bool = False):  # Add new parameter
+             diagram: bool = False,
+             batch_mode: bool = False,
+             exec_workers: int = 0,
+             exec_timeout: float = None,
+             exec_memory_limit = None,
+             code_candidates: int = None,
+             candidate_selection: str = None,
+             profile_code: bool = False):
         
         if db_path:
             import sqlite3
@@ -49,6 +59,38 @@ class InsightAI:
         self.report_questions = []
         self.report_answers = []
         self.diagram_enabled = diagram
+        # Submit the report's Code Generator calls as one provider batch job
+        self.batch_mode = batch_mode
+        # Limits for each execution of generated code: seconds, and bytes or a size string like '2GB'
+        self.exec_timeout = exec_timeout or float(os.getenv('INSIGHTAI_EXEC_TIMEOUT', 0)) or None
+        self.exec_memory_limit = exec_pool.parse_size(exec_memory_limit or os.getenv('INSIGHTAI_EXEC_MEMORY_LIMIT'))
+        # Run generated code in pre-warmed worker processes instead of in this process. Limits can
+        # only be enforced on a separate process, so setting one also enables a worker.
+        if exec_workers or self.exec_timeout or self.exec_memory_limit:
+            self.exec_pool = exec_pool.get_pool(max(exec_workers, 1))
+        else:
+            self.exec_pool = None
+        self.exec_figures = []
+        # Generate several versions of the code at once and keep the first (or best ranked) that runs.
+        # Arguments take precedence over INSIGHTAI_CODE_CANDIDATES and INSIGHTAI_CANDIDATE_SELECTION.
+        self.CANDIDATE_SELECTIONS = ('first', 'rank')
+        self.code_candidates = code_candidates if code_candidates is not None else int(os.getenv('INSIGHTAI_CODE_CANDIDATES', 1))
+        if self.code_candidates < 1:
+            raise ValueError(f"code_candidates must be at least 1, got {self.code_candidates}")
+        self.candidate_selection = candidate_selection or os.getenv('INSIGHTAI_CANDIDATE_SELECTION', 'first')
+        if self.candidate_selection not in self.CANDIDATE_SELECTIONS:
+            raise ValueError(f"Unknown candidate_selection '{self.candidate_selection}', "
+                             f"expected one of {', '.join(self.CANDIDATE_SELECTIONS)}")
+        self.CANDIDATE_TEMPERATURE_STEP = 0.3
+        # Workers the candidates race in, started now so they are warm by the first question. The
+        # shared pool is left at its own size; runs that lose a race are cancelled, and their workers replaced.
+        self.candidate_pool = None
+        if self.code_candidates > 1:
+            self.candidate_pool = exec_pool.ExecPool(
+                self.code_candidates, figure_dir=self.exec_pool.figure_dir if self.exec_pool is not None else None)
+            weakref.finalize(self, self.candidate_pool.shutdown)
+        # Time each top-level statement of the generated code, and track its peak memory
+        self.profile_code = profile_code or profiler.profiling_enabled()
 
         # FIXED: Dynamic API key checking based on LLM config
         self._check_required_api_keys()
@@ -65,6 +107,10 @@ class InsightAI:
         
         # Results of the code execution
         self.code_exec_results = None
+        # What the output capture of the last execution omitted or summarized
+        self.code_exec_truncation = None
+        # Per-statement profile of the last execution, when profile_code is on
+        self.code_exec_profile = None
 
         # Debug and exploratory modes
         self.debug = debug
@@ -99,7 +145,10 @@ class InsightAI:
             "code_generator_user_df",
             "code_generator_user_gen",
             "error_corector_system",
+            "execution_timeout_hint",
+            "execution_memory_hint",
             "code_debugger_system",
+            "code_optimizer_system",
             "code_ranker_system",
             "solution_summarizer_system",
             "dataset_categorizer_system",
@@ -142,6 +191,8 @@ class InsightAI:
         # LLM calls
         self.llm_call = models.llm_call
         self.llm_stream = models.llm_stream
+        self.allm_call = models.allm_call
+        self.allm_stream = models.allm_stream
 
         # Logging
         self.token_cost_dict = {
@@ -196,6 +247,13 @@ class InsightAI:
         self.log_and_call_manager = log_manager.LogAndCallManager(self.token_cost_dict)
         self.chain_id = None
 
+        # Serve Prometheus metrics when INSIGHTAI_METRICS_PORT is set
+        metrics.start_http_server_from_env()
+
+        # Cheap DataFrame snapshots in execute_code need Copy-on-Write, opt-in before pandas 3
+        if os.getenv('INSIGHTAI_COPY_ON_WRITE', '0').lower() in ('1', 'true', 'yes'):
+            utils.enable_copy_on_write()
+
         # Messages lists
         self.pre_eval_messages = [{"role": "system", "content": self.expert_selector_system}]
         self.select_analyst_messages = [{"role": "system", "content": self.analyst_selector_system}]
@@ -243,6 +301,16 @@ class InsightAI:
     ### Util Functions ###
     ######################
 
+    @property
+    def chain_id(self):
+        return self._chain_id
+
+    @chain_id.setter
+    def chain_id(self, chain_id):
+        # Spans opened from now on (tracing.traced stages, provider calls) belong to this chain
+        self._chain_id = chain_id
+        tracing.set_chain(chain_id)
+
     def reset_messages_and_logs(self):
         self.pre_eval_messages = [{"role": "system", "content": self.expert_selector_system}]
         self.select_analyst_messages = [{"role": "system", "content": self.analyst_selector_system}]
@@ -268,6 +336,7 @@ class InsightAI:
     ### Eval Functions ###
     ######################
     
+    @tracing.traced()
     def select_expert(self, pre_eval_messages, file_type):
         '''Call the Expert Selector'''
         agent = 'Expert Selector'
@@ -307,6 +376,7 @@ class InsightAI:
             return query.strip()
         return None
 
+    @tracing.traced()
     def select_analyst(self, select_analyst_messages):
         '''Call the Analyst Selector'''
         agent = 'Analyst Selector'
@@ -336,6 +406,7 @@ class InsightAI:
             
         return response
     
+    @tracing.traced()
     def taskmaster(self, question, df_columns):
         plan = None
         analyst = None
@@ -474,17 +545,22 @@ class InsightAI:
                 example_code = self.default_example_output_sql if file_type == '.db' else self.default_example_output_df
 
             # Generate and execute code
-            code = self.generate_code(analyst, question, plan, self.code_messages, example_code)
+            candidate_result = None
+            if file_type == '.csv' and self.code_candidates > 1:
+                code, candidate_result = self.race_code_candidates(analyst, question, plan, self.code_messages, example_code)
+            else:
+                code = self.generate_code(analyst, question, plan, self.code_messages, example_code)
             
             if file_type == '.db':
                 answer, results = self.execute_sql(code, plan, question)
             else:
-                answer, results, code = self.execute_code(analyst, code, plan, question, self.code_messages)
+                answer, results, code = self.execute_code(analyst, code, plan, question, self.code_messages, candidate_result)
 
             # Display results
             self.output_manager.display_results(
                 self.df if file_type == '.csv' else None,
-                answer, code, None, False
+                answer, code, None, False,
+                self.code_exec_profile if file_type == '.csv' else None
             )
             
             self.log_and_call_manager.print_summary_to_terminal()
@@ -497,6 +573,7 @@ class InsightAI:
     ### Code Functions ###
     ######################
             
+    @tracing.traced()
     def debug_code(self,analyst,code,question):
         agent = 'Code Debugger'
         # Initialize the messages list with a system message containing the task prompt
@@ -514,17 +591,52 @@ class InsightAI:
         self.output_manager.display_tool_end(agent)
 
         return debugged_code
-    def execute_code(self, analyst, code, plan, original_question, code_messages):
+
+    @tracing.traced()
+    def optimize_code(self, analyst, code, question, profile=None):
+        """Ask the Code Generator for a faster, leaner version of code, pointing it at its most expensive statements.
+
+        `profile` is a profiler.CodeProfile of the code, by default that of the last execution (needs profile_code).
+        """
+        agent = 'Code Generator'
+        profile = profile or self.code_exec_profile
+        if profile is None:
+            raise ValueError("No profile of the code to optimize; enable profile_code and run it first")
+        optimize_messages = [{"role": "user", "content": self.code_optimizer_system.format(code, question, profile.format())}]
+
+        using_model,provider = models.get_model_name(agent)
+
+        self.output_manager.display_tool_start(agent,using_model)
+
+        llm_response = self.llm_stream(self.log_and_call_manager, optimize_messages, agent=agent, chain_id=self.chain_id)
+
+        optimized_code = self._extract_code(llm_response,analyst,provider)
+        self.output_manager.display_tool_end(agent)
+
+        return optimized_code
+    @tracing.traced()
+    def execute_code(self, analyst, code, plan, original_question, code_messages, candidate_result=None):
         agent = 'Code Executor'
         # Initialize error correction counter
         error_corrections = 0
 
-        # Create a copy of the original self.df
+        # Figures left open by code run in a worker process, saved as PNG files
+        self.exec_figures = []
+        self.code_exec_profile = None
+
+        # Snapshot the original self.df (a lazy copy under pandas Copy-on-Write)
+        original_df = None
         if self.df is not None:
-            original_df = self.df.copy()
+            original_df = utils.snapshot_dataframe(self.df)
+
+        # Errors fixed by a local repair rule instead of the Error Corrector
+        local_repairs = 0
 
-        # Redirect standard output to a StringIO buffer
-        with redirect_stdout(io.StringIO()) as output:
+        # Messages about the run are printed here, not into the captured results
+        console = sys.stdout
+
+        # Redirect standard output to a buffer that keeps the head and tail of long output
+        with redirect_stdout(output_capture.BoundedOutput()) as output:
             # Try to execute the code and handle errors
             while error_corrections < self.MAX_ERROR_CORRECTIONS:
                 try:
@@ -533,26 +645,57 @@ class InsightAI:
 
                     # Execute the code
                     if code is not None:
-                        local_vars = {'df': self.df} # Create a local variable to store the dataframe
-                        exec(code, local_vars) # Execute the code
-                        self.df = local_vars['df'] # Update the dataframe with the local variable
+                        # Fix or reject bad column references without running the code
+                        if self.df is not None and code_validator.validation_enabled():
+                            with redirect_stdout(console):
+                                code = self._validate_code(code)
+                        self._run_code(analyst, code, original_df, candidate_result)
+                        candidate_result = None
 
                         # Remove examples from the messages list to minimize the number of tokens used
                         code_messages = self._remove_examples(code_messages)
                     break
                 except Exception as error:
-                    # Capture the full traceback
-                    exc_type, exc_value, tb = sys.exc_info()
-                    full_traceback = traceback.format_exc()
-                    # Filter the traceback
-                    exec_traceback = self.filter_exec_traceback(full_traceback, exc_type.__name__, str(exc_value)) 
-
-                    # Increment the error corrections counter
-                    error_corrections += 1
+                    if isinstance(error, exec_pool.CodeExecutionError):
+                        # Raised in a worker process, which sends its own traceback
+                        exception_type = error.exception_type
+                        full_traceback = error.traceback
+                        exec_traceback = self.filter_exec_traceback(error.traceback, error.exception_type, error.exception_value)
+                        # Ask for a faster or leaner rewrite rather than a bug fix
+                        if isinstance(error, exec_pool.ExecutionTimeout):
+                            exec_traceback += '\n' + self.execution_timeout_hint.format(error.timeout)
+                        elif isinstance(error, exec_pool.ExecutionMemoryExceeded):
+                            exec_traceback += '\n' + self.execution_memory_hint.format(round(error.memory_limit / 2**20))
+                    else:
+                        # Capture the full traceback
+                        exc_type, exc_value, tb = sys.exc_info()
+                        exception_type = exc_type.__name__
+                        full_traceback = traceback.format_exc()
+                        # Filter the traceback
+                        exec_traceback = self.filter_exec_traceback(full_traceback, exc_type.__name__, str(exc_value)) 
 
                     # Reset df to the original state before trying again
                     if self.df is not None:
-                        self.df = original_df.copy()
+                        self.df = utils.snapshot_dataframe(original_df)
+
+                    # Mechanical errors (removed pandas APIs, unparsed dates...) are rewritten locally
+                    repaired = None
+                    if local_repairs < repair_rules.MAX_LOCAL_REPAIRS and repair_rules.repairs_enabled():
+                        repaired = repair_rules.repair(code, exception_type, full_traceback)
+                    if repaired is not None:
+                        rule, code = repaired
+                        local_repairs += 1
+                        metrics.code_repairs.inc(rule=rule)
+                        # Record the rewrite as an error correction, so a later error is shown with the code that raised it
+                        code_messages.append({"role": "user", "content": self.error_corector_system.format(exec_traceback)})
+                        code_messages.append({"role": "assistant", "content": f"```python\n{code}\n```"})
+                        with redirect_stdout(console):
+                            self.output_manager.display_system_messages(f"Applied repair rule '{rule}', retrying")
+                        continue
+
+                    # Increment the error corrections counter
+                    error_corrections += 1
+                    metrics.error_corrections.inc(analyst=analyst)
 
                     code, code_messages = self.correct_code_errors(exec_traceback, error_corrections, code_messages, analyst)
               
@@ -562,6 +705,23 @@ class InsightAI:
         # Store the results in a class variable so it can be appended to the subsequent messages list
         self.code_exec_results = results
 
+        # Record what was cut or summarized to keep the prompts small
+        self.code_exec_truncation = output.truncation()
+        if self.code_exec_truncation['omitted_chars'] or self.code_exec_truncation['summarized_objects']:
+            if self.code_exec_truncation['omitted_chars']:
+                metrics.exec_output_omitted.inc(self.code_exec_truncation['omitted_chars'])
+            self.output_manager.display_system_messages(
+                f"Execution output trimmed: kept {self.code_exec_truncation['kept_chars']} of "
+                f"{self.code_exec_truncation['total_chars']} characters, "
+                f"{self.code_exec_truncation['summarized_objects']} DataFrame/Series printed as summaries"
+            )
+
+        if self.exec_figures:
+            self.output_manager.display_system_messages(f"Figures saved to: {', '.join(self.exec_figures)}")
+
+        if self.code_exec_profile is not None:
+            self.log_and_call_manager.record_code_profile(self.chain_id, code, self.code_exec_profile)
+
         summary = self.summarise_solution(original_question, plan, results)
 
         # Generate Mermaid diagram if enabled
@@ -572,17 +732,194 @@ class InsightAI:
             # Display a message about the diagram
             self.output_manager.display_system_messages("Mermaid diagram generated for the analysis flow")
 
-        # Reset the StringIO buffer
-        output.truncate(0)
-        output.seek(0)
+        # Release the captured output
+        output.clear()
 
         return summary, results, code
 
+    def _validate_code(self, code):
+        """Check the code's column references against self.df. Returns the code with misspellings fixed."""
+        with tracing.span('validate_code'):
+            result = code_validator.validate_code(code, self.df)
+        if result.problems:
+            metrics.code_validations.inc(result='rejected')
+            raise code_validator.CodeValidationError(result.problems)
+        if result.fixes:
+            metrics.code_validations.inc(result='fixed')
+            fixes = ', '.join(f"'{fix.old}' -> '{fix.new}' (line {fix.lineno})" for fix in result.fixes)
+            self.output_manager.display_system_messages(f"Fixed column references: {fixes}")
+        else:
+            metrics.code_validations.inc(result='ok')
+        return result.code
+
+    def _run_code(self, analyst, code, original_df, result=None):
+        """Run generated code on self.df, or replay it from the execution cache if it already ran on this data.
+
+        `result` is the ExecResult of a run already done by race_code_candidates, which is applied as is.
+        """
+        if result is not None:
+            print(result.stdout, end='')
+            self.df = result.df
+            self.exec_figures.extend(result.figures)
+            self.code_exec_profile = result.profile
+            return
+
+        cache = exec_cache.get_cache()
+        key = cache.make_key(code, self.df) if cache is not None else None
+        if key is not None:
+            cached = cache.get(key, original_df)
+            metrics.exec_cache_lookups.inc(result='miss' if cached is None else 'hit')
+            if cached is not None:
+                print(cached.stdout, end='')
+                self.df = cached.df
+                self.exec_figures.extend(cached.figures)
+                return
+
+        figure_dir = self.exec_pool.figure_dir if self.exec_pool is not None else os.getenv('INSIGHTAI_FIGURE_DIR', exec_pool.FIGURE_DIR)
+        # File timestamps come from a coarse clock and can trail time.time() by a tick
+        started = time.time() - 0.05
+        figures = []
+        output = output_capture.BoundedOutput()
+        try:
+            with redirect_stdout(output):
+                if self.exec_pool is not None:
+                    # Run in a worker process; its stdout is echoed into the buffer
+                    with tracing.span('exec'), metrics.code_exec.time(analyst=analyst):
+                        exec_result = self.exec_pool.run(code, self.df, self.exec_timeout, self.exec_memory_limit,
+                                                         profile=self.profile_code)
+                    self.df = exec_result.df
+                    figures.extend(exec_result.figures)
+                    self.code_exec_profile = exec_result.profile
+                else:
+                    local_vars = output_capture.exec_namespace(self.df) # Create a local variable to store the dataframe
+                    with tracing.span('exec'), metrics.code_exec.time(analyst=analyst):
+                        if self.profile_code:
+                            self.code_exec_profile = profiler.profile_exec(code, local_vars)
+                        else:
+                            exec(code, local_vars) # Execute the code
+                    self.df = local_vars['df'] # Update the dataframe with the local variable
+        finally:
+            # Pass the output on to execute_code's buffer, including that of a failed run
+            print(output.getvalue(), end='')
+            if isinstance(sys.stdout, output_capture.BoundedOutput):
+                sys.stdout.summarized += output.summarized
+
+        self.exec_figures.extend(figures)
+        if key is not None:
+            figures = sorted(set(figures) | set(exec_cache.new_files(figure_dir, started)))
+            cache.put(key, original_df, output.getvalue(), self.df, figures)
+
+    @tracing.traced()
     def generate_code(self, analyst, question, plan, code_messages, example_code):
         """Generate code based on analyst type and input parameters."""
         agent = 'Code Generator'
         using_model, provider = models.get_model_name(agent)
-        
+
+        self._prepare_code_messages(analyst, question, plan, code_messages, example_code)
+
+        # Generate code using LLM
+        self.output_manager.display_tool_start(agent, using_model)
+        llm_response = self.llm_stream(
+            self.log_and_call_manager,
+            code_messages,
+            agent=agent,
+            chain_id=self.chain_id
+        )
+
+        return self._extract_generated_code(analyst, provider, code_messages, llm_response)
+
+    @tracing.traced()
+    def race_code_candidates(self, analyst, question, plan, code_messages, example_code):
+        """Generate self.code_candidates versions of the code concurrently and run them in parallel workers.
+
+        Candidates after the first use increasing temperatures. Returns (code, ExecResult) for the
+        first candidate that runs without error, or with candidate_selection='rank' for the best
+        ranked success; the other runs are cancelled. If none succeeds, returns the first
+        candidate's code and None, and execute_code takes it through the usual error correction.
+        """
+        agent = 'Code Generator'
+        using_model, provider = models.get_model_name(agent)
+
+        self._prepare_code_messages(analyst, question, plan, code_messages, example_code)
+        self.output_manager.display_tool_start(agent, using_model)
+
+        pool = self.candidate_pool
+        messages = list(code_messages)
+        df = self.df
+        cancel = threading.Event()
+        responses = {}
+
+        def run_candidate(index):
+            temperature = None if index == 0 else min(1.0, self.CANDIDATE_TEMPERATURE_STEP * index)
+            response = self.llm_call(self.log_and_call_manager, messages, agent=agent, chain_id=self.chain_id,
+                                     temperature=temperature)
+            responses[index] = response
+            if cancel.is_set():
+                raise exec_pool.ExecutionCancelled()
+            code = self._extract_code(response, analyst, provider)
+            if df is not None and code_validator.validation_enabled():
+                validation = code_validator.validate_code(code, df)
+                if validation.problems:
+                    raise code_validator.CodeValidationError(validation.problems)
+                code = validation.code
+            with tracing.span('exec', candidate=index), metrics.code_exec.time(analyst=analyst):
+                result = pool.run(code, df, self.exec_timeout, self.exec_memory_limit, cancel=cancel, echo=False,
+                                  profile=self.profile_code)
+            return index, response, code, result
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.code_candidates,
+                                                         thread_name_prefix='insightai-candidate')
+        futures = [executor.submit(contextvars.copy_context().run, run_candidate, index)
+                   for index in range(self.code_candidates)]
+        successes = []
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    successes.append(future.result())
+                except exec_pool.ExecutionCancelled:
+                    metrics.code_candidates.inc(outcome='cancelled')
+                    continue
+                except Exception:
+                    metrics.code_candidates.inc(outcome='failed')
+                    if not responses and all(other.done() for other in futures):
+                        # Not a single Code Generator call succeeded
+                        raise
+                    continue
+                if self.candidate_selection != 'rank':
+                    break
+        finally:
+            # Stop the remaining runs; Code Generator calls still in flight finish in the background
+            cancel.set()
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+        if not successes:
+            # Hand the first candidate to execute_code, whose error correction loop takes over
+            code = self._extract_generated_code(analyst, provider, code_messages, responses[min(responses)])
+            self.output_manager.display_tool_end(agent)
+            return code, None
+
+        winner = successes[0]
+        if len(successes) > 1:
+            ranks = []
+            for _, _, code, result in successes:
+                rank = self.rank_code(result.stdout, code, question)
+                ranks.append(int(rank) if rank.isdigit() else 0)
+            winner = successes[ranks.index(max(ranks))]
+        index, response, code, result = winner
+        metrics.code_candidates.inc(outcome='selected')
+        if len(successes) > 1:
+            metrics.code_candidates.inc(len(successes) - 1, outcome='succeeded')
+
+        self._extract_generated_code(analyst, provider, code_messages, response)
+        self.output_manager.display_system_messages(
+            f"Selected code candidate {index + 1} of {self.code_candidates} ({len(successes)} ran successfully)")
+        self.output_manager.display_tool_end(agent)
+        return code, result
+
+    def _prepare_code_messages(self, analyst, question, plan, code_messages, example_code):
+        """Set the Code Generator system prompt and append the user prompt for the analyst type."""
         if analyst == 'SQL Analyst':
             schema = self.get_db_schema()
             if hasattr(self, 'code_generator_system_sql'):
@@ -681,15 +1018,8 @@ class InsightAI:
                     )
                 })
 
-        # Generate code using LLM
-        self.output_manager.display_tool_start(agent, using_model)
-        llm_response = self.llm_stream(
-            self.log_and_call_manager,
-            code_messages,
-            agent=agent,
-            chain_id=self.chain_id
-        )
-        
+    def _extract_generated_code(self, analyst, provider, code_messages, llm_response):
+        """Record the Code Generator response in the message history and extract the code from it."""
         # Add response to message history
         code_messages.append({"role": "assistant", "content": llm_response})
         
@@ -716,6 +1046,7 @@ class InsightAI:
 
         return filtered_traceback
     
+    @tracing.traced()
     def correct_code_errors(self, error, error_corrections, code_messages, analyst):
         agent = 'Error Corrector'
 
@@ -738,6 +1069,7 @@ class InsightAI:
 
         return code, code_messages
 
+    @tracing.traced()
     def rank_code(self,results, code, question):
         agent = 'Code Ranker'
         # Initialize the messages list with a user message containing the task prompt
@@ -759,6 +1091,7 @@ class InsightAI:
     ## Summarise the solution ##
     ############################
 
+    @tracing.traced()
     def summarise_solution(self, original_question, plan, results):
         agent = 'Solution Summarizer'
 
@@ -774,6 +1107,7 @@ class InsightAI:
         self.conn = sqlite3.connect(db_path)
         self.cur = self.conn.cursor()
         
+    @tracing.traced()
     def execute_sql(self, query: str, plan: str, question: str):
         """Execute SQL queries and format results with proper schema handling.
         
@@ -801,8 +1135,9 @@ class InsightAI:
             for q in queries:
                 try:
                     # Execute query
-                    self.cur.execute(q)
-                    result = self.cur.fetchall()
+                    with metrics.sql_query.time():
+                        self.cur.execute(q)
+                        result = self.cur.fetchall()
                     
                     if "pragma" in q.lower():
                         # Format PRAGMA schema results
@@ -836,6 +1171,7 @@ class InsightAI:
             self.output_manager.display_error(f"SQL Execution Error: {str(e)}")
             return None, None
 
+    @tracing.traced()
     def get_db_schema(self):
         """Extract and format database schema."""
         try:
@@ -861,6 +1197,7 @@ class InsightAI:
         except Exception as e:
             print(f"Error getting schema: {str(e)}")
             return None
+    @tracing.traced()
     def categorize_dataset(self, df_info=None):
         """Identify the real-world category and domain of the dataset."""
         import json
@@ -894,6 +1231,7 @@ class InsightAI:
         
         return {"domain": "Unknown", "category": "Unknown", "use_cases": [], "description": "Could not determine dataset category"}
 
+    @tracing.traced()
     def generate_questions(self, num_questions=5):
         """Generate insightful questions based on the dataset category."""
         import json
@@ -935,6 +1273,9 @@ class InsightAI:
         Automatically captures and saves any visualizations created during analysis.
         """
         import time
+
+        if self.batch_mode:
+            return self.process_report_questions_batch()
         
         if not self.report_questions:
             self.report_questions = self.generate_questions()
@@ -972,10 +1313,14 @@ class InsightAI:
                 example_code = self.default_example_output_df if analyst == 'Data Analyst DF' else self.default_example_output_gen
                 
                 # Generate code
-                code = self.generate_code(analyst, question, plan, self.code_messages, example_code)
+                candidate_result = None
+                if self.code_candidates > 1:
+                    code, candidate_result = self.race_code_candidates(analyst, question, plan, self.code_messages, example_code)
+                else:
+                    code = self.generate_code(analyst, question, plan, self.code_messages, example_code)
                 
                 # Execute code
-                answer, results, code = self.execute_code(analyst, code, plan, question, self.code_messages)
+                answer, results, code = self.execute_code(analyst, code, plan, question, self.code_messages, candidate_result)
             
             answers.append({
                 "question": question,
@@ -990,6 +1335,91 @@ class InsightAI:
         self.report_answers = answers
         return answers
 
+    def process_report_questions_batch(self):
+        """
+        Batch variant of process_report_questions. Every question is planned first, the Code Generator
+        prompts of all questions are then submitted as a single batch job, and the generated code is
+        executed question by question once the batch has finished.
+        """
+        if not self.report_questions:
+            self.report_questions = self.generate_questions()
+
+        agent = 'Code Generator'
+        file_type = '.db' if hasattr(self, 'conn') else '.csv'
+        original_chain_id = self.chain_id
+        prepared = []
+
+        # Step 1: plan each question and build its Code Generator prompt
+        for question in self.report_questions:
+            self.output_manager.display_system_messages(f"Planning question: {question}")
+
+            # Chain IDs are timestamps; keep them distinct when questions are planned within the same second
+            chain_id = int(time.time())
+            if prepared and chain_id <= prepared[-1]['chain_id']:
+                chain_id = prepared[-1]['chain_id'] + 1
+            self.chain_id = chain_id
+            self.reset_messages_and_logs()
+
+            if file_type == '.db':
+                analyst = 'SQL Analyst'
+                plan = None
+                example_code = self.default_example_output_sql
+            else:
+                analyst, plan, query_unknown, query_condition, requires_dataset, confidence = self.taskmaster(
+                    question, '' if self.df is None else self.df.columns.tolist()
+                )
+                example_code = self.default_example_output_df if analyst == 'Data Analyst DF' else self.default_example_output_gen
+
+            self._prepare_code_messages(analyst, question, plan, self.code_messages, example_code)
+            prepared.append({
+                "question": question,
+                "analyst": analyst,
+                "plan": plan,
+                "chain_id": chain_id,
+                "code_messages": self.code_messages
+            })
+
+        # Step 2: generate the code for all questions in one batch job
+        using_model, provider = models.get_model_name(agent)
+        self.output_manager.display_tool_start(agent, using_model)
+        responses = batch.run_batch(
+            self.log_and_call_manager,
+            agent,
+            [(item["chain_id"], item["code_messages"]) for item in prepared]
+        )
+        self.output_manager.display_tool_end(agent)
+
+        # Step 3: execute each question's code
+        answers = []
+        for item, llm_response in zip(prepared, responses):
+            question, analyst, plan = item["question"], item["analyst"], item["plan"]
+            self.output_manager.display_system_messages(f"Processing question: {question}")
+
+            self.chain_id = item["chain_id"]
+            self.code_messages = item["code_messages"]
+            self.code_exec_results = None
+
+            code = self._extract_generated_code(analyst, provider, self.code_messages, llm_response)
+
+            if file_type == '.db':
+                answer, results = self.execute_sql(code, plan, question)
+            else:
+                answer, results, code = self.execute_code(analyst, code, plan, question, self.code_messages)
+
+            answers.append({
+                "question": question,
+                "answer": answer,
+                "code": code,
+                "results": results
+            })
+
+        # Restore original chain ID
+        self.chain_id = original_chain_id
+
+        self.report_answers = answers
+        return answers
+
+    @tracing.traced()
     def compile_report(self):
         """Compile questions and answers into a professional markdown report."""
         import json
@@ -1034,9 +1464,10 @@ class InsightAI:
             from weasyprint import HTML
             import markdown
             
-            html = markdown.markdown(report_markdown, extensions=['tables', 'fenced_code'])
-            pdf_filename = f"data_analysis_report_{self.chain_id}.pdf"
-            HTML(string=html).write_pdf(pdf_filename)
+            with tracing.span('render_pdf'):
+                html = markdown.markdown(report_markdown, extensions=['tables', 'fenced_code'])
+                pdf_filename = f"data_analysis_report_{self.chain_id}.pdf"
+                HTML(string=html).write_pdf(pdf_filename)
             self.output_manager.display_system_messages(f"PDF report saved to {pdf_filename}")
         except ImportError:
             self.output_manager.display_system_messages("PDF conversion requires markdown and weasyprint libraries. Install them with: pip install markdown weasyprint")
@@ -1078,6 +1509,7 @@ class InsightAI:
         return report
         
 # Add to insightai.py class
+    @tracing.traced()
     def process_data_cleaning(self, question, df_columns):
         """
         Specialized agent flow for data cleaning and ML suggestion tasks
@@ -1256,6 +1688,7 @@ class InsightAI:
         )
 
         return summary
+    @tracing.traced()
     def generate_mermaid_diagram(self, summary, question, file_type):
         """
         Generate a Mermaid flowchart diagram based on the analysis flow and results.
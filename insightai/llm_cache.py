@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_FILE_PATH = 'insightai_llm_cache.db'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # 256 MB
+DEFAULT_TTL = 7 * 24 * 60 * 60  # One week
+
+class LLMCache:
+    """Content-addressed store of LLM responses backed by SQLite.
+
+    Entries are keyed by a canonical hash of everything that determines the response
+    (provider, model, temperature, max_tokens and the message list). The store is bounded
+    by total content size; the least recently used entries are evicted first.
+    """
+    def __init__(self, path=CACHE_FILE_PATH, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                provider TEXT,
+                model TEXT,
+                content TEXT,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                total_tokens INTEGER,
+                size INTEGER,
+                created_at REAL,
+                last_access REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+
+    @staticmethod
+    def make_key(provider, model, temperature, max_tokens, messages):
+        """Hash the request parameters into a stable cache key."""
+        payload = json.dumps(
+            {
+                'provider': provider,
+                'model': model,
+                'temperature': temperature,
+                'max_tokens': max_tokens,
+                'messages': messages,
+            },
+            sort_keys=True, separators=(',', ':'), default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached entry for a key, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, prompt_tokens, completion_tokens, total_tokens, created_at FROM responses WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is not None and self.ttl and now - row[4] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+
+        return {
+            'content': row[0],
+            'prompt_tokens': row[1],
+            'completion_tokens': row[2],
+            'total_tokens': row[3],
+        }
+
+    def put(self, key, provider, model, content, prompt_tokens, completion_tokens, total_tokens):
+        """Store a response and evict least recently used entries if over the size budget."""
+        now = time.time()
+        size = len(content.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, content, prompt_tokens, completion_tokens, total_tokens, size, now, now)
+            )
+            self._evict()
+
+    def _evict(self):
+        if self.ttl:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+
+        total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+
+        # Walk from the least recently used entry until enough space has been freed
+        to_delete = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC"):
+            if total_size <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            total_size -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _build_cache(path=None, max_bytes=None, ttl=None):
+    return LLMCache(
+        path or os.getenv('INSIGHTAI_LLM_CACHE_PATH', CACHE_FILE_PATH),
+        max_bytes if max_bytes is not None else int(os.getenv('INSIGHTAI_LLM_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+        ttl if ttl is not None else float(os.getenv('INSIGHTAI_LLM_CACHE_TTL', DEFAULT_TTL)),
+    )
+
+def enable_cache(path=None, max_bytes=None, ttl=None):
+    """Turn on the response cache for this process and return it."""
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = _build_cache(path, max_bytes, ttl)
+    return _cache
+
+def disable_cache():
+    """Turn off the response cache for this process."""
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = None
+
+def get_cache():
+    """Return the active cache, creating it on first use if INSIGHTAI_LLM_CACHE is set."""
+    global _cache
+    if _cache is None and os.getenv('INSIGHTAI_LLM_CACHE', '').lower() in ('1', 'true', 'yes'):
+        with _cache_lock:
+            if _cache is None:
+                _cache = _build_cache()
+    return _cache
+
+def is_cacheable(temperature, tools=None):
+    """Only deterministic calls without tool use are safe to serve from the cache."""
+    return not temperature and not tools
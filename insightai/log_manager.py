@@ -1,17 +1,26 @@
+import atexit
+import base64
 import json
 from json import JSONEncoder
 import logging
 from logging.handlers import RotatingFileHandler
 import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
 
 try:
     # Attempt package-relative import
-    from . import output_manager
+    from . import output_manager, log_store, tracing, metrics
 except ImportError:
     # Fall back to script-style import
-    import output_manager
+    import output_manager, log_store, tracing, metrics
 
-ORIGINAL_LOG_FILE_PATH = 'insightai_run_log.json'
+ORIGINAL_LOG_FILE_PATH = 'insightai_run_log.jsonl'
+BLOB_LOG_FILE_PATH = 'insightai_run_log_blobs.jsonl'  # Message bodies referenced by the run log
+LEGACY_LOG_FILE_PATH = 'insightai_run_log.json'  # JSON array written by earlier versions
 CONSOLIDATED_LOG_FILE_PATH = 'insightai_consolidated_log.json'
 
 # Initialize the JSON logger
@@ -43,26 +52,288 @@ class FlexibleJSONEncoder(JSONEncoder):
         obj_dict['__custom_class__'] = obj.__class__.__name__
         return obj_dict
 
+FSYNC_POLICIES = ('never', 'batch', 'always')
+
+class RunLogWriter:
+    """Appends run log entries to a JSON Lines file from a background thread.
+
+    write() only enqueues the entry; serialization and file I/O happen on the writer thread,
+    off the LLM call path. The queue is bounded, so a stalled disk slows callers down rather
+    than growing memory without limit. The fsync policy (INSIGHTAI_LOG_FSYNC) is 'never'
+    (leave it to the OS), 'batch' (after each drained batch of entries, the default) or
+    'always' (after every entry).
+
+    Messages are not written inline: each entry lists the hashes of its messages under
+    `message_refs`, and every distinct message body is appended once to the blob file,
+    compressed as set by INSIGHTAI_LOG_COMPRESSION. read_run_log() puts them back together.
+
+    Each batch is also recorded in the SQLite log store (see log_store.py) once it has been
+    written, unless the store is disabled with INSIGHTAI_LOG_STORE=0.
+    """
+    _TRUNCATE = object()
+    _STOP = object()
+
+    def __init__(self, path, blob_path=None, fsync=None, max_queue=None):
+        self.path = path
+        self.blob_path = blob_path or blob_log_path(path)
+        self.fsync = (fsync or os.getenv('INSIGHTAI_LOG_FSYNC', 'batch')).lower()
+        if self.fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{self.fsync}', expected one of {', '.join(FSYNC_POLICIES)}")
+        self._queue = queue.Queue(maxsize=max_queue or int(os.getenv('INSIGHTAI_LOG_QUEUE_SIZE', 10000)))
+        self._thread = None
+        self._lock = threading.Lock()
+        self._written_blobs = set()
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='insightai-log-writer', daemon=True)
+                    self._thread.start()
+
+    def write(self, entry):
+        """Queue an entry to be appended. Blocks only if the queue is full."""
+        self._ensure_started()
+        self._queue.put(entry)
+
+    def truncate(self):
+        """Empty the log file once every entry queued before this call has been written."""
+        self._ensure_started()
+        self._queue.put(self._TRUNCATE)
+
+    def flush(self):
+        """Wait until every queued entry has been written."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def close(self):
+        """Write out the queue and stop the writer thread."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+
+    def _run(self):
+        self._written_blobs = read_blob_hashes(self.blob_path)
+        log_file = open(self.path, 'a', encoding='utf-8')
+        blob_file = open(self.blob_path, 'a', encoding='utf-8')
+        try:
+            stop = False
+            while not stop:
+                items = [self._queue.get()]
+                # Drain whatever else is queued so it is written and flushed together
+                while True:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                written, bodies = [], {}
+                # Attribute the batch to the chain of its first entry
+                chain_id = next((item.get('chain_id') for item in items if isinstance(item, dict)), None)
+                try:
+                    with tracing.span('log_write', chain_id, entries=len(items)):
+                        try:
+                            codec = log_store.get_compression()
+                            for item in items:
+                                if item is self._STOP:
+                                    stop = True
+                                elif item is self._TRUNCATE:
+                                    log_file.close()
+                                    blob_file.close()
+                                    log_file = open(self.path, 'w', encoding='utf-8')
+                                    blob_file = open(self.blob_path, 'w', encoding='utf-8')
+                                    self._written_blobs.clear()
+                                else:
+                                    record = self._write_entry(log_file, blob_file, item, bodies, codec)
+                                    if record is not None:
+                                        written.append(record)
+                            # Blobs first, so a flushed entry never references a body that is not on disk
+                            for f in (blob_file, log_file):
+                                f.flush()
+                                if self.fsync == 'batch':
+                                    os.fsync(f.fileno())
+                        except OSError as error:
+                            print(f"Failed to write run log {self.path}: {error}", file=sys.stderr)
+                        self._record_in_store(written, bodies)
+                finally:
+                    for _ in items:
+                        self._queue.task_done()
+        finally:
+            log_file.close()
+            blob_file.close()
+
+    def _write_entry(self, log_file, blob_file, entry, bodies, codec):
+        """Write an entry and its new message bodies; returns the entry as written, or None."""
+        try:
+            refs, entry_bodies = log_store.split_messages(entry.get('messages'), FlexibleJSONEncoder)
+            record = {('message_refs' if key == 'messages' else key): (refs if key == 'messages' else value)
+                      for key, value in entry.items()}
+            line = json.dumps(record, cls=FlexibleJSONEncoder)
+        except (TypeError, ValueError) as error:
+            print(f"Skipping run log entry that cannot be serialized: {error}", file=sys.stderr)
+            return None
+
+        for digest, body in entry_bodies.items():
+            if digest not in self._written_blobs:
+                blob_file.write(json.dumps(encode_blob(digest, body, codec)) + '\n')
+                self._written_blobs.add(digest)
+        bodies.update(entry_bodies)
+        log_file.write(line + '\n')
+        if self.fsync == 'always':
+            for f in (blob_file, log_file):
+                f.flush()
+                os.fsync(f.fileno())
+        return record
+
+    def _record_in_store(self, entries, bodies):
+        if not entries:
+            return
+        try:
+            store = log_store.get_log_store(FlexibleJSONEncoder)
+            if store is not None:
+                store.record_calls(entries, bodies)
+        except sqlite3.Error as error:
+            print(f"Failed to record {len(entries)} run log entries in the log store: {error}", file=sys.stderr)
+
+def blob_log_path(path):
+    """Blob file kept next to a run log, e.g. insightai_run_log_blobs.jsonl."""
+    root, ext = os.path.splitext(path)
+    return f"{root}_blobs{ext}"
+
+def encode_blob(digest, body, codec):
+    """One line of the blob file; compressed bodies are base64 encoded."""
+    blob_codec, data = log_store.compress(body, codec)
+    if blob_codec == 'none':
+        return {'hash': digest, 'codec': 'none', 'data': data.decode('utf-8')}
+    return {'hash': digest, 'codec': blob_codec, 'data': base64.b64encode(data).decode('ascii')}
+
+def decode_blob(blob):
+    if blob['codec'] == 'none':
+        return json.loads(blob['data'])
+    return json.loads(log_store.decompress(blob['codec'], base64.b64decode(blob['data'])))
+
+def _read_blob_lines(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as blob_file:
+        for line in blob_file:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    pass
+
+def read_blob_hashes(path):
+    return {blob['hash'] for blob in _read_blob_lines(path)}
+
+def read_blobs(path):
+    """Return {hash: message} for every message body in a blob file."""
+    return {blob['hash']: decode_blob(blob) for blob in _read_blob_lines(path)}
+
+run_log_writer = RunLogWriter(ORIGINAL_LOG_FILE_PATH, BLOB_LOG_FILE_PATH)
+atexit.register(run_log_writer.close)
+
+def read_run_log(path=ORIGINAL_LOG_FILE_PATH, legacy_path=LEGACY_LOG_FILE_PATH):
+    """Return the run log entries with their messages, including any left in a legacy JSON array log."""
+    entries = []
+    if legacy_path and os.path.exists(legacy_path):
+        with open(legacy_path, 'r') as json_file:
+            file_content = json_file.read()
+            if file_content.strip():
+                entries.extend(json.loads(file_content))
+
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as log_file:
+            for line in log_file:
+                if not line.strip():
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A line cut short by a crash; the entries around it are still valid
+                    pass
+
+    if any('message_refs' in entry for entry in entries):
+        blobs = read_blobs(blob_log_path(path))
+        for entry in entries:
+            if 'message_refs' in entry:
+                entry['messages'] = [blobs.get(digest) for digest in entry.pop('message_refs')]
+    return entries
+
 class LogAndCallManager:
     def __init__(self, token_cost_dict):
         self.token_summary = {}
+        # Hedge, candidate-race and async executor threads update the summaries concurrently
+        self._summary_lock = threading.Lock()
         self.token_cost_dict = token_cost_dict
+        # Per-statement profiles of generated code, per chain, until the logs are consolidated
+        self.code_profiles = {}
         self.output_manager = output_manager.OutputManager()
         
-    def update_token_summary(self, chain_id, prompt_tokens, completion_tokens, total_tokens, elapsed_time, cost):
+    def _chain_summary(self, chain_id):
+        # Callers hold self._summary_lock
         if chain_id not in self.token_summary:
-            self.token_summary[chain_id] = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'elapsed_time': 0,'total_cost': 0}
-        
-        self.token_summary[chain_id]['prompt_tokens'] += prompt_tokens
-        self.token_summary[chain_id]['completion_tokens'] += completion_tokens
-        self.token_summary[chain_id]['total_tokens'] += total_tokens
-        self.token_summary[chain_id]['elapsed_time'] += elapsed_time
-        self.token_summary[chain_id]['total_cost'] += cost
+            self.token_summary[chain_id] = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'elapsed_time': 0,'total_cost': 0,
+                                            'cache_hits': 0, 'cache_misses': 0, 'time_to_first_token': 0, 'streamed_calls': 0,
+                                            'retries': 0}
+        return self.token_summary[chain_id]
+
+    def _summaries(self):
+        """A copy of the per-chain summaries, safe to iterate while calls are still being recorded."""
+        with self._summary_lock:
+            return {chain_id: dict(summary) for chain_id, summary in self.token_summary.items()}
+
+    def update_token_summary(self, chain_id, prompt_tokens, completion_tokens, total_tokens, elapsed_time, cost):
+        with self._summary_lock:
+            summary = self._chain_summary(chain_id)
+            summary['prompt_tokens'] += prompt_tokens
+            summary['completion_tokens'] += completion_tokens
+            summary['total_tokens'] += total_tokens
+            summary['elapsed_time'] += elapsed_time
+            summary['total_cost'] += cost
+
+    def update_first_token_summary(self, chain_id, time_to_first_token):
+        with self._summary_lock:
+            summary = self._chain_summary(chain_id)
+            summary['time_to_first_token'] += time_to_first_token
+            summary['streamed_calls'] += 1
+
+    def record_retry(self, chain_id, provider=None, model=None):
+        # Count LLM calls retried after a rate-limit response
+        with self._summary_lock:
+            self._chain_summary(chain_id)['retries'] += 1
+        metrics.llm_retries.inc(model=model, provider=provider)
+
+    def record_cache_event(self, chain_id, hit):
+        # Count LLM response cache hits and misses per chain
+        with self._summary_lock:
+            summary = self._chain_summary(chain_id)
+            if hit:
+                summary['cache_hits'] += 1
+            else:
+                summary['cache_misses'] += 1
+
+    def record_code_profile(self, chain_id, code, profile):
+        # Attach the profile of an execution of generated code to the chain's log
+        entry = {
+            'timestamp': time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+            'code': code,
+            **profile.to_dict(),
+        }
+        with self._summary_lock:
+            self.code_profiles.setdefault(chain_id, []).append(entry)
+
+    def _take_code_profiles(self):
+        """Remove and return the profiles recorded so far, per chain."""
+        with self._summary_lock:
+            code_profiles, self.code_profiles = self.code_profiles, {}
+        return code_profiles
 
     def print_summary_to_terminal(self):
         summary_text = ""
-        for chain_id, tokens in self.token_summary.items():
-            avg_speed = tokens['completion_tokens'] / tokens['elapsed_time']
+        summaries = self._summaries()
+        for chain_id, tokens in summaries.items():
+            avg_speed = tokens['completion_tokens'] / tokens['elapsed_time'] if tokens['elapsed_time'] > 0 else 0
 
             summary_text += f"Chain ID: {chain_id}\n"
             summary_text += f"Prompt Tokens: {tokens['prompt_tokens']}\n"
@@ -71,10 +342,23 @@ class LogAndCallManager:
             summary_text += f"Total Time (LLM Interact.): {tokens['elapsed_time']:.2f} seconds\n"
             summary_text += f"Average Response Speed: {avg_speed:.2f} tokens/second\n"
             summary_text += f"Total Cost: ${tokens['total_cost']:.4f}\n"
+            if tokens['streamed_calls']:
+                avg_ttft = tokens['time_to_first_token'] / tokens['streamed_calls']
+                summary_text += f"Avg Time to First Token: {avg_ttft:.2f} seconds\n"
+            if tokens['retries']:
+                summary_text += f"Rate Limit Retries: {tokens['retries']}\n"
+            if tokens['cache_hits'] or tokens['cache_misses']:
+                summary_text += f"Response Cache: {tokens['cache_hits']} hits / {tokens['cache_misses']} misses\n"
 
         self.output_manager.display_call_summary(summary_text)
 
-    def write_to_log(self, agent, chain_id, timestamp, model, messages, content, prompt_tokens, completion_tokens, total_tokens, elapsed_time, tokens_per_second):
+        # Where the time went, per pipeline stage and provider call
+        for chain_id in summaries:
+            stages = tracing.tracer.stage_summary(chain_id)
+            if stages:
+                self.output_manager.display_stage_summary(chain_id, stages)
+
+    def write_to_log(self, agent, chain_id, timestamp, model, messages, content, prompt_tokens, completion_tokens, total_tokens, elapsed_time, tokens_per_second, cached=False, time_to_first_token=None, provider=None):
         # Calculate the costs
         token_costs = self.token_cost_dict.get(model, {})
         prompt_token_cost = token_costs.get('prompt_tokens', 0)
@@ -82,6 +366,10 @@ class LogAndCallManager:
         cost = ((prompt_tokens * prompt_token_cost) / 1000) + ((completion_tokens * completion_token_cost) / 1000)
         
         self.update_token_summary(chain_id, prompt_tokens, completion_tokens, total_tokens, elapsed_time, cost)
+        if time_to_first_token is not None:
+            self.update_first_token_summary(chain_id, time_to_first_token)
+        metrics.record_llm_call(agent, model, provider, prompt_tokens, completion_tokens, elapsed_time, cost,
+                                cached=cached, time_to_first_token=time_to_first_token)
 
         # Writing to JSON log
         json_entry = {
@@ -89,41 +377,51 @@ class LogAndCallManager:
             'chain_id': chain_id,
             'timestamp': timestamp,
             'model': model,
-            'messages': messages,
+            'messages': list(messages),  # Callers keep appending to their list after this call
             'content': content,
             'prompt_tokens': prompt_tokens,
             'completion_tokens': completion_tokens,
             'total_tokens': total_tokens,
             'elapsed_time': elapsed_time,
             'tokens_per_second': tokens_per_second,
-            'cost': cost
+            'time_to_first_token': time_to_first_token,
+            'cost': cost,
+            'cached': cached
         }
-        # Load existing JSON logs from file
-        try:
-            with open(ORIGINAL_LOG_FILE_PATH, 'r') as json_file:
-                file_content = json_file.read()
-                if not file_content:
-                    existing_json_logs = []
-                else:
-                    existing_json_logs = json.loads(file_content)
-        except FileNotFoundError:
-            existing_json_logs = []
-        
-        # Append the new JSON log entry to the existing logs
-        existing_json_logs.append(json_entry)
-        
-        # Write the updated JSON logs back to the file
-        with open(ORIGINAL_LOG_FILE_PATH, 'w') as json_file:
-            json.dump(existing_json_logs, json_file, indent=2, cls=FlexibleJSONEncoder)
-
-
-    def consolidate_logs(self):     
-        # Read the existing original JSON log file
-        if os.path.exists(ORIGINAL_LOG_FILE_PATH):
-            with open(ORIGINAL_LOG_FILE_PATH, 'r') as json_file:
-                existing_json_logs = json.load(json_file)
-        else:
-            existing_json_logs = []
+        # Append to the JSON Lines run log from the background writer
+        run_log_writer.write(json_entry)
+
+
+    @tracing.traced()
+    def consolidate_logs(self):
+        # Wait until every queued entry has been written to the run log and the log store
+        run_log_writer.flush()
+
+        summaries = self._summaries()
+        for chain_id in summaries:
+            tracing.export_chain_trace(chain_id)
+
+        store = log_store.get_log_store(FlexibleJSONEncoder)
+        if store is None:
+            # No log store: merge the run log into the consolidated JSON file instead
+            self._consolidate_json(summaries)
+            return
+
+        # Calls and their per-chain and per-model totals are already in the store; add the
+        # counters only this manager keeps
+        for chain_id, summary_data in summaries.items():
+            store.update_chain_stats(chain_id, summary_data['cache_hits'], summary_data['cache_misses'],
+                                     summary_data['retries'])
+        for chain_id, profiles in self._take_code_profiles().items():
+            for profile in profiles:
+                store.record_code_profile(chain_id, profile)
+
+        # The consolidated JSON file is still written by default, now exported from the store
+        if os.getenv('INSIGHTAI_CONSOLIDATED_JSON', '1').lower() not in ('0', 'false', 'no'):
+            export_consolidated_log(store)
+
+    def _consolidate_json(self, summaries):
+        existing_json_logs = read_run_log()
         
         # Read the existing consolidated JSON log file
         consolidated_logs = {}
@@ -169,7 +467,8 @@ class LogAndCallManager:
             
 
         # Update chain summaries
-        for chain_id, summary_data in self.token_summary.items():
+        code_profiles = self._take_code_profiles()
+        for chain_id, summary_data in summaries.items():
             if chain_id in consolidated_logs:
                 summary = {}
                 summary['Total LLM Calls'] = len(consolidated_logs[chain_id]['chain_details'])
@@ -179,8 +478,12 @@ class LogAndCallManager:
                 summary['Total Time'] = round(summary_data['elapsed_time'], 2)
                 summary['Tokens per Second'] = round(summary_data['completion_tokens'] / summary_data['elapsed_time'], 2)
                 summary['Total Cost'] = round(summary_data['total_cost'], 4)
+                summary['Cache Hits'] = summary_data['cache_hits']
+                summary['Cache Misses'] = summary_data['cache_misses']
                 
                 consolidated_logs[chain_id]['chain_summary'] = summary
+                if chain_id in code_profiles:
+                    consolidated_logs[chain_id].setdefault('code_profiles', []).extend(code_profiles[chain_id])
         
         # Write the updated consolidated logs back to the file
         with open(CONSOLIDATED_LOG_FILE_PATH, 'w') as json_file:
@@ -188,8 +491,57 @@ class LogAndCallManager:
 
     def clear_run_logs(self):
         # Clear the existing log entries and token summary
-        self.token_summary.clear()
+        with self._summary_lock:
+            self.token_summary.clear()
+            self.code_profiles.clear()
+
+        # Clear the run log, after any entries still queued, and drop a legacy log if present
+        run_log_writer.truncate()
+        if os.path.exists(LEGACY_LOG_FILE_PATH):
+            os.remove(LEGACY_LOG_FILE_PATH)
+
+def export_consolidated_log(store=None, path=CONSOLIDATED_LOG_FILE_PATH, since=None):
+    """Write the log store to a JSON file in the consolidated log format.
+
+    `since` limits the export to chains active in the last `since` seconds.
+    """
+    store = store or log_store.get_log_store(FlexibleJSONEncoder)
+    if store is None:
+        raise RuntimeError("The log store is disabled (INSIGHTAI_LOG_STORE=0)")
+    run_log_writer.flush()
+
+    consolidated_logs = {}
+    for chain_id in store.chain_ids(since):
+        chain = store.chain_summary(chain_id)
+        summary_per_model = {}
+        for model_data in store.model_summary(chain_id):
+            summary_per_model[model_data['model']] = {
+                'LLM Calls': model_data['llm_calls'],
+                'Prompt Tokens': model_data['prompt_tokens'],
+                'Completion Tokens': model_data['completion_tokens'],
+                'Total Tokens': model_data['total_tokens'],
+                'Total Time': model_data['total_time'],
+                'Tokens per Second': round(model_data['completion_tokens'] / model_data['total_time'], 2) if model_data['total_time'] else 0,
+                'Total Cost': model_data['total_cost']
+            }
+        consolidated_logs[chain_id] = {
+            'chain_details': store.chain_calls(chain_id),
+            'chain_summary': {
+                'Total LLM Calls': chain['llm_calls'],
+                'Prompt Tokens': chain['prompt_tokens'],
+                'Completion Tokens': chain['completion_tokens'],
+                'Total Tokens': chain['total_tokens'],
+                'Total Time': round(chain['total_time'], 2),
+                'Tokens per Second': round(chain['completion_tokens'] / chain['total_time'], 2) if chain['total_time'] else 0,
+                'Total Cost': round(chain['total_cost'], 4),
+                'Cache Hits': chain['cache_hits'],
+                'Cache Misses': chain['cache_misses']
+            },
+            'summary_per_model': summary_per_model
+        }
+        code_profiles = store.code_profiles(chain_id)
+        if code_profiles:
+            consolidated_logs[chain_id]['code_profiles'] = code_profiles
 
-        # Clear the original log file
-        with open(ORIGINAL_LOG_FILE_PATH, 'w') as json_file:
-            json.dump([], json_file, indent=2, cls=FlexibleJSONEncoder)
\ No newline at end of file
+    with open(path, 'w') as json_file:
+        json.dump(consolidated_logs, json_file, indent=2, cls=FlexibleJSONEncoder)
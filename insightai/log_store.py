@@ -0,0 +1,357 @@
+import hashlib
+import importlib.util
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+LOG_STORE_FILE_PATH = 'insightai_logs.db'
+
+# Columns that may be aggregated or grouped by in queries
+METRIC_COLUMNS = ('elapsed_time', 'time_to_first_token', 'tokens_per_second', 'prompt_tokens',
+                  'completion_tokens', 'total_tokens', 'cost')
+GROUP_COLUMNS = ('agent', 'model', 'chain_id')
+
+COMPRESSION_CODECS = ('none', 'zlib', 'zstd')
+MIN_COMPRESS_SIZE = 512  # Bytes; smaller message bodies are stored as-is
+
+_zstd_warned = False
+
+def get_compression():
+    """Codec for new message bodies, from INSIGHTAI_LOG_COMPRESSION ('zlib' by default)."""
+    global _zstd_warned
+    codec = os.getenv('INSIGHTAI_LOG_COMPRESSION', 'zlib').lower()
+    if codec not in COMPRESSION_CODECS:
+        raise ValueError(f"Unknown log compression '{codec}', expected one of {', '.join(COMPRESSION_CODECS)}")
+    if codec == 'zstd' and importlib.util.find_spec('zstandard') is None:
+        if not _zstd_warned:
+            print("zstandard is not installed; compressing log messages with zlib instead.", file=sys.stderr)
+            _zstd_warned = True
+        return 'zlib'
+    return codec
+
+def compress(body, codec):
+    """Return (codec, data) for a message body; small bodies are left uncompressed."""
+    if codec == 'none' or len(body) < MIN_COMPRESS_SIZE:
+        return 'none', body
+    if codec == 'zstd':
+        import zstandard
+        return 'zstd', zstandard.ZstdCompressor().compress(body)
+    return 'zlib', zlib.compress(body)
+
+def decompress(codec, data):
+    if codec == 'none':
+        return bytes(data)
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+def split_messages(messages, json_encoder=None):
+    """Return (refs, bodies): the hash of each message and {hash: serialized message}.
+
+    Logs store each distinct message body once and reference it by hash, so system prompts and
+    conversation history repeated across calls are not written again for every call.
+    """
+    refs, bodies = [], {}
+    for message in messages or []:
+        body = json.dumps(message, cls=json_encoder, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        # 64 bits keep references short; a collision needs billions of distinct messages
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        refs.append(digest)
+        bodies[digest] = body
+    return refs, bodies
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    codec TEXT,
+    size INTEGER,
+    data BLOB
+);
+
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chain_id TEXT,
+    agent TEXT,
+    model TEXT,
+    timestamp TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    elapsed_time REAL,
+    tokens_per_second REAL,
+    time_to_first_token REAL,
+    cost REAL,
+    cached INTEGER,
+    messages TEXT,  -- JSON list of blob hashes
+    content TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_calls_chain_id ON calls (chain_id);
+CREATE INDEX IF NOT EXISTS idx_calls_agent_timestamp ON calls (agent, timestamp);
+CREATE INDEX IF NOT EXISTS idx_calls_model_timestamp ON calls (model, timestamp);
+CREATE INDEX IF NOT EXISTS idx_calls_timestamp ON calls (timestamp);
+
+CREATE TABLE IF NOT EXISTS chains (
+    chain_id TEXT PRIMARY KEY,
+    first_timestamp TEXT,
+    last_timestamp TEXT,
+    llm_calls INTEGER DEFAULT 0,
+    prompt_tokens INTEGER DEFAULT 0,
+    completion_tokens INTEGER DEFAULT 0,
+    total_tokens INTEGER DEFAULT 0,
+    total_time REAL DEFAULT 0,
+    total_cost REAL DEFAULT 0,
+    cached_calls INTEGER DEFAULT 0,
+    cache_hits INTEGER DEFAULT 0,
+    cache_misses INTEGER DEFAULT 0,
+    retries INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_chains_last_timestamp ON chains (last_timestamp);
+
+CREATE TABLE IF NOT EXISTS model_summary (
+    chain_id TEXT,
+    model TEXT,
+    llm_calls INTEGER DEFAULT 0,
+    prompt_tokens INTEGER DEFAULT 0,
+    completion_tokens INTEGER DEFAULT 0,
+    total_tokens INTEGER DEFAULT 0,
+    total_time REAL DEFAULT 0,
+    total_cost REAL DEFAULT 0,
+    PRIMARY KEY (chain_id, model)
+);
+CREATE INDEX IF NOT EXISTS idx_model_summary_model ON model_summary (model);
+
+CREATE TABLE IF NOT EXISTS code_profiles (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chain_id TEXT,
+    timestamp TEXT,
+    profile TEXT  -- JSON: code, totals and per-statement timings
+);
+CREATE INDEX IF NOT EXISTS idx_code_profiles_chain_id ON code_profiles (chain_id);
+"""
+
+class LogStore:
+    """SQLite store of every logged LLM call, with per-chain and per-model aggregates.
+
+    The aggregates are updated in the same transaction as the calls they summarize, so
+    consolidation costs nothing extra and never rereads history. WAL mode and a busy timeout
+    let several processes log to the same file. Messages live in the blobs table, one row per
+    distinct message, and calls reference them by hash.
+    """
+    def __init__(self, path=LOG_STORE_FILE_PATH, json_encoder=None):
+        self.path = path
+        self.json_encoder = json_encoder
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._known_blobs = set()
+
+    def record_calls(self, entries, bodies=None):
+        """Insert run log entries and update the chain and model aggregates in one transaction.
+
+        Entries either carry their `messages`, or `message_refs` whose bodies are in `bodies`
+        (as produced by split_messages).
+        """
+        if not entries:
+            return
+        codec = get_compression()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for entry in entries:
+                    if 'message_refs' in entry:
+                        refs = entry['message_refs']
+                    else:
+                        refs, bodies = split_messages(entry.get('messages'), self.json_encoder)
+                    self._store_blobs(refs, bodies or {}, codec)
+                    self._record_call(entry, refs)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                # Blobs added in the rolled back transaction are gone again
+                self._known_blobs.clear()
+                raise
+
+    def _store_blobs(self, refs, bodies, codec):
+        if len(self._known_blobs) > 100000:
+            self._known_blobs.clear()
+        for digest in refs:
+            if digest in self._known_blobs or digest not in bodies:
+                continue
+            body = bodies[digest]
+            blob_codec, data = compress(body, codec)
+            self._conn.execute("INSERT OR IGNORE INTO blobs (hash, codec, size, data) VALUES (?, ?, ?, ?)",
+                               (digest, blob_codec, len(body), data))
+            self._known_blobs.add(digest)
+
+    def load_messages(self, refs):
+        """Resolve message hashes to messages; unknown hashes resolve to None."""
+        wanted = list(set(refs))
+        messages = {}
+        for start in range(0, len(wanted), 500):
+            chunk = wanted[start:start + 500]
+            rows = self._query(f"SELECT hash, codec, data FROM blobs WHERE hash IN ({','.join('?' * len(chunk))})", chunk)
+            for digest, codec, data in rows:
+                messages[digest] = json.loads(decompress(codec, data))
+        return [messages.get(digest) for digest in refs]
+
+    def _record_call(self, entry, refs):
+        chain_id = str(entry.get('chain_id'))
+        timestamp = entry.get('timestamp')
+        prompt_tokens = entry.get('prompt_tokens') or 0
+        completion_tokens = entry.get('completion_tokens') or 0
+        total_tokens = entry.get('total_tokens') or 0
+        elapsed_time = entry.get('elapsed_time') or 0
+        cost = entry.get('cost') or 0
+        cached = 1 if entry.get('cached') else 0
+
+        self._conn.execute(
+            """INSERT INTO calls (chain_id, agent, model, timestamp, prompt_tokens, completion_tokens, total_tokens,
+                                  elapsed_time, tokens_per_second, time_to_first_token, cost, cached, messages, content)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (chain_id, entry.get('agent'), entry.get('model'), timestamp, prompt_tokens, completion_tokens,
+             total_tokens, elapsed_time, entry.get('tokens_per_second'), entry.get('time_to_first_token'), cost,
+             cached, json.dumps(refs), entry.get('content'))
+        )
+        self._conn.execute(
+            """INSERT INTO chains (chain_id, first_timestamp, last_timestamp, llm_calls, prompt_tokens, completion_tokens,
+                                   total_tokens, total_time, total_cost, cached_calls)
+               VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (chain_id) DO UPDATE SET
+                   first_timestamp = MIN(first_timestamp, excluded.first_timestamp),
+                   last_timestamp = MAX(last_timestamp, excluded.last_timestamp),
+                   llm_calls = llm_calls + 1,
+                   prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                   completion_tokens = completion_tokens + excluded.completion_tokens,
+                   total_tokens = total_tokens + excluded.total_tokens,
+                   total_time = total_time + excluded.total_time,
+                   total_cost = total_cost + excluded.total_cost,
+                   cached_calls = cached_calls + excluded.cached_calls""",
+            (chain_id, timestamp, timestamp, prompt_tokens, completion_tokens, total_tokens, elapsed_time, cost, cached)
+        )
+        self._conn.execute(
+            """INSERT INTO model_summary (chain_id, model, llm_calls, prompt_tokens, completion_tokens, total_tokens,
+                                          total_time, total_cost)
+               VALUES (?, ?, 1, ?, ?, ?, ?, ?)
+               ON CONFLICT (chain_id, model) DO UPDATE SET
+                   llm_calls = llm_calls + 1,
+                   prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                   completion_tokens = completion_tokens + excluded.completion_tokens,
+                   total_tokens = total_tokens + excluded.total_tokens,
+                   total_time = total_time + excluded.total_time,
+                   total_cost = total_cost + excluded.total_cost""",
+            (chain_id, entry.get('model'), prompt_tokens, completion_tokens, total_tokens, elapsed_time, cost)
+        )
+
+    def update_chain_stats(self, chain_id, cache_hits=0, cache_misses=0, retries=0):
+        """Store the cache and retry counters kept in memory by LogAndCallManager for a chain."""
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO chains (chain_id, cache_hits, cache_misses, retries) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (chain_id) DO UPDATE SET
+                       cache_hits = excluded.cache_hits,
+                       cache_misses = excluded.cache_misses,
+                       retries = excluded.retries""",
+                (str(chain_id), cache_hits, cache_misses, retries)
+            )
+
+    def record_code_profile(self, chain_id, profile):
+        """Store the per-statement profile of one execution of generated code (see LogAndCallManager)."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO code_profiles (chain_id, timestamp, profile) VALUES (?, ?, ?)",
+                (str(chain_id), profile.get('timestamp'), json.dumps(profile, cls=self.json_encoder))
+            )
+
+    def code_profiles(self, chain_id):
+        rows = self._query("SELECT profile FROM code_profiles WHERE chain_id = ? ORDER BY id", (str(chain_id),))
+        return [json.loads(row[0]) for row in rows]
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def percentile(self, percentile=0.95, column='elapsed_time', group_by='agent', since=None):
+        """Return {group: value} for a percentile of a call metric, e.g. p95 latency per agent.
+
+        `since` limits the calls to the last `since` seconds. The value is the smallest one whose
+        rank within its group is at or above the percentile (nearest-rank method).
+        """
+        if column not in METRIC_COLUMNS:
+            raise ValueError(f"Unknown metric column: {column}")
+        if group_by not in GROUP_COLUMNS:
+            raise ValueError(f"Unknown group column: {group_by}")
+
+        where, params = f"WHERE {column} IS NOT NULL", []
+        if since is not None:
+            where += " AND timestamp >= ?"
+            params.append(time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - since)))
+
+        rows = self._query(
+            f"""SELECT grp, MIN(value) FROM (
+                    SELECT {group_by} AS grp, {column} AS value,
+                           CUME_DIST() OVER (PARTITION BY {group_by} ORDER BY {column}) AS rank
+                    FROM calls {where}
+                ) WHERE rank >= ? GROUP BY grp""",
+            params + [percentile]
+        )
+        return {row[0]: row[1] for row in rows}
+
+    def chain_ids(self, since=None):
+        """Chain IDs in order of their last call, optionally only those active in the last `since` seconds."""
+        if since is None:
+            rows = self._query("SELECT chain_id FROM chains ORDER BY last_timestamp")
+        else:
+            cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - since))
+            rows = self._query("SELECT chain_id FROM chains WHERE last_timestamp >= ? ORDER BY last_timestamp", (cutoff,))
+        return [row[0] for row in rows]
+
+    def chain_summary(self, chain_id):
+        rows = self._query("SELECT * FROM chains WHERE chain_id = ?", (str(chain_id),))
+        return dict(rows[0]) if rows else None
+
+    def model_summary(self, chain_id):
+        rows = self._query("SELECT * FROM model_summary WHERE chain_id = ? ORDER BY model", (str(chain_id),))
+        return [dict(row) for row in rows]
+
+    def chain_calls(self, chain_id):
+        """Every call of a chain as a run log entry, in the order they were logged."""
+        rows = self._query("SELECT * FROM calls WHERE chain_id = ? ORDER BY id", (str(chain_id),))
+        calls = []
+        for row in rows:
+            call = dict(row)
+            del call['id']
+            # The messages column holds the hashes of the call's messages
+            call['messages'] = self.load_messages(json.loads(call['messages'])) if call['messages'] else []
+            call['cached'] = bool(call['cached'])
+            calls.append(call)
+        return calls
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_log_store(json_encoder=None):
+    """Return the process-wide log store, or None if INSIGHTAI_LOG_STORE is set to 0/false/no.
+
+    The store is opened on first use at INSIGHTAI_LOG_STORE_PATH; `json_encoder` is used to
+    serialize the messages of each call.
+    """
+    global _store
+    if os.getenv('INSIGHTAI_LOG_STORE', '1').lower() in ('0', 'false', 'no'):
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = LogStore(os.getenv('INSIGHTAI_LOG_STORE_PATH', LOG_STORE_FILE_PATH), json_encoder)
+    return _store
@@ -0,0 +1,225 @@
+import bisect
+import contextlib
+import os
+import threading
+import time
+
+# Latency buckets in seconds, from fast local work up to slow reasoning models
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base for labelled metrics; values are kept per tuple of label values."""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple('' if labels[name] is None else str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self, items):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram. If it has an 'outcome' label, time() fills it in."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the duration of the enclosed block, with outcome 'ok' or 'error' if that label exists."""
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            yield
+            outcome = 'ok'
+        finally:
+            if 'outcome' in self.labelnames:
+                labels['outcome'] = outcome
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get(self, **labels):
+        """Return (count, sum) for a label set."""
+        with self._lock:
+            counts, total = self._values.get(self._key(labels), ([0], 0.0))
+            return sum(counts), total
+
+    def _render_samples(self, items):
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def clear(self):
+        """Reset every metric to zero, keeping the registrations."""
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+LLM_LABELS = ('agent', 'model', 'provider')
+
+llm_calls = registry.register(Counter(
+    'insightai_llm_calls_total', 'LLM calls, including responses served from the cache.', LLM_LABELS + ('cached',)))
+llm_tokens = registry.register(Counter(
+    'insightai_llm_tokens_total', 'Tokens used by LLM calls.', LLM_LABELS + ('type',)))
+llm_cost = registry.register(Counter(
+    'insightai_llm_cost_dollars_total', 'Estimated cost of LLM calls in US dollars.', LLM_LABELS))
+llm_retries = registry.register(Counter(
+    'insightai_llm_retries_total', 'LLM calls retried after a rate-limit response.', ('model', 'provider')))
+error_corrections = registry.register(Counter(
+    'insightai_error_corrections_total', 'Generated code sent back to the LLM after failing to run.', ('analyst',)))
+llm_latency = registry.register(Histogram(
+    'insightai_llm_latency_seconds', 'Duration of LLM calls.', LLM_LABELS))
+llm_time_to_first_token = registry.register(Histogram(
+    'insightai_llm_time_to_first_token_seconds', 'Time to the first token of streamed LLM calls.', LLM_LABELS))
+code_exec = registry.register(Histogram(
+    'insightai_code_exec_seconds', 'Duration of executing generated Python code.', ('analyst', 'outcome')))
+sql_query = registry.register(Histogram(
+    'insightai_sql_query_seconds', 'Duration of executing generated SQL queries.', ('outcome',)))
+code_candidates = registry.register(Counter(
+    'insightai_code_candidates_total', 'Code candidates generated in parallel, by outcome.', ('outcome',)))
+code_validations = registry.register(Counter(
+    'insightai_code_validations_total', 'Static checks of generated code before it runs, by ok, fixed or rejected.', ('result',)))
+code_repairs = registry.register(Counter(
+    'insightai_code_repairs_total', 'Failed generated code rewritten by a local repair rule instead of the LLM.', ('rule',)))
+exec_output_omitted = registry.register(Counter(
+    'insightai_exec_output_omitted_chars_total', 'Characters of generated code output dropped from the captured results.'))
+exec_cache_lookups = registry.register(Counter(
+    'insightai_exec_cache_lookups_total', 'Execution cache lookups for generated code, by hit or miss.', ('result',)))
+
+def record_llm_call(agent, model, provider, prompt_tokens, completion_tokens, elapsed_time, cost,
+                    cached=False, time_to_first_token=None):
+    """Update the LLM metrics for one logged call."""
+    labels = {'agent': agent, 'model': model, 'provider': provider}
+    llm_calls.inc(cached='true' if cached else 'false', **labels)
+    llm_tokens.inc(prompt_tokens, type='prompt', **labels)
+    llm_tokens.inc(completion_tokens, type='completion', **labels)
+    llm_cost.inc(cost, **labels)
+    if not cached:
+        # Cache hits take no time worth measuring and would drag the latency quantiles down
+        llm_latency.observe(elapsed_time, **labels)
+        if time_to_first_token is not None:
+            llm_time_to_first_token.observe(time_to_first_token, **labels)
+
+def render():
+    """Return every metric in the Prometheus text exposition format."""
+    return registry.render()
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_http_server(port, addr='127.0.0.1'):
+    """Serve the metrics at http://addr:port/metrics from a daemon thread. Returns the server."""
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Keep scrapes out of the notebook/terminal output
+            pass
+
+    with _server_lock:
+        if _server is not None:
+            return _server
+        _server = ThreadingHTTPServer((addr, int(port)), MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name='insightai-metrics', daemon=True).start()
+    return _server
+
+def start_http_server_from_env():
+    """Start the metrics endpoint if INSIGHTAI_METRICS_PORT is set. Returns the server or None."""
+    port = os.getenv('INSIGHTAI_METRICS_PORT')
+    if not port:
+        return None
+    return start_http_server(port, os.getenv('INSIGHTAI_METRICS_ADDR', '127.0.0.1'))
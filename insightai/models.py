@@ -1,12 +1,54 @@
+import asyncio
+import atexit
+import collections
+import concurrent.futures
+import contextvars
+import email.utils
+import functools
 import importlib
 import os
+import threading
 import time
+import types
 import json
+import math
+import random
 import re
+import sys
+import weakref
 
+try:
+    # Attempt package-relative import
+    from . import llm_cache, output_manager, token_counter, tracing
+except ImportError:
+    # Fall back to script-style import
+    import llm_cache, output_manager, token_counter, tracing
+
+output_handler = output_manager.OutputManager()
+
+# Environment variables holding the API key and (optional) base URL for each provider
+PROVIDER_API_KEYS = {
+    'openai': 'OPENAI_API_KEY',
+    'groq': 'GROQ_API_KEY',
+    'gemini': 'GEMINI_API_KEY',
+}
+PROVIDER_BASE_URLS = {
+    'openai': 'OPENAI_BASE_URL',
+    'groq': 'GROQ_BASE_URL',
+    'gemini': 'GEMINI_BASE_URL',
+}
+
+# Agent whose call is in progress; lets the replay provider find its recordings
+current_agent = contextvars.ContextVar('insightai_current_agent', default=None)
+
+def get_llm_mode():
+    """'live' (default), 'record' (also append every call to the fixture file) or 'replay' (serve calls from it)."""
+    return os.getenv('INSIGHTAI_LLM_MODE', 'live').lower()
 
 def get_best_available_provider():
     """Determine the best available provider based on environment variables."""
+    if get_llm_mode() == 'replay':
+        return 'replay', 'gpt-4o-mini'
     if os.getenv('OPENAI_API_KEY'):
         return 'openai', 'gpt-4o-mini'
     if os.getenv('GROQ_API_KEY'):
@@ -42,16 +84,21 @@ def load_llm_config():
 
     return default_llm_config
 
-def get_effective_config():
+LLM_CONFIG_FILE_PATH = "LLM_CONFIG.json"
+
+# Seconds to wait for the first token before hedging an agent call to its next fallback
+DEFAULT_HEDGE_AFTER = float(os.getenv('INSIGHTAI_HEDGE_AFTER', 3))
+
+def _build_effective_config(path=LLM_CONFIG_FILE_PATH):
     """Merge user config with default config to get the full picture."""
     # Start with base defaults
     effective_config = {item['agent']: item for item in load_llm_config()}
     
     # Try to load user config from file
     user_config = []
-    if os.path.exists("LLM_CONFIG.json"):
+    if os.path.exists(path):
         try:
-            with open("LLM_CONFIG.json", 'r') as f:
+            with open(path, 'r') as f:
                 user_config = json.load(f)
         except Exception:
             pass
@@ -67,12 +114,111 @@ def get_effective_config():
     # Merge user settings into defaults
     for item in user_config:
         effective_config[item['agent']] = item
+
+    if get_llm_mode() == 'replay':
+        # Serve every agent from the recordings, keeping the configured model names for the logs
+        for agent, item in effective_config.items():
+            details = {key: value for key, value in item.get('details', {}).items() if key != 'fallbacks'}
+            effective_config[agent] = dict(item, details=dict(details, provider='replay'))
         
     return list(effective_config.values())
 
+class LLMConfigRegistry:
+    """Memoized view of the effective LLM configuration.
+
+    The config is rebuilt only when LLM_CONFIG.json changes on disk (by mtime), the
+    LLM_CONFIG environment variable changes, or the set of available API keys changes.
+    Agent lookups go through a dict index instead of scanning the config list.
+    """
+    def __init__(self, path=LLM_CONFIG_FILE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # (signature, config, index, (provider, model)), replaced as a whole so readers never see a mix
+        self._snapshot = None
+
+    def _current_signature(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        return (os.getcwd(), mtime, os.environ.get('LLM_CONFIG'), get_best_available_provider())
+
+    def _ensure_loaded(self):
+        """Return the current (signature, config, index, (provider, model)) snapshot, rebuilding it if stale."""
+        signature = self._current_signature()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == signature:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot[0] == signature:
+                return snapshot
+            config = tuple(_build_effective_config(self.path))
+            index = types.MappingProxyType({item['agent']: item.get('details', {}) for item in config})
+            snapshot = self._snapshot = (signature, config, index, signature[-1])
+            return snapshot
+
+    def reload(self):
+        """Force the configuration to be rebuilt on next access."""
+        with self._lock:
+            self._snapshot = None
+
+    def get_config(self):
+        """Return the effective config as a list of {'agent', 'details'} items."""
+        return list(self._ensure_loaded()[1])
+
+    @staticmethod
+    def _agent_details(snapshot, agent):
+        _, _, index, (provider, model) = snapshot
+        details = index.get(agent)
+        if details is None:
+            # Absolute fallback to best available key
+            return model, provider, 2000, 0
+
+        return (
+            details.get('model', model),
+            details.get('provider', provider),
+            details.get('max_tokens', 2000),
+            details.get('temperature', 0)
+        )
+
+    def get_agent_details(self, agent):
+        """Return (model, provider, max_tokens, temperature) for an agent."""
+        return self._agent_details(self._ensure_loaded(), agent)
+
+    def get_hedge_plan(self, agent):
+        """Return ([(model, provider, max_tokens, temperature), ...], hedge_after) for an agent.
+
+        The first entry is the agent's own model, followed by its optional "fallbacks" list.
+        Fallback entries inherit max_tokens and temperature from the agent unless they set them.
+        """
+        snapshot = self._ensure_loaded()
+        primary = self._agent_details(snapshot, agent)
+        details = snapshot[2].get(agent) or {}
+        attempts = [primary]
+        for fallback in details.get('fallbacks', []):
+            attempts.append((
+                fallback.get('model', primary[0]),
+                fallback.get('provider', primary[1]),
+                fallback.get('max_tokens', primary[2]),
+                fallback.get('temperature', primary[3])
+            ))
+        return attempts, float(details.get('hedge_after', DEFAULT_HEDGE_AFTER))
+
+config_registry = LLMConfigRegistry()
+
+def get_effective_config():
+    """Get the merged default and user configuration."""
+    return config_registry.get_config()
+
+def reload_llm_config():
+    """Re-read LLM_CONFIG.json and the LLM_CONFIG environment variable on next use."""
+    config_registry.reload()
+
 def get_agent_details(agent, llm_config):
     """Get model details for a specific agent from config."""
-    model, provider = get_best_available_provider()
+    provider, model = get_best_available_provider()
     
     for item in llm_config:
         if item['agent'] == agent:
@@ -89,14 +235,66 @@ def get_agent_details(agent, llm_config):
 
 def init(agent):
     """Initialize model parameters for an agent."""
-    llm_config = get_effective_config()
-    return get_agent_details(agent, llm_config)
+    return config_registry.get_agent_details(agent)
+
+def get_hedge_plan(agent, temperature=None):
+    """Get the primary and fallback models for an agent, and the hedging deadline.
+
+    A `temperature` given here replaces the configured one for every model in the plan.
+    """
+    attempts, hedge_after = config_registry.get_hedge_plan(agent)
+    if temperature is not None:
+        attempts = [attempt[:3] + (temperature,) for attempt in attempts]
+    return attempts, hedge_after
 
 def get_model_name(agent):
     """Get model name and provider for an agent."""
     model, provider, _, _ = init(agent)
     return model, provider
 
+class StreamStats:
+    """Timing and provider-reported usage gathered while consuming a streamed response.
+
+    Content is echoed through `emit`. When an `on_token` callback is given (hedged requests)
+    it receives the text instead of the console, and may raise to abort the stream.
+    """
+    def __init__(self, on_token=None):
+        self.start_time = time.time()
+        self.first_token_time = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.on_token = on_token
+
+    def mark_token(self):
+        """Record the arrival of a content token; only the first one matters."""
+        if self.first_token_time is None:
+            self.first_token_time = time.time()
+
+    def emit(self, text):
+        """Record a content token and echo it to the console (or hand it to on_token)."""
+        self.mark_token()
+        if self.on_token is not None:
+            self.on_token(text)
+        else:
+            output_handler.print_wrapper(text, end='', flush=True)
+
+    def add_usage(self, prompt_tokens, completion_tokens):
+        """Add usage reported by the provider. Calls made for tool follow-ups are summed."""
+        self.prompt_tokens = (self.prompt_tokens or 0) + (prompt_tokens or 0)
+        self.completion_tokens = (self.completion_tokens or 0) + (completion_tokens or 0)
+
+    @property
+    def time_to_first_token(self):
+        if self.first_token_time is None:
+            return None
+        return self.first_token_time - self.start_time
+
+    def resolve_usage(self, messages, content):
+        """Return (prompt_tokens, completion_tokens), tokenizing locally only if the provider reported nothing."""
+        if self.completion_tokens is not None:
+            return self.prompt_tokens, self.completion_tokens
+        return token_counter.count_prompt_tokens(messages), token_counter.count_text_tokens(content)
+
 def try_import(module_name):
     """Import a module, trying package-relative import first."""
     try:
@@ -104,33 +302,625 @@ def try_import(module_name):
     except ImportError:
         return importlib.import_module(module_name)
 
-def llm_call(log_and_call_manager, messages: str, agent: str = None, chain_id: str = None):
-    """Make a non-streaming LLM call."""
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-    model, provider, max_tokens, temperature = init(agent)
+class ClientRegistry:
+    """Process-wide cache of provider clients, one per (provider, api key, base URL).
 
-    provider_function_map = {
-        'groq': 'llm_call',
-        'openai': 'llm_call',
-        'gemini': 'llm_call',
-    }
+    Each client owns a keep-alive HTTP connection pool, so consecutive agent calls
+    reuse warm connections instead of repeating the TCP and TLS handshakes.
+    Async clients are additionally keyed by event loop, since their pools are bound to it.
+    """
+    def __init__(self):
+        self._clients = {}
+        self._async_clients = {}
+        self._lock = threading.Lock()
+        self.pool_limits = {
+            'max_connections': int(os.getenv('INSIGHTAI_HTTP_MAX_CONNECTIONS', 20)),
+            'max_keepalive_connections': int(os.getenv('INSIGHTAI_HTTP_MAX_KEEPALIVE', 10)),
+            'keepalive_expiry': float(os.getenv('INSIGHTAI_HTTP_KEEPALIVE_EXPIRY', 30)),
+        }
 
-    if provider not in provider_function_map:
-        raise ValueError(f"Unsupported provider: {provider}")
+    def configure(self, **pool_limits):
+        """Update the connection pool limits. Existing clients are closed so the new limits apply."""
+        unknown = set(pool_limits) - set(self.pool_limits)
+        if unknown:
+            raise ValueError(f"Unknown connection pool setting(s): {', '.join(sorted(unknown))}")
+        with self._lock:
+            self.pool_limits.update(pool_limits)
+        self.close()
 
-    provider_module = try_import(f'{provider}_models')
-    function_name = provider_function_map[provider]
-    
-    result = getattr(provider_module, function_name)(
-        messages, model, temperature, max_tokens
+    def get(self, provider, api_key=None, base_url=None):
+        """Return the shared client for a provider, creating it on first use."""
+        key = (provider, api_key, base_url)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+
+        with self._lock:
+            # Another thread may have built the client while we were waiting for the lock
+            client = self._clients.get(key)
+            if client is None:
+                provider_module = try_import(f'{provider}_models')
+                client = provider_module.create_client(api_key, base_url, dict(self.pool_limits))
+                self._clients[key] = client
+        return client
+
+    def get_async(self, provider, api_key=None, base_url=None):
+        """Return the shared async client for a provider on the running event loop."""
+        loop = asyncio.get_running_loop()
+        key = (provider, api_key, base_url, id(loop))
+        client = self._async_clients.get(key)
+        if client is not None:
+            return client
+
+        with self._lock:
+            client = self._async_clients.get(key)
+            if client is None:
+                provider_module = try_import(f'{provider}_models')
+                client = provider_module.create_async_client(api_key, base_url, dict(self.pool_limits))
+                self._async_clients[key] = client
+                # Forget the client when its loop goes away so a new loop with the same id starts fresh
+                weakref.finalize(loop, self._async_clients.pop, key, None)
+        return client
+
+    def close(self):
+        """Close every cached sync client and forget all async clients."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._async_clients.clear()
+        for client in clients:
+            close = getattr(client, 'close', None)
+            if callable(close):
+                try:
+                    close()
+                except Exception:
+                    pass
+
+client_registry = ClientRegistry()
+atexit.register(client_registry.close)
+
+def _client_settings(provider):
+    api_key = os.environ.get(PROVIDER_API_KEYS.get(provider, ''))
+    base_url = os.environ.get(PROVIDER_BASE_URLS.get(provider, '')) or None
+    return api_key, base_url
+
+def get_client(provider):
+    """Get the pooled client for a provider using the API key and base URL from the environment."""
+    api_key, base_url = _client_settings(provider)
+    if not api_key:
+        return None
+    return client_registry.get(provider, api_key, base_url)
+
+def get_async_client(provider):
+    """Get the pooled async client for a provider. Must be called from a running event loop."""
+    api_key, base_url = _client_settings(provider)
+    if not api_key:
+        return None
+    return client_registry.get_async(provider, api_key, base_url)
+
+def configure_connection_pool(**pool_limits):
+    """Set max_connections, max_keepalive_connections and/or keepalive_expiry for provider clients."""
+    client_registry.configure(**pool_limits)
+
+class TokenBucket:
+    """A budget of `capacity` units per minute that refills continuously."""
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def delay_for(self, amount, now):
+        """Seconds until `amount` units are available (requests larger than the budget wait for a full bucket)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) * 60.0 / self.capacity
+
+    def consume(self, amount):
+        self.tokens -= amount
+
+class _RateLimitState:
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.blocked_until = 0
+        self.queue = collections.deque()
+
+    def delay_for(self, tokens):
+        now = time.monotonic()
+        delay = max(0, self.blocked_until - now)
+        if self.requests is not None:
+            delay = max(delay, self.requests.delay_for(1, now))
+        if self.tokens is not None and tokens:
+            delay = max(delay, self.tokens.delay_for(tokens, now))
+        return delay
+
+    def consume(self, tokens):
+        if self.requests is not None:
+            self.requests.consume(1)
+        if self.tokens is not None and tokens:
+            self.tokens.consume(tokens)
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute budgets per provider (or provider/model).
+
+    Callers queue in arrival order and are released as budget becomes available. A 429 from
+    the provider blocks the whole queue for the Retry-After period, so waiting callers do not
+    pile onto an endpoint that is already refusing requests.
+    """
+    def __init__(self):
+        self._limits = {}
+        self._states = {}
+        self._cond = threading.Condition()
+        self.max_retries = int(os.getenv('INSIGHTAI_RATE_LIMIT_MAX_RETRIES', 5))
+        self.base_delay = float(os.getenv('INSIGHTAI_RATE_LIMIT_BASE_DELAY', 1))
+        self.max_delay = float(os.getenv('INSIGHTAI_RATE_LIMIT_MAX_DELAY', 60))
+
+        if os.environ.get('INSIGHTAI_RATE_LIMITS'):
+            # e.g. {"openai": {"rpm": 500, "tpm": 200000}, "groq/llama-3.3-70b-versatile": {"rpm": 30}}
+            try:
+                configured = {name: (limits.get('rpm'), limits.get('tpm'))
+                              for name, limits in json.loads(os.environ['INSIGHTAI_RATE_LIMITS']).items()}
+            except (ValueError, AttributeError) as error:
+                # Runs at import; a bad value must not make the package unimportable
+                print(f"Ignoring INSIGHTAI_RATE_LIMITS, which is not a JSON object of "
+                      f'{{"provider[/model]": {{"rpm": ..., "tpm": ...}}}} entries: {error}', file=sys.stderr)
+                configured = {}
+            for name, (rpm, tpm) in configured.items():
+                provider, _, model = name.partition('/')
+                self.configure(provider, model or None, rpm, tpm)
+
+    def configure(self, provider, model=None, rpm=None, tpm=None):
+        """Set the budget for a provider, or for one model of a provider if `model` is given."""
+        with self._cond:
+            self._limits[(provider, model)] = (rpm, tpm)
+            self._states.pop((provider, model), None)
+
+    def _key(self, provider, model):
+        return (provider, model) if (provider, model) in self._limits else (provider, None)
+
+    def _state(self, provider, model):
+        key = self._key(provider, model)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _RateLimitState(*self._limits.get(key, (None, None)))
+        return state
+
+    def has_token_budget(self, provider, model):
+        with self._cond:
+            return self._state(provider, model).tokens is not None
+
+    def acquire(self, provider, model, tokens=0):
+        """Block until this caller is first in the queue and the budget allows the request."""
+        ticket = object()
+        with self._cond:
+            state = self._state(provider, model)
+            state.queue.append(ticket)
+            try:
+                while True:
+                    delay = None
+                    if state.queue[0] is ticket:
+                        delay = state.delay_for(tokens)
+                        if delay <= 0:
+                            state.consume(tokens)
+                            return
+                    self._cond.wait(delay)
+            finally:
+                state.queue.remove(ticket)
+                self._cond.notify_all()
+
+    async def aacquire(self, provider, model, tokens=0):
+        """Coroutine counterpart of acquire that waits without blocking the event loop."""
+        ticket = object()
+        with self._cond:
+            state = self._state(provider, model)
+            state.queue.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    if state.queue[0] is ticket:
+                        delay = state.delay_for(tokens)
+                        if delay <= 0:
+                            state.consume(tokens)
+                            return
+                    else:
+                        delay = 0.05  # Poll until this caller reaches the head of the queue
+                await asyncio.sleep(delay)
+        finally:
+            with self._cond:
+                state.queue.remove(ticket)
+                self._cond.notify_all()
+
+    def refund(self, provider, model, tokens):
+        """Return (or charge, if negative) the difference between estimated and actual token usage."""
+        with self._cond:
+            state = self._state(provider, model)
+            if state.tokens is not None and tokens:
+                state.tokens.consume(-tokens)
+            self._cond.notify_all()
+
+    def block(self, provider, model, delay):
+        """Hold every queued caller for `delay` seconds after a rate-limit response."""
+        with self._cond:
+            state = self._state(provider, model)
+            state.blocked_until = max(state.blocked_until, time.monotonic() + delay)
+            self._cond.notify_all()
+
+    def backoff(self, attempt, retry_after=None):
+        """Delay before the next retry: the server's hint if given, otherwise jittered exponential backoff."""
+        if retry_after is not None:
+            return retry_after + random.uniform(0, min(1.0, retry_after * 0.1))
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+rate_limiter = RateLimiter()
+
+def configure_rate_limit(provider, model=None, rpm=None, tpm=None):
+    """Limit requests and/or tokens per minute for a provider or a single model."""
+    rate_limiter.configure(provider, model, rpm, tpm)
+
+def is_rate_limit_error(error):
+    """Recognise 429 responses from the OpenAI, Groq and Gemini SDKs."""
+    if getattr(error, 'status_code', None) == 429 or getattr(error, 'code', None) == 429:
+        return True
+    return type(error).__name__ in ('RateLimitError', 'ResourceExhausted', 'TooManyRequests')
+
+def _parse_duration(value):
+    """Parse '20', '1.5', '20ms', '1s' or '6m0s' into seconds."""
+    value = str(value).strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        pass
+    else:
+        # float() also accepts 'nan' and 'inf'
+        return seconds if math.isfinite(seconds) else None
+    # Malformed values such as '1.5.3s' are not a duration
+    if not re.fullmatch(r'(?:\d+(?:\.\d+)?(?:ms|h|m|s))+', value):
+        return None
+    scale = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(number) * scale[unit] for number, unit in re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value))
+
+def get_retry_after(error):
+    """Read how long to wait from the Retry-After or x-ratelimit-reset-* headers of a 429 response."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+
+    if headers.get('retry-after-ms'):
+        retry_after_ms = _parse_duration(headers['retry-after-ms'])
+        if retry_after_ms is not None:
+            return retry_after_ms / 1000
+        # Unparseable; fall back to the other headers
+    if headers.get('retry-after'):
+        retry_after = _parse_duration(headers['retry-after'])
+        if retry_after is None:
+            # HTTP-date form
+            try:
+                retry_at = email.utils.parsedate_to_datetime(headers['retry-after'])
+                return max(0, retry_at.timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+        return retry_after
+
+    resets = [_parse_duration(headers[name]) for name in ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens')
+              if headers.get(name)]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+def _estimate_tokens(provider, model, messages, max_tokens):
+    """Tokens to reserve against a TPM budget: the prompt plus the completion ceiling."""
+    if not rate_limiter.has_token_budget(provider, model):
+        return 0
+    return token_counter.count_prompt_tokens(messages) + (max_tokens or 0)
+
+def _on_rate_limited(log_and_call_manager, chain_id, provider, model, error, attempt):
+    if not is_rate_limit_error(error) or attempt >= rate_limiter.max_retries:
+        return None
+
+    delay = rate_limiter.backoff(attempt, get_retry_after(error))
+    rate_limiter.block(provider, model, delay)
+    log_and_call_manager.record_retry(chain_id, provider, model)
+    output_handler.print_wrapper(
+        f"Rate limit reached for {provider}/{model}. Retrying in {delay:.1f} seconds "
+        f"(attempt {attempt + 1} of {rate_limiter.max_retries})."
     )
-    
-    # Unpack results
+    return delay
+
+def _settle_tokens(provider, model, estimated_tokens, result):
+    if estimated_tokens:
+        rate_limiter.refund(provider, model, estimated_tokens - (result[2] + result[3]))
+
+def call_with_rate_limit(log_and_call_manager, chain_id, provider, model, messages, max_tokens, function, *args):
+    """Run a provider call inside the rate limiter, retrying 429 responses with backoff."""
+    estimated_tokens = _estimate_tokens(provider, model, messages, max_tokens)
+    attempt = 0
+    while True:
+        with tracing.span('rate_limit_wait', chain_id):
+            rate_limiter.acquire(provider, model, estimated_tokens)
+        try:
+            with tracing.span(f"{provider} request", chain_id, model=model, agent=current_agent.get()):
+                result = function(*args)
+        except Exception as error:
+            if _on_rate_limited(log_and_call_manager, chain_id, provider, model, error, attempt) is None:
+                raise
+            attempt += 1
+            continue
+        _settle_tokens(provider, model, estimated_tokens, result)
+        return result
+
+async def acall_with_rate_limit(log_and_call_manager, chain_id, provider, model, messages, max_tokens, function, *args):
+    """Coroutine counterpart of call_with_rate_limit."""
+    estimated_tokens = _estimate_tokens(provider, model, messages, max_tokens)
+    attempt = 0
+    while True:
+        with tracing.span('rate_limit_wait', chain_id):
+            await rate_limiter.aacquire(provider, model, estimated_tokens)
+        try:
+            with tracing.span(f"{provider} request", chain_id, model=model, agent=current_agent.get()):
+                result = await function(*args)
+        except Exception as error:
+            if _on_rate_limited(log_and_call_manager, chain_id, provider, model, error, attempt) is None:
+                raise
+            attempt += 1
+            continue
+        _settle_tokens(provider, model, estimated_tokens, result)
+        return result
+
+def _cache_lookup(log_and_call_manager, chain_id, provider, model, temperature, max_tokens, messages, tools=None):
+    """Return (cache, key, cached entry) for a call, or (None, None, None) when caching does not apply."""
+    cache = llm_cache.get_cache()
+    if cache is None or not llm_cache.is_cacheable(temperature, tools):
+        return None, None, None
+
+    key = cache.make_key(provider, model, temperature, max_tokens, messages)
+    cached = cache.get(key)
+    log_and_call_manager.record_cache_event(chain_id, cached is not None)
+    return cache, key, cached
+
+async def _run_blocking(function, *args, **kwargs):
+    """Run a blocking function in the default executor, with the caller's context variables."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, functools.partial(context.run, function, *args, **kwargs))
+
+async def _acache_lookup(log_and_call_manager, chain_id, provider, model, temperature, max_tokens, messages, tools=None):
+    """_cache_lookup for coroutines; the SQLite read runs off the event loop."""
+    if not llm_cache.is_cacheable(temperature, tools):
+        return None, None, None
+    # With INSIGHTAI_LLM_CACHE unset, get_cache() only returns a cache enabled from code and never opens one
+    if os.getenv('INSIGHTAI_LLM_CACHE', '').lower() not in ('1', 'true', 'yes') and llm_cache.get_cache() is None:
+        return None, None, None
+    return await _run_blocking(_cache_lookup, log_and_call_manager, chain_id, provider, model, temperature,
+                               max_tokens, messages, tools)
+
+def _cached_result(cached, messages, start_time):
+    """Build a provider-style result tuple from a cache entry. No tokens were spent on a cache hit."""
+    elapsed_time = time.time() - start_time
+    return cached['content'], messages, 0, 0, 0, elapsed_time, 0
+
+def _replay_stream(content):
+    """Print a cached response the same way the provider streaming functions do."""
+    output_handler.print_wrapper(content, end='', flush=True)
+    output_handler.print_wrapper("")
+
+# Provider name -> module implementing llm_call/llm_stream (and optionally allm_call/allm_stream)
+PROVIDER_MODULES = {
+    'groq': 'groq_models',
+    'openai': 'openai_models',
+    'gemini': 'gemini_models',
+    'replay': 'replay_models',
+}
+
+def get_provider_function(provider, function_name):
+    """Look up a provider's implementation of llm_call, llm_stream, allm_call or allm_stream."""
+    if provider not in PROVIDER_MODULES:
+        raise ValueError(f"Unsupported provider: {provider}")
+
+    provider_module = try_import(PROVIDER_MODULES[provider])
+    function = getattr(provider_module, function_name, None)
+    if function is None and function_name.startswith('a'):
+        # No native async implementation: run the blocking one in the default executor
+        sync_function = getattr(provider_module, function_name[1:])
+
+        async def function(*args, **kwargs):
+            return await _run_blocking(sync_function, *args, **kwargs)
+
+    return function
+
+class HedgeCancelled(BaseException):
+    """Raised inside a hedge attempt that lost the race, to abort its stream.
+
+    Derives from BaseException (like asyncio.CancelledError) so that provider error
+    handling and the rate-limit retry loop let it through untouched.
+    """
+
+class _HedgeRace:
+    """Race between an agent's primary model and its fallbacks.
+
+    The first attempt to produce a token (or, for non-streaming calls, a response) wins;
+    only its tokens reach the console. A new attempt is started whenever the running ones
+    have produced nothing within `hedge_after` seconds, or all of them have failed.
+    """
+    def __init__(self, attempts, hedge_after, wake):
+        self.attempts = attempts
+        self.hedge_after = hedge_after
+        self.deadline = time.monotonic() + hedge_after
+        self.winner = None
+        self.failed = {}
+        self._wake = wake
+        self._lock = threading.Lock()
+
+    def claim(self, index):
+        """Try to make attempt `index` the winner. Returns whether it is the winner."""
+        with self._lock:
+            if self.winner is None:
+                self.winner = index
+                self._wake()
+            return self.winner == index
+
+    def on_token(self, index):
+        """Token callback for attempt `index`: print if it wins, abort it if it lost."""
+        def on_token(text):
+            if not self.claim(index):
+                raise HedgeCancelled()
+            output_handler.print_wrapper(text, end='', flush=True)
+        return on_token
+
+    def wrap(self, index, function):
+        """Wrap a provider function so that an attempt that already lost never sends its request."""
+        def attempt(*args, **kwargs):
+            if self.winner not in (None, index):
+                raise HedgeCancelled()
+            return function(*args, **kwargs)
+        return attempt
+
+    def next_step(self, jobs):
+        """Decide what to do given the running futures or tasks, keyed by attempt index.
+
+        Returns ('done', index), ('start', index), ('raise', error) or ('wait', timeout).
+        """
+        for index, job in jobs.items():
+            if job.done() and index not in self.failed:
+                if job.exception() is not None:
+                    self.failed[index] = job.exception()
+                else:
+                    # Finished without streaming any content
+                    self.claim(index)
+
+        if self.winner is not None:
+            return 'done', self.winner
+
+        now = time.monotonic()
+        running = len(jobs) - len(self.failed)
+        can_hedge = len(jobs) < len(self.attempts)
+        if can_hedge and (running == 0 or now >= self.deadline):
+            self.deadline = now + self.hedge_after
+            return 'start', len(jobs)
+        if running == 0:
+            return 'raise', list(self.failed.values())[-1]
+        return 'wait', max(0, self.deadline - now) if can_hedge else None
+
+def _announce_hedge(race, index):
+    if index == 0:
+        return
+    model, provider = race.attempts[index][:2]
+    if race.failed and len(race.failed) == index:
+        output_handler.print_wrapper(f"Previous model failed; failing over to {provider}/{model}.")
+    else:
+        output_handler.print_wrapper(
+            f"No response after {race.hedge_after:g} seconds; sending hedge request to {provider}/{model}."
+        )
+
+def _attempt_args(race, index, function_name, log_and_call_manager, chain_id, messages, tools):
+    """Provider function and arguments for one attempt. Each attempt gets its own copy of the messages."""
+    model, provider, max_tokens, temperature = race.attempts[index]
+    function = get_provider_function(provider, function_name)
+    if function_name.endswith('stream'):
+        function = functools.partial(function, on_token=race.on_token(index))
+        args = (log_and_call_manager, chain_id, list(messages), model, temperature, max_tokens, tools)
+    else:
+        args = (list(messages), model, temperature, max_tokens)
+    return (log_and_call_manager, chain_id, provider, model, messages, max_tokens, race.wrap(index, function)) + args
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+def _get_hedge_executor():
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_executor_lock:
+            if _hedge_executor is None:
+                _hedge_executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix='insightai-hedge')
+    return _hedge_executor
+
+def hedged_call(log_and_call_manager, chain_id, attempts, hedge_after, function_name, messages, tools=None):
+    """Run `function_name` ('llm_call' or 'llm_stream') against the attempts, hedging on slow first tokens.
+
+    Returns (winning attempt, result). Losing streams are aborted on their next token; a losing
+    blocking call cannot be interrupted, so its response is simply discarded.
+    """
+    wake = threading.Event()
+    race = _HedgeRace(attempts, hedge_after, wake.set)
+    jobs = {}
+    executor = _get_hedge_executor()
+
+    while True:
+        wake.clear()
+        step, value = race.next_step(jobs)
+        if step == 'done':
+            for index, job in jobs.items():
+                if index != value:
+                    job.cancel()
+            return attempts[value], jobs[value].result()
+        if step == 'raise':
+            raise value
+        if step == 'start':
+            _announce_hedge(race, value)
+            args = _attempt_args(race, value, function_name, log_and_call_manager, chain_id, messages, tools)
+            jobs[value] = executor.submit(contextvars.copy_context().run, call_with_rate_limit, *args)
+            jobs[value].add_done_callback(lambda _: wake.set())
+        else:
+            wake.wait(value)
+
+async def ahedged_call(log_and_call_manager, chain_id, attempts, hedge_after, function_name, messages, tools=None):
+    """Coroutine counterpart of hedged_call for 'allm_call' and 'allm_stream'. Losing attempts are cancelled."""
+    wake = asyncio.Event()
+    race = _HedgeRace(attempts, hedge_after, wake.set)
+    jobs = {}
+
+    def on_done(task):
+        if not task.cancelled():
+            task.exception()  # Retrieved here so losers do not warn about unretrieved exceptions
+        wake.set()
+
+    try:
+        while True:
+            wake.clear()
+            step, value = race.next_step(jobs)
+            if step == 'done':
+                for index, job in jobs.items():
+                    if index != value:
+                        job.cancel()
+                return attempts[value], await jobs[value]
+            if step == 'raise':
+                raise value
+            if step == 'start':
+                _announce_hedge(race, value)
+                args = _attempt_args(race, value, function_name, log_and_call_manager, chain_id, messages, tools)
+                jobs[value] = asyncio.ensure_future(acall_with_rate_limit(*args))
+                jobs[value].add_done_callback(on_done)
+            else:
+                try:
+                    await asyncio.wait_for(wake.wait(), value)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        for job in jobs.values():
+            job.cancel()
+
+def _finish_call(log_and_call_manager, agent, chain_id, timestamp, model, provider, result, cache, cache_key, cached,
+                 clean_sql=False):
+    """Store a fresh result in the cache, clean it up and log it. Returns the response content."""
+    # Unpack results. Streaming providers append the time to first token.
     (content_received, local_llm_messages, prompt_tokens_used,
      completion_tokens_used, total_tokens_used, elapsed_time,
-     tokens_per_second) = result
+     tokens_per_second) = result[:7]
+    time_to_first_token = result[7] if len(result) > 7 else None
+
+    if cache is not None and cached is None:
+        cache.put(cache_key, provider, model, content_received,
+                  prompt_tokens_used, completion_tokens_used, total_tokens_used)
+
+    if cached is None and provider != 'replay' and get_llm_mode() == 'record':
+        try_import('replay_models').record(agent, chain_id, timestamp, model, provider, result)
 
-    if agent == 'SQL Generator':
+    if clean_sql and agent == 'SQL Generator':
         # Strip any markdown or explanatory text from SQL
         content_received = re.sub(r'```sql\s*|\s*```', '', content_received)
         content_received = re.sub(r'^.*?--', '--', content_received, flags=re.DOTALL)
@@ -139,44 +929,142 @@ def llm_call(log_and_call_manager, messages: str, agent: str = None, chain_id: s
     log_and_call_manager.write_to_log(
         agent, chain_id, timestamp, model, local_llm_messages,
         content_received, prompt_tokens_used, completion_tokens_used,
-        total_tokens_used, elapsed_time, tokens_per_second
+        total_tokens_used, elapsed_time, tokens_per_second,
+        cached=cached is not None, time_to_first_token=time_to_first_token, provider=provider
     )
 
     return content_received
 
+def llm_call(log_and_call_manager, messages: str, agent: str = None, chain_id: str = None,
+             temperature: float = None):
+    """Make a non-streaming LLM call. `temperature` overrides the agent's configured temperature."""
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    start_time = time.time()
+    current_agent.set(agent)
+    attempts, hedge_after = get_hedge_plan(agent, temperature)
+    model, provider, max_tokens, temperature = attempts[0]
+    provider_function = get_provider_function(provider, 'llm_call')
+
+    cache, cache_key, cached = _cache_lookup(
+        log_and_call_manager, chain_id, provider, model, temperature, max_tokens, messages
+    )
+
+    if cached is not None:
+        result = _cached_result(cached, messages, start_time)
+    elif len(attempts) > 1:
+        attempt, result = hedged_call(
+            log_and_call_manager, chain_id, attempts, hedge_after, 'llm_call', messages
+        )
+        if attempt is not attempts[0]:
+            # The cache key belongs to the primary model, so a fallback's answer is not stored
+            model, provider, cache = attempt[0], attempt[1], None
+    else:
+        result = call_with_rate_limit(
+            log_and_call_manager, chain_id, provider, model, messages, max_tokens,
+            provider_function, messages, model, temperature, max_tokens
+        )
+
+    return _finish_call(log_and_call_manager, agent, chain_id, timestamp, model, provider,
+                        result, cache, cache_key, cached, clean_sql=True)
+
 def llm_stream(log_and_call_manager, messages: str, agent: str = None, 
-               chain_id: str = None, tools: str = None):
-    """Make a streaming LLM call."""
+               chain_id: str = None, tools: str = None, temperature: float = None):
+    """Make a streaming LLM call. `temperature` overrides the agent's configured temperature."""
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-    model, provider, max_tokens, temperature = init(agent)
+    start_time = time.time()
+    current_agent.set(agent)
+    attempts, hedge_after = get_hedge_plan(agent, temperature)
+    model, provider, max_tokens, temperature = attempts[0]
+    provider_function = get_provider_function(provider, 'llm_stream')
 
-    provider_function_map = {
-        'groq': 'llm_stream',
-        'openai': 'llm_stream',
-        'gemini': 'llm_stream',
-    }
+    cache, cache_key, cached = _cache_lookup(
+        log_and_call_manager, chain_id, provider, model, temperature, max_tokens, messages, tools
+    )
 
-    if provider not in provider_function_map:
-        raise ValueError(f"Unsupported provider: {provider}")
+    if cached is not None:
+        _replay_stream(cached['content'])
+        result = _cached_result(cached, messages, start_time)
+    elif len(attempts) > 1:
+        attempt, result = hedged_call(
+            log_and_call_manager, chain_id, attempts, hedge_after, 'llm_stream', messages, tools
+        )
+        if attempt is not attempts[0]:
+            # The cache key belongs to the primary model, so a fallback's answer is not stored
+            model, provider, cache = attempt[0], attempt[1], None
+    else:
+        result = call_with_rate_limit(
+            log_and_call_manager, chain_id, provider, model, messages, max_tokens,
+            provider_function, log_and_call_manager, chain_id, messages,
+            model, temperature, max_tokens, tools
+        )
 
-    provider_module = try_import(f'{provider}_models')
-    function_name = provider_function_map[provider]
-    
-    result = getattr(provider_module, function_name)(
-        log_and_call_manager, chain_id, messages,
-        model, temperature, max_tokens, tools
+    return _finish_call(log_and_call_manager, agent, chain_id, timestamp, model, provider,
+                        result, cache, cache_key, cached)
+
+async def allm_call(log_and_call_manager, messages: str, agent: str = None, chain_id: str = None,
+                    temperature: float = None):
+    """Coroutine counterpart of llm_call."""
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    start_time = time.time()
+    current_agent.set(agent)
+    attempts, hedge_after = get_hedge_plan(agent, temperature)
+    model, provider, max_tokens, temperature = attempts[0]
+    provider_function = get_provider_function(provider, 'allm_call')
+
+    cache, cache_key, cached = await _acache_lookup(
+        log_and_call_manager, chain_id, provider, model, temperature, max_tokens, messages
     )
-    
-    # Unpack results
-    (content_received, local_llm_messages, prompt_tokens_used,
-     completion_tokens_used, total_tokens_used, elapsed_time,
-     tokens_per_second) = result
 
-    # Log results
-    log_and_call_manager.write_to_log(
-        agent, chain_id, timestamp, model, local_llm_messages,
-        content_received, prompt_tokens_used, completion_tokens_used,
-        total_tokens_used, elapsed_time, tokens_per_second
+    if cached is not None:
+        result = _cached_result(cached, messages, start_time)
+    elif len(attempts) > 1:
+        attempt, result = await ahedged_call(
+            log_and_call_manager, chain_id, attempts, hedge_after, 'allm_call', messages
+        )
+        if attempt is not attempts[0]:
+            # The cache key belongs to the primary model, so a fallback's answer is not stored
+            model, provider, cache = attempt[0], attempt[1], None
+    else:
+        result = await acall_with_rate_limit(
+            log_and_call_manager, chain_id, provider, model, messages, max_tokens,
+            provider_function, messages, model, temperature, max_tokens
+        )
+
+    # Storing in the cache (and recording) writes to disk; keep it off the event loop
+    return await _run_blocking(_finish_call, log_and_call_manager, agent, chain_id, timestamp, model, provider,
+                               result, cache, cache_key, cached, clean_sql=True)
+
+async def allm_stream(log_and_call_manager, messages: str, agent: str = None,
+                      chain_id: str = None, tools: str = None, temperature: float = None):
+    """Coroutine counterpart of llm_stream."""
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    start_time = time.time()
+    current_agent.set(agent)
+    attempts, hedge_after = get_hedge_plan(agent, temperature)
+    model, provider, max_tokens, temperature = attempts[0]
+    provider_function = get_provider_function(provider, 'allm_stream')
+
+    cache, cache_key, cached = await _acache_lookup(
+        log_and_call_manager, chain_id, provider, model, temperature, max_tokens, messages, tools
     )
 
-    return content_received
\ No newline at end of file
+    if cached is not None:
+        _replay_stream(cached['content'])
+        result = _cached_result(cached, messages, start_time)
+    elif len(attempts) > 1:
+        attempt, result = await ahedged_call(
+            log_and_call_manager, chain_id, attempts, hedge_after, 'allm_stream', messages, tools
+        )
+        if attempt is not attempts[0]:
+            # The cache key belongs to the primary model, so a fallback's answer is not stored
+            model, provider, cache = attempt[0], attempt[1], None
+    else:
+        result = await acall_with_rate_limit(
+            log_and_call_manager, chain_id, provider, model, messages, max_tokens,
+            provider_function, log_and_call_manager, chain_id, messages,
+            model, temperature, max_tokens, tools
+        )
+
+    # Storing in the cache (and recording) writes to disk; keep it off the event loop
+    return await _run_blocking(_finish_call, log_and_call_manager, agent, chain_id, timestamp, model, provider,
+                               result, cache, cache_key, cached)
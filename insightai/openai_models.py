@@ -1,65 +1,52 @@
 import json
 import os
 import time
+import httpx
 import openai
-import tiktoken
 
 try:
     # Attempt package-relative import
-    from . import output_manager, prompts, utils
+    from . import models, output_manager
 except ImportError:
     # Fall back to script-style import
-    import output_manager, prompts, utils
+    import models, output_manager
 
 output_handler = output_manager.OutputManager()
 
+def create_client(api_key, base_url, pool_limits):
+    """Build an OpenAI client with a keep-alive connection pool. Called once per key by models.client_registry."""
+    http_client_class = getattr(openai, 'DefaultHttpxClient', httpx.Client)
+    http_client = http_client_class(limits=httpx.Limits(**pool_limits))
+    return openai.OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
+def create_async_client(api_key, base_url, pool_limits):
+    """Build an AsyncOpenAI client with a keep-alive connection pool bound to the running loop."""
+    http_client_class = getattr(openai, 'DefaultAsyncHttpxClient', httpx.AsyncClient)
+    http_client = http_client_class(limits=httpx.Limits(**pool_limits))
+    return openai.AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
 def init():
     API_KEY = os.environ.get('OPENAI_API_KEY')
     if API_KEY is None:
         output_handler.print_wrapper("Warning: OPENAI_API_KEY environment variable not found.")
         return
     else:
-        openai_client = openai.OpenAI()
-        openai_client.api_key = API_KEY
-        return openai_client
-
-def llm_call(messages: str,model: str,temperature: str,max_tokens: str):  
-
-    openai_client = init()
-
-    try:
-        start_time = time.time()
-        response = openai_client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-        end_time = time.time()
-    except openai.RateLimitError:
-        output_handler.print_wrapper(
-            "The OpenAI API rate limit has been exceeded. Waiting 10 seconds and trying again."
-        )
-        time.sleep(10)
-        start_time = time.time()
-        response = openai_client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-        end_time = time.time()
+        return models.get_client('openai')
 
-    elapsed_time = end_time - start_time
+def ainit():
+    API_KEY = os.environ.get('OPENAI_API_KEY')
+    if API_KEY is None:
+        output_handler.print_wrapper("Warning: OPENAI_API_KEY environment variable not found.")
+        return
+    else:
+        return models.get_async_client('openai')
 
+def _call_result(response, messages, elapsed_time):
     content = response.choices[0].message.content.strip()
-    prompt_tokens = response.usage.prompt_tokens
-    completion_tokens = response.usage.completion_tokens
-    total_tokens = response.usage.total_tokens
+    prompt_tokens_used = response.usage.prompt_tokens
+    completion_tokens_used = response.usage.completion_tokens
+    total_tokens_used = response.usage.total_tokens
 
-    prompt_tokens_used = prompt_tokens
-    completion_tokens_used = completion_tokens
-    total_tokens_used = total_tokens
     if elapsed_time > 0:
         tokens_per_second = completion_tokens_used / elapsed_time
     else:
@@ -67,56 +54,82 @@ def llm_call(messages: str,model: str,temperature: str,max_tokens: str):
 
     return content, messages, prompt_tokens_used, completion_tokens_used, total_tokens_used, elapsed_time, tokens_per_second
 
-def llm_stream(log_and_call_manager, chain_id: str, messages: str,model: str,temperature: str,max_tokens: str,tools: str = None):  
-    collected_chunks = []
-    collected_messages = []
-    tool_calls = []
+def llm_call(messages: str,model: str,temperature: str,max_tokens: str):
 
     openai_client = init()
 
+    # Rate limits are handled by models.call_with_rate_limit, which queues and retries with backoff
+    start_time = time.time()
     response = openai_client.chat.completions.create(
         model=model,
         messages=messages,
         temperature=temperature,
         max_tokens=max_tokens,
-        tools=tools,
-        stream = True
     )
-    
+    end_time = time.time()
+
+    elapsed_time = end_time - start_time
+
+    return _call_result(response, messages, elapsed_time)
+
+async def allm_call(messages: str, model: str, temperature: str, max_tokens: str):
+    """Coroutine counterpart of llm_call using the async OpenAI client."""
+    openai_client = ainit()
+
+    # Rate limits are handled by models.call_with_rate_limit, which queues and retries with backoff
     start_time = time.time()
-    # iterate through the stream of events
-    for chunk in response:
-        delta = chunk.choices[0].delta
-        collected_chunks.append(chunk)  # save the event response
-
-        if delta and delta.content:
-            collected_messages.append(delta.content)  # save the message
-            # Only stream to console for high-level creative/info agents
-            if agent not in ['Expert Selector', 'Analyst Selector', 'Solution Summarizer']:
-                output_handler.print_wrapper(delta.content, end='', flush=True)
-        elif delta and delta.tool_calls:
-            tcchunklist = delta.tool_calls
-            for tcchunk in tcchunklist:
-                if len(tool_calls) <= tcchunk.index:
-                    tool_calls.append({"id": "", "type": "function", "function": { "name": "", "arguments": "" } })
-                tc = tool_calls[tcchunk.index] 
-
-                if tcchunk.id:
-                    tc["id"] += tcchunk.id
-                if tcchunk.function.name:
-                    tc["function"]["name"] += tcchunk.function.name
-                if tcchunk.function.arguments:
-                    tc["function"]["arguments"] += tcchunk.function.arguments
+    response = await openai_client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
+    end_time = time.time()
+
+    elapsed_time = end_time - start_time
+
+    return _call_result(response, messages, elapsed_time)
+
+def _collect_chunk(chunk, stats, collected_messages, tool_calls):
+    """Accumulate one streamed chunk, echoing any content to the console."""
+    usage = getattr(chunk, 'usage', None)
+    if usage:
+        stats.add_usage(usage.prompt_tokens, usage.completion_tokens)
+
+    # The final chunk requested via include_usage carries usage only
+    if not chunk.choices:
+        return
 
+    delta = chunk.choices[0].delta
+
+    if delta and delta.content:
+        stats.emit(delta.content)
+        collected_messages.append(delta.content)  # save the message
+    elif delta and delta.tool_calls:
+        tcchunklist = delta.tool_calls
+        for tcchunk in tcchunklist:
+            if len(tool_calls) <= tcchunk.index:
+                tool_calls.append({"id": "", "type": "function", "function": { "name": "", "arguments": "" } })
+            tc = tool_calls[tcchunk.index]
+
+            if tcchunk.id:
+                tc["id"] += tcchunk.id
+            if tcchunk.function.name:
+                tc["function"]["name"] += tcchunk.function.name
+            if tcchunk.function.arguments:
+                tc["function"]["arguments"] += tcchunk.function.arguments
+
+def _append_tool_calls(messages, tool_calls):
+    """Append the assistant tool call and the tool responses to the message history."""
     if tool_calls:
         messages.append(
             {
                 "tool_calls": tool_calls,
                 "role": 'assistant',
-            }                    
+            }
         )
-    
-    for index, tool_call in enumerate(tool_calls):
+
+    for tool_call in tool_calls:
         function_name = tool_call['function']['name']
         function_args = json.loads(tool_call['function']['arguments'])
         messages.append(
@@ -128,58 +141,113 @@ def llm_stream(log_and_call_manager, chain_id: str, messages: str,model: str,tem
             }
         )
 
-        if index == len(tool_calls) - 1:
-            response = openai_client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=True
-            )
-
-    # iterate through the stream of events
-    for chunk in response:
-        delta = chunk.choices[0].delta
-        collected_chunks.append(chunk)  # save the event response
-
-        if delta and delta.content:
-            collected_messages.append(delta.content)  # save the message
-            if agent not in ['Expert Selector', 'Analyst Selector', 'Solution Summarizer']:
-                output_handler.print_wrapper(delta.content, end='', flush=True)
-
-
+def _stream_result(messages, stats, collected_messages):
     end_time = time.time()
-    elapsed_time = end_time - start_time
-    
+    elapsed_time = end_time - stats.start_time
+
     output_handler.print_wrapper("")
 
     # get the complete text received
     full_reply_content = ''.join([m for m in collected_messages])
 
-    # count the number of response tokens used
-    completion_tokens_used = len(collected_chunks)
-
-    # count the number of prompt tokens used
-    encoding = tiktoken.encoding_for_model("gpt-4")   
-    tokens_per_message = 3
-    tokens_per_name = 1
-    prompt_tokens_used = 0
-    
-    for message in messages:
-        prompt_tokens_used += tokens_per_message
-        for key, value in message.items():
-            if isinstance(value, str):
-                prompt_tokens_used += len(encoding.encode(value))
-            if key == "name":
-                prompt_tokens_used += tokens_per_name
-    prompt_tokens_used += 3  # every reply is primed with <|start|>assistant<|message|>
-    
+    # use the usage reported by the API, tokenizing locally only if it is missing
+    prompt_tokens_used, completion_tokens_used = stats.resolve_usage(messages, full_reply_content)
+
     # calculate the total tokens used
     total_tokens_used = prompt_tokens_used + completion_tokens_used
-    
+
     if elapsed_time > 0:
         tokens_per_second = completion_tokens_used / elapsed_time
     else:
         tokens_per_second = 0
 
-    return full_reply_content, messages, prompt_tokens_used, completion_tokens_used, total_tokens_used, elapsed_time, tokens_per_second
\ No newline at end of file
+    return (full_reply_content, messages, prompt_tokens_used, completion_tokens_used, total_tokens_used,
+            elapsed_time, tokens_per_second, stats.time_to_first_token)
+
+def _read_stream(response, stats, collected_messages, tool_calls):
+    # A hedge attempt that lost is stopped mid-stream by HedgeCancelled; close the stream so its connection is released
+    try:
+        for chunk in response:
+            _collect_chunk(chunk, stats, collected_messages, tool_calls)
+    finally:
+        response.close()
+
+async def _aread_stream(response, stats, collected_messages, tool_calls):
+    try:
+        async for chunk in response:
+            _collect_chunk(chunk, stats, collected_messages, tool_calls)
+    finally:
+        await response.close()
+
+def llm_stream(log_and_call_manager, chain_id: str, messages: str,model: str,temperature: str,max_tokens: str,tools: str = None, on_token=None):
+    collected_messages = []
+    tool_calls = []
+
+    openai_client = init()
+
+    stats = models.StreamStats(on_token)
+    response = openai_client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        tools=tools,
+        stream = True,
+        stream_options={"include_usage": True}
+    )
+
+    # iterate through the stream of events
+    _read_stream(response, stats, collected_messages, tool_calls)
+
+    if tool_calls:
+        _append_tool_calls(messages, tool_calls)
+
+        response = openai_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+        # iterate through the stream of events
+        _read_stream(response, stats, collected_messages, tool_calls)
+
+    return _stream_result(messages, stats, collected_messages)
+
+async def allm_stream(log_and_call_manager, chain_id: str, messages: str, model: str, temperature: str, max_tokens: str, tools: str = None, on_token=None):
+    """Coroutine counterpart of llm_stream using the async OpenAI client."""
+    collected_messages = []
+    tool_calls = []
+
+    openai_client = ainit()
+
+    stats = models.StreamStats(on_token)
+    response = await openai_client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        tools=tools,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+
+    await _aread_stream(response, stats, collected_messages, tool_calls)
+
+    if tool_calls:
+        _append_tool_calls(messages, tool_calls)
+
+        response = await openai_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+        await _aread_stream(response, stats, collected_messages, tool_calls)
+
+    return _stream_result(messages, stats, collected_messages)
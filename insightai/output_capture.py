@@ -0,0 +1,139 @@
+import builtins
+import collections
+import io
+import os
+import sys
+
+import pandas as pd
+
+DEFAULT_MAX_CHARS = 20000  # About 5k tokens of execution output kept for the prompts
+CHARS_PER_TOKEN = 4  # Rough ratio used to turn INSIGHTAI_EXEC_OUTPUT_MAX_TOKENS into characters
+SUMMARY_MIN_ROWS = 50  # Printed frames and series longer than this are replaced by a summary
+SUMMARY_ROWS = 5  # Rows shown from each end of a summarized frame
+DESCRIBE_MAX_ROWS = 1000000  # Larger frames are described from a sample of this many rows
+DESCRIBE_MAX_COLUMNS = 20
+
+def max_output_chars():
+    """Cap on captured execution output in characters, from the environment. 0 means no cap."""
+    if os.getenv('INSIGHTAI_EXEC_OUTPUT_MAX_CHARS'):
+        return int(os.getenv('INSIGHTAI_EXEC_OUTPUT_MAX_CHARS'))
+    if os.getenv('INSIGHTAI_EXEC_OUTPUT_MAX_TOKENS'):
+        return int(os.getenv('INSIGHTAI_EXEC_OUTPUT_MAX_TOKENS')) * CHARS_PER_TOKEN
+    return DEFAULT_MAX_CHARS
+
+def summaries_enabled():
+    return os.getenv('INSIGHTAI_EXEC_OUTPUT_SUMMARIES', '1').lower() not in ('0', 'false', 'no')
+
+class BoundedOutput(io.TextIOBase):
+    """Write-only text stream that keeps the head and the tail of what is written.
+
+    Up to half of `max_chars` is kept from the start and half from the end; the middle is
+    dropped as it arrives, so memory stays bounded however much generated code prints.
+    getvalue() marks where output was omitted.
+    """
+    def __init__(self, max_chars=None):
+        self.max_chars = max_output_chars() if max_chars is None else max_chars
+        self._head_limit = self.max_chars // 2
+        self._tail_limit = self.max_chars - self._head_limit
+        self.total_chars = 0
+        self.summarized = 0  # Frames and series printed as summaries (see summarizing_print)
+        self._head = []
+        self._head_chars = 0
+        self._tail = collections.deque()
+        self._tail_chars = 0
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        length = len(text)
+        self.total_chars += length
+        if not self.max_chars:
+            self._head.append(text)
+            return length
+
+        room = self._head_limit - self._head_chars
+        if room > 0:
+            self._head.append(text[:room])
+            self._head_chars += len(text[:room])
+            text = text[room:]
+        if text:
+            self._tail.append(text)
+            self._tail_chars += len(text)
+            # Drop whole chunks that lie entirely before the last _tail_limit characters
+            while self._tail_chars - len(self._tail[0]) >= self._tail_limit:
+                self._tail_chars -= len(self._tail.popleft())
+        return length
+
+    @property
+    def omitted_chars(self):
+        if not self.max_chars:
+            return 0
+        return self.total_chars - self._head_chars - min(self._tail_chars, self._tail_limit)
+
+    def getvalue(self):
+        head = ''.join(self._head)
+        if not self._tail:
+            return head
+        tail = ''.join(self._tail)[-self._tail_limit:]
+        if not self.omitted_chars:
+            return head + tail
+        return f"{head}\n... [{self.omitted_chars} characters of output omitted] ...\n{tail}"
+
+    def truncation(self):
+        """What was dropped from the output, for logs and display."""
+        return {
+            'total_chars': self.total_chars,
+            'kept_chars': self.total_chars - self.omitted_chars,
+            'omitted_chars': self.omitted_chars,
+            'summarized_objects': self.summarized,
+        }
+
+    def clear(self):
+        self.total_chars = self.summarized = self._head_chars = self._tail_chars = 0
+        self._head.clear()
+        self._tail.clear()
+
+def summarize_object(obj):
+    """Compact text for a large DataFrame or Series: shape, first and last rows, and describe()."""
+    if isinstance(obj, pd.DataFrame):
+        title = f"<DataFrame: {obj.shape[0]} rows x {obj.shape[1]} columns>"
+        columns = obj.iloc[:, :DESCRIBE_MAX_COLUMNS]
+    else:
+        title = f"<Series '{obj.name}': {len(obj)} values, dtype {obj.dtype}>"
+        columns = obj
+    sample = columns.sample(DESCRIBE_MAX_ROWS, random_state=0) if len(columns) > DESCRIBE_MAX_ROWS else columns
+    try:
+        described = sample.describe().to_string()
+    except (TypeError, ValueError):
+        described = None
+
+    parts = [title, f"First {SUMMARY_ROWS} rows:", obj.head(SUMMARY_ROWS).to_string(),
+             f"Last {SUMMARY_ROWS} rows:", obj.tail(SUMMARY_ROWS).to_string()]
+    if described is not None:
+        scope = f" (sample of {DESCRIBE_MAX_ROWS} rows)" if sample is not columns else ''
+        if isinstance(obj, pd.DataFrame) and obj.shape[1] > DESCRIBE_MAX_COLUMNS:
+            scope += f" (first {DESCRIBE_MAX_COLUMNS} columns)"
+        parts += [f"Summary statistics{scope}:", described]
+    return '\n'.join(parts)
+
+def summarizing_print(*args, **kwargs):
+    """print() for generated code: large DataFrames and Series written to stdout are summarized."""
+    stream = kwargs.get('file')
+    if stream is None or stream is sys.stdout:
+        converted = []
+        for arg in args:
+            if isinstance(arg, (pd.DataFrame, pd.Series)) and len(arg) > SUMMARY_MIN_ROWS:
+                arg = summarize_object(arg)
+                if isinstance(sys.stdout, BoundedOutput):
+                    sys.stdout.summarized += 1
+            converted.append(arg)
+        args = converted
+    builtins.print(*args, **kwargs)
+
+def exec_namespace(df):
+    """Globals for executing generated code: df, and the summarizing print unless turned off."""
+    namespace = {'df': df}
+    if summaries_enabled():
+        namespace['print'] = summarizing_print
+    return namespace
@@ -1,29 +1,27 @@
-from termcolor import cprint
-from IPython.display import display, HTML, Markdown as IPythonMarkdown
+import importlib.util
 import sys
 import time
-import pandas as pd
-
-# Rich UI Imports
-try:
-    from rich.console import Console
-    from rich.panel import Panel
-    from rich.table import Table
-    from rich.syntax import Syntax
-    from rich.markdown import Markdown as RichMarkdown
-    from rich.text import Text
-    from rich import box
-    RICH_AVAILABLE = True
-except ImportError:
-    RICH_AVAILABLE = False
+
+# Rich UI Imports. Checking for rich does not import it; the classes are loaded by
+# _load_rich() the first time a console is needed, which keeps package import fast.
+RICH_AVAILABLE = importlib.util.find_spec('rich') is not None
+Console = Panel = Table = Syntax = RichMarkdown = Text = box = None
+
+def _load_rich():
+    global Console, Panel, Table, Syntax, RichMarkdown, Text, box
+    if Console is None:
+        from rich.console import Console
+        from rich.panel import Panel
+        from rich.table import Table
+        from rich.syntax import Syntax
+        from rich.markdown import Markdown as RichMarkdown
+        from rich.text import Text
+        from rich import box
 
 class OutputManager:
     def __init__(self):
-        # Initialize console with force_jupyter if in notebook to ensure theme rendering
-        if self.is_notebook():
-            self.console = Console(force_jupyter=True) if RICH_AVAILABLE else None
-        else:
-            self.console = Console() if RICH_AVAILABLE else None
+        # The console is created on first use (see the console property)
+        self._console = None
         
         # Professional Color Palette
         self.theme = {
@@ -43,40 +41,71 @@ class OutputManager:
         self.color_usr_input_rank = 'green'
         self.color_error_ntb = '#d86c00'
 
+    @property
+    def console(self):
+        if self._console is None and RICH_AVAILABLE:
+            _load_rich()
+            # Initialize console with force_jupyter if in notebook to ensure theme rendering
+            self._console = Console(force_jupyter=True) if self.is_notebook() else Console()
+        return self._console
+
     def is_notebook(self):
         return 'ipykernel' in sys.modules
 
     # Display the results of the analysis
-    def display_results(self, df=None, answer=None, code=None, rank=None, vector_db=False):
+    def display_results(self, df=None, answer=None, code=None, rank=None, vector_db=False, profile=None):
+        console = self.console
         if self.is_notebook():
             if df is not None:
-                self.console.print(Panel(Text(f"{df.dtypes}"), title="DataFrame Structure", border_style="cyan"))
+                console.print(Panel(Text(f"{df.dtypes}"), title="DataFrame Structure", border_style="cyan"))
+                from IPython.display import display
                 display(df.head())
             
             if code is not None:
                 syntax = Syntax(code, "python", theme=self.theme["code"], line_numbers=True)
-                self.console.print(Panel(syntax, title="Applied Python Code", border_style="green"))
+                console.print(Panel(syntax, title="Applied Python Code", border_style="green"))
             
             if answer is not None:
-                self.console.print(Panel(RichMarkdown(answer), title="Solution Summary", border_style="bold green"))
+                console.print(Panel(RichMarkdown(answer), title="Solution Summary", border_style="bold green"))
             
             if vector_db and rank is not None:
-                self.console.print(Panel(Text(str(rank)), title="Solution Rank", border_style="blue"))
+                console.print(Panel(Text(str(rank)), title="Solution Rank", border_style="blue"))
         else:
             if df is not None:
-                self.console.print(Panel(Text(f"{df.dtypes}"), title="DataFrame Structure", border_style=self.theme["panel_border"]))
+                console.print(Panel(Text(f"{df.dtypes}"), title="DataFrame Structure", border_style=self.theme["panel_border"]))
             
             if code is not None:
                 syntax = Syntax(code, "python", theme=self.theme["code"], line_numbers=True)
-                self.console.print(Panel(syntax, title="Applied Python Code", border_style="green"))
+                console.print(Panel(syntax, title="Applied Python Code", border_style="green"))
             
             if answer is not None:
-                self.console.print(Panel(RichMarkdown(answer), title="Solution Summary", border_style=self.theme["success"]))
+                console.print(Panel(RichMarkdown(answer), title="Solution Summary", border_style=self.theme["success"]))
             
             if vector_db and rank is not None:
-                self.console.print(Panel(Text(str(rank)), title="Solution Rank", border_style=self.theme["info"]))
+                console.print(Panel(Text(str(rank)), title="Solution Rank", border_style=self.theme["info"]))
+
+        if profile is not None:
+            self.display_code_profile(profile)
+
+    def display_code_profile(self, profile, count=5):
+        # profile: profiler.CodeProfile of the executed code; shows its slowest statements
+        console = self.console
+        table = Table(title=f"Slowest Statements ({profile.wall_time:.3f}s total)", box=box.ROUNDED, header_style="bold magenta")
+        table.add_column("Line", justify="right", style="cyan")
+        table.add_column("Wall (s)", justify="right")
+        table.add_column("CPU (s)", justify="right")
+        table.add_column("Peak (MB)", justify="right")
+        table.add_column("Statement", overflow="fold")
+
+        for statement in profile.top(count):
+            peak = f"{statement.peak_bytes / 2**20:.1f}" if statement.peak_bytes is not None else "-"
+            table.add_row(str(statement.lineno), f"{statement.wall_time:.3f}", f"{statement.cpu_time:.3f}", peak,
+                          statement.source)
+
+        console.print(table)
 
     def display_expert_selection(self, expert, requires_dataset, confidence):
+        console = self.console
         grid = Table.grid(expand=True)
         grid.add_column(style="cyan", justify="left")
         grid.add_column(style="white", justify="right")
@@ -84,22 +113,24 @@ class OutputManager:
         grid.add_row("Requires Dataset:", "Yes" if requires_dataset else "No")
         grid.add_row("Confidence Score:", f"{confidence}/10")
         
-        self.console.print(Panel(grid, title="🧠 Selection Result", border_style="bold green", expand=False))
+        console.print(Panel(grid, title="🧠 Selection Result", border_style="bold green", expand=False))
 
     def display_analyst_selection(self, analyst, unknown, condition):
+        console = self.console
         grid = Table.grid(expand=True)
         grid.add_column(style="cyan", justify="left")
         grid.add_row(f"Target Analyst: [bold]{analyst}[/]")
         if unknown: grid.add_row(f"Objective: [italic]{unknown}[/]")
         if condition: grid.add_row(f"Constraints: [italic]{condition}[/]")
         
-        self.console.print(Panel(grid, title="🎯 Analysis Strategy", border_style="bold blue", expand=False))
+        console.print(Panel(grid, title="🎯 Analysis Strategy", border_style="bold blue", expand=False))
 
     def display_task_eval(self, task_eval):
         self.console.print(Panel(RichMarkdown(task_eval), title="Agent Reasoning & Strategy", border_style=self.theme["primary"]))
     
     # Display the header for the agent
     def display_tool_start(self, agent, model):
+        console = self.console
         # Emoji Mapping for professional look
         emojis = {
             "Planner": "📝",
@@ -143,7 +174,7 @@ class OutputManager:
             ("\nAction: ", self.theme["secondary"]),
             (f"{msg}", "bold white")
         )
-        self.console.print(Panel(content, title=f"{emoji} {agent}", border_style=self.theme["primary"], expand=False))
+        console.print(Panel(content, title=f"{emoji} {agent}", border_style=self.theme["primary"], expand=False))
 
     # Display the footer for the agent
     def display_tool_end(self, agent):
@@ -194,6 +225,7 @@ class OutputManager:
         self.console.print(Text(f"ℹ️ {message}", style="bold blue"))
 
     def display_call_summary(self, summary_text):
+        console = self.console
         table = Table(title="Chain Performance Summary", box=box.ROUNDED, header_style="bold magenta")
         table.add_column("Metric", style="cyan")
         table.add_column("Value", style="white")
@@ -205,7 +237,22 @@ class OutputManager:
                     key, value = parts
                     table.add_row(key.strip(), value.strip())
         
-        self.console.print(table)
+        console.print(table)
+
+    def display_stage_summary(self, chain_id, stages):
+        # stages: [(name, calls, total seconds, max seconds)], as returned by tracing.Tracer.stage_summary
+        console = self.console
+        table = Table(title=f"Stage Timings (Chain {chain_id})", box=box.ROUNDED, header_style="bold magenta")
+        table.add_column("Stage", style="cyan")
+        table.add_column("Calls", justify="right")
+        table.add_column("Total (s)", justify="right")
+        table.add_column("Avg (s)", justify="right")
+        table.add_column("Max (s)", justify="right")
+
+        for name, calls, total, longest in stages:
+            table.add_row(name, str(calls), f"{total:.3f}", f"{total / calls:.3f}", f"{longest:.3f}")
+
+        console.print(table)
 
     def print_wrapper(self, message, end="\n", flush=False):
         if RICH_AVAILABLE and not self.is_notebook():
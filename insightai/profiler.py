@@ -0,0 +1,166 @@
+import ast
+import collections
+import os
+import time
+import tracemalloc
+
+# Name the instrumented code calls its profiler by; only the statement wrappers use it
+PROFILE_HOOK = '__insightai_profiler__'
+TOP_STATEMENTS = 5  # Statements shown in the results and given to the Code Generator
+SOURCE_CHARS = 80  # Characters of a statement's first line kept as its label
+# Per-statement peaks need tracemalloc.reset_peak (Python 3.9+); without it peak_bytes is None
+CAN_TRACE_PEAKS = hasattr(tracemalloc, 'reset_peak')
+
+StatementProfile = collections.namedtuple('StatementProfile', 'lineno end_lineno source wall_time cpu_time peak_bytes')
+
+def profiling_enabled():
+    return os.getenv('INSIGHTAI_PROFILE_CODE', '').lower() in ('1', 'true', 'yes')
+
+def memory_tracing_enabled():
+    return CAN_TRACE_PEAKS and os.getenv('INSIGHTAI_PROFILE_MEMORY', '1').lower() not in ('0', 'false', 'no')
+
+def instrument(code):
+    """Compile `code` with every top-level statement wrapped in a timing block.
+
+    Statements keep their line numbers and the "<string>" file name of a plain exec, so
+    tracebacks read the same as for uninstrumented code.
+    """
+    tree = ast.parse(code, '<string>')
+    body = []
+    for index, statement in enumerate(tree.body):
+        if isinstance(statement, ast.ImportFrom) and statement.module == '__future__':
+            # Must stay at the top of the module
+            body.append(statement)
+            continue
+        timer = ast.Call(
+            func=ast.Attribute(value=ast.Name(id=PROFILE_HOOK, ctx=ast.Load()), attr='statement', ctx=ast.Load()),
+            args=[ast.Constant(index)], keywords=[],
+        )
+        wrapper = ast.With(items=[ast.withitem(context_expr=timer)], body=[statement])
+        body.append(ast.copy_location(wrapper, statement))
+    tree.body = body
+    ast.fix_missing_locations(tree)
+    return compile(tree, '<string>', 'exec')
+
+class _StatementTimer:
+    __slots__ = ('profiler', 'index', 'wall', 'cpu', 'memory')
+
+    def __init__(self, profiler, index):
+        self.profiler = profiler
+        self.index = index
+
+    def __enter__(self):
+        if self.profiler.trace_memory:
+            tracemalloc.reset_peak()
+            self.memory = tracemalloc.get_traced_memory()[0]
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        wall_time = time.perf_counter() - self.wall
+        cpu_time = time.process_time() - self.cpu
+        peak_bytes = None
+        if self.profiler.trace_memory:
+            peak_bytes = max(tracemalloc.get_traced_memory()[1] - self.memory, 0)
+        self.profiler.record(self.index, wall_time, cpu_time, peak_bytes)
+        return False
+
+class StatementProfiler:
+    """Collects wall time, CPU time and peak memory of each top-level statement of one piece of code.
+
+    Peak memory is the most allocated through tracemalloc while the statement ran, above what was
+    allocated when it started. It covers Python and numpy/pandas allocations, and slows the code
+    down noticeably, so it can be turned off with `trace_memory`.
+    """
+    def __init__(self, code, trace_memory=True):
+        self.trace_memory = trace_memory and CAN_TRACE_PEAKS
+        self.statements = [(node.lineno, node.end_lineno) for node in ast.parse(code).body]
+        self.lines = code.splitlines()
+        self.records = []
+
+    def statement(self, index):
+        return _StatementTimer(self, index)
+
+    def record(self, index, wall_time, cpu_time, peak_bytes):
+        lineno, end_lineno = self.statements[index]
+        source = self.lines[lineno - 1].strip()
+        if len(source) > SOURCE_CHARS or end_lineno > lineno:
+            source = source[:SOURCE_CHARS].rstrip() + ' ...'
+        self.records.append(StatementProfile(lineno, end_lineno, source, wall_time, cpu_time, peak_bytes))
+
+    def profile(self):
+        return CodeProfile(self.records)
+
+class CodeProfile:
+    """Per-statement costs of one execution of generated code, in the order the statements ran."""
+    def __init__(self, statements):
+        self.statements = list(statements)
+
+    @property
+    def wall_time(self):
+        return sum(statement.wall_time for statement in self.statements)
+
+    @property
+    def cpu_time(self):
+        return sum(statement.cpu_time for statement in self.statements)
+
+    @property
+    def peak_bytes(self):
+        peaks = [statement.peak_bytes for statement in self.statements if statement.peak_bytes is not None]
+        return max(peaks) if peaks else None
+
+    def top(self, count=TOP_STATEMENTS, key='wall_time'):
+        """The `count` most expensive statements by `key`: wall_time, cpu_time or peak_bytes."""
+        ranked = [statement for statement in self.statements if getattr(statement, key) is not None]
+        return sorted(ranked, key=lambda statement: getattr(statement, key), reverse=True)[:count]
+
+    def to_dict(self):
+        return {
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'peak_bytes': self.peak_bytes,
+            'statements': [statement._asdict() for statement in self.statements],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(StatementProfile(**statement) for statement in data['statements'])
+
+    def format(self, count=TOP_STATEMENTS):
+        """Plain text of the slowest statements, for display and prompts."""
+        lines = [f"Total: {self.wall_time:.3f}s wall, {self.cpu_time:.3f}s CPU"
+                 + (f", {format_bytes(self.peak_bytes)} peak memory" if self.peak_bytes is not None else '')]
+        for statement in self.top(count):
+            lines.append(f"line {statement.lineno}: {statement.wall_time:.3f}s wall, {statement.cpu_time:.3f}s CPU"
+                         + (f", {format_bytes(statement.peak_bytes)} peak" if statement.peak_bytes is not None else '')
+                         + f" | {statement.source}")
+        return '\n'.join(lines)
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def profile_exec(code, namespace, trace_memory=None):
+    """exec `code` in `namespace` like exec(code, namespace), timing each top-level statement.
+
+    Returns the CodeProfile. Exceptions raised by the code propagate as they would from exec.
+    """
+    if trace_memory is None:
+        trace_memory = memory_tracing_enabled()
+    trace_memory = trace_memory and CAN_TRACE_PEAKS
+    compiled = instrument(code)
+    profiler = StatementProfiler(code, trace_memory)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    namespace[PROFILE_HOOK] = profiler
+    try:
+        exec(compiled, namespace)
+    finally:
+        namespace.pop(PROFILE_HOOK, None)
+        if started_tracing:
+            tracemalloc.stop()
+    return profiler.profile()
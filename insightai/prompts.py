@@ -527,6 +527,16 @@ Always include the import statements at the top of the code, and comments and pr
 
 The error message is: {}
 """
+execution_timeout_hint = """
+The code was stopped because it ran longer than the {} second time limit. It is not wrong, it is too slow.
+Rewrite it to be faster: use vectorized pandas/numpy operations instead of loops, iterrows or apply with Python functions,
+avoid cross joins and repeated work, and aggregate or sample the data before plotting.
+"""
+execution_memory_hint = """
+The code was stopped because it used more than the {} MB memory limit. It is not wrong, it uses too much memory.
+Rewrite it to use less memory: do not copy the dataframe, select only the columns you need, avoid cross joins and
+large intermediate results, use smaller dtypes, and aggregate before reshaping or plotting.
+"""
 # Code Debugger Prompts
 code_debugger_system = """
 Your job as an AI QA engineer involves correcting and refactoring of the given Code so it delivers the outcome as described in the given Task list.
@@ -566,6 +576,27 @@ df_description = df.describe()
 print(df_description)
 ```
 """
+# Code Optimizer Prompts
+code_optimizer_system = """
+The Python code below answers the given Task list correctly, but it is slow or uses too much memory.
+
+Code:
+{}.
+Task list:
+{}.
+
+The code was profiled statement by statement. The most expensive top-level statements, with their line numbers,
+wall-clock time, CPU time and peak memory allocated while they ran:
+{}
+
+Rewrite the code so it produces the same output faster and with less memory. Focus on the statements at the top
+of the profile: use vectorized pandas/numpy operations instead of loops, iterrows or apply with Python functions,
+avoid copies of the dataframe and large intermediate results, and do not repeat work. Leave cheap statements as they are.
+If provided, the dataframe df has already been defined and populated with the required data.
+
+Provide the final, updated code, and a brief summary of the changes you made.
+Always use the backticks to enclose the code.
+"""
 # Code Ranker Agent Prompts
 code_ranker_system = """
 As an AI QA Engineer, your role is to evaluate and grade the code: {}, supplied by the AI Data Analyst. You should rank it on a scale of 1 to 10.
@@ -0,0 +1,216 @@
+import ast
+import collections
+import os
+import re
+
+import pandas as pd
+
+try:
+    # Attempt package-relative import
+    from . import utils
+except ImportError:
+    # Fall back to script-style import
+    import utils
+
+# Local repairs tried in one execute_code call before errors go to the Error Corrector
+MAX_LOCAL_REPAIRS = 5
+
+RepairRule = collections.namedtuple('RepairRule', 'name exceptions pattern fix')
+
+RULES = []
+
+REDUCTIONS = {'mean', 'median', 'sum', 'std', 'var', 'sem', 'prod', 'min', 'max', 'quantile', 'corr', 'cov',
+              'skew', 'kurt'}
+DATAFRAME_ATTRIBUTES = frozenset(dir(pd.DataFrame))
+
+def repairs_enabled():
+    return os.getenv('INSIGHTAI_REPAIR_RULES', '1').lower() not in ('0', 'false', 'no')
+
+def rule(name, exceptions, pattern=None):
+    """Register a repair rule for errors of the given exception type names whose message matches `pattern`.
+
+    The decorated function is called as fix(code, tree, lineno, error) with the parsed code and
+    the line that failed, and returns the rewritten code, or None if it does not apply.
+    """
+    def decorator(fix):
+        RULES.append(RepairRule(name, tuple(exceptions), re.compile(pattern) if pattern else None, fix))
+        return fix
+    return decorator
+
+def error_line(traceback_text):
+    """Line of the generated code that raised, from the last "<string>" frame of the traceback."""
+    lines = re.findall(r'File "<string>", line (\d+)', traceback_text)
+    return int(lines[-1]) if lines else None
+
+def failing_calls(traceback_text):
+    """Names of the functions running below the generated code's failing line, outermost first.
+
+    Empty when the error was raised by the line itself, e.g. float('x').
+    """
+    frames = re.findall(r'File "(.*?)", line \d+, in (\S+)', traceback_text)
+    generated = [index for index, (file_name, _) in enumerate(frames) if file_name == '<string>']
+    if not generated:
+        return []
+    return [name for _, name in frames[generated[-1] + 1:]]
+
+def _failures(exception_type, traceback_text):
+    """(line, error text) pairs for the rules to work from."""
+    if exception_type == 'CodeValidationError':
+        # Rejected by code_validator before running; each reported problem names its line
+        return [(int(lineno), message) for lineno, message
+                in re.findall(r'(?m)(?:^|: )line (\d+): (.*)$', traceback_text)]
+    lineno = error_line(traceback_text)
+    return [(lineno, traceback_text)] if lineno is not None else []
+
+def repair(code, exception_type, traceback_text):
+    """Return (rule name, repaired code) for the first rule that fixes the error, or None.
+
+    `traceback_text` is the full traceback of a failed run, or the message of a CodeValidationError.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    # Every rule works from the line that failed
+    failures = _failures(exception_type, traceback_text)
+    for repair_rule in RULES:
+        if exception_type not in repair_rule.exceptions:
+            continue
+        for lineno, error in failures:
+            if repair_rule.pattern is not None and not repair_rule.pattern.search(error):
+                continue
+            repaired = repair_rule.fix(code, tree, lineno, error)
+            if repaired is not None and repaired != code:
+                return repair_rule.name, repaired
+    return None
+
+# Helpers for rewriting source by AST node positions, which keeps the rest of the code as written
+
+def _nodes_on_line(tree, lineno, node_type):
+    return [node for node in ast.walk(tree) if isinstance(node, node_type)
+            and node.lineno <= lineno <= node.end_lineno]
+
+def _offset(line_starts, lines, lineno, col):
+    # AST column offsets count UTF-8 bytes
+    return line_starts[lineno - 1] + len(lines[lineno - 1].encode('utf-8')[:col].decode('utf-8'))
+
+def replace_nodes(code, replacements):
+    """Replace the source of each (node, text) pair, assuming the nodes do not overlap."""
+    lines = code.splitlines(keepends=True)
+    line_starts = [0]
+    for line in lines:
+        line_starts.append(line_starts[-1] + len(line))
+    spans = sorted(((_offset(line_starts, lines, node.lineno, node.col_offset),
+                     _offset(line_starts, lines, node.end_lineno, node.end_col_offset), text)
+                    for node, text in replacements), reverse=True)
+    for start, end, text in spans:
+        code = code[:start] + text + code[end:]
+    return code
+
+def _outermost(nodes):
+    """Drop nodes nested inside another one of the list, so replacements do not overlap."""
+    return [node for node in nodes if not any(_contains(other, node) for other in nodes)]
+
+def _innermost(nodes):
+    """Drop nodes that contain another one of the list; the inner ones run, and fail, first."""
+    return [node for node in nodes if not any(_contains(node, other) for other in nodes)]
+
+def _contains(node, other):
+    return other is not node and any(child is other for child in ast.walk(node))
+
+def _ensure_pandas_import(code, tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import) and any(alias.name == 'pandas' and alias.asname == 'pd' for alias in node.names):
+            return code
+    return 'import pandas as pd\n' + code
+
+def _is_column(node):
+    """df['col'] or df.col, for any variable name."""
+    if isinstance(node, ast.Subscript):
+        key = utils.subscript_key(node)
+        return isinstance(node.value, ast.Name) and isinstance(key, ast.Constant) and isinstance(key.value, str)
+    if isinstance(node, ast.Attribute):
+        return isinstance(node.value, ast.Name) and node.attr not in DATAFRAME_ATTRIBUTES
+    return False
+
+def _source(code, node):
+    """Source text of a node, or None for nodes without a position; rules skip those."""
+    return ast.get_source_segment(code, node)
+
+# The rules, tried in order
+
+@rule('append_to_concat', ['AttributeError'], r"object has no attribute 'append'")
+def append_to_concat(code, tree, lineno, error):
+    """DataFrame.append and Series.append were removed in pandas 2.0; use pd.concat."""
+    replacements = []
+    for call in _outermost(_nodes_on_line(tree, lineno, ast.Call)):
+        if not (isinstance(call.func, ast.Attribute) and call.func.attr == 'append' and len(call.args) == 1):
+            continue
+        other = call.args[0]
+        frame_source, other_source = _source(code, call.func.value), _source(code, other)
+        if frame_source is None or other_source is None:
+            continue
+        if isinstance(other, (ast.Dict, ast.List)):
+            # A row given as a dict, or a list of them
+            other_source = f"pd.DataFrame({other_source})" if isinstance(other, ast.List) \
+                else f"pd.DataFrame([{other_source}])"
+        keywords = [f"{keyword.arg}={_source(code, keyword.value)}" for keyword in call.keywords
+                    if keyword.arg in ('ignore_index', 'sort', 'verify_integrity')]
+        arguments = ', '.join([f"[{frame_source}, {other_source}]"] + keywords)
+        replacements.append((call, f"pd.concat({arguments})"))
+    if not replacements:
+        return None
+    return _ensure_pandas_import(replace_nodes(code, replacements), tree)
+
+@rule('numeric_only', ['TypeError', 'ValueError'],
+      r"Cannot perform reduction|does not support operation|agg function failed|could not convert string to float"
+      r"|Could not convert .* to numeric|unsupported operand type\(s\) for .*'str'")
+def numeric_only(code, tree, lineno, error):
+    """Reductions over non-numeric columns fail since pandas 2.0; restrict them to numeric columns."""
+    if not REDUCTIONS.intersection(failing_calls(error)):
+        # The same messages come from astype(float), float() or arithmetic on text
+        return None
+    replacements = []
+    for call in _nodes_on_line(tree, lineno, ast.Call):
+        if not isinstance(call.func, ast.Attribute) or call.func.attr not in REDUCTIONS:
+            continue
+        if any(keyword.arg == 'numeric_only' for keyword in call.keywords):
+            continue
+        # Insert the keyword just before the closing parenthesis
+        source = _source(code, call)
+        if source is None or not source.endswith(')'):
+            continue
+        head = source[:-1].rstrip()
+        separator = '' if head.endswith('(') else ' ' if head.endswith(',') else ', '
+        replacements.append((call, f"{head}{separator}numeric_only=True)"))
+    if not replacements:
+        return None
+    # For nested reductions fix the inner one; the outer one gets its turn if it fails next
+    keep = _innermost([node for node, _ in replacements])
+    return replace_nodes(code, [(node, text) for node, text in replacements if node in keep])
+
+@rule('to_datetime', ['AttributeError', 'CodeValidationError'],
+      r"Can only use \.dt accessor with datetimelike values|which has no \.dt accessor")
+def dt_accessor(code, tree, lineno, error):
+    """Parse a string column with pd.to_datetime before using its .dt accessor."""
+    replacements = [(node.value, f"pd.to_datetime({_source(code, node.value)}, errors='coerce')")
+                    for node in _nodes_on_line(tree, lineno, ast.Attribute)
+                    if node.attr == 'dt' and _is_column(node.value) and _source(code, node.value) is not None]
+    if not replacements:
+        return None
+    return _ensure_pandas_import(replace_nodes(code, replacements), tree)
+
+@rule('to_datetime_compare', ['TypeError'],
+      r"not supported between instances of .*(Timestamp|datetime|date).*|Invalid comparison between dtype=(object|str)")
+def datetime_comparison(code, tree, lineno, error):
+    """Parse string columns compared against dates with pd.to_datetime."""
+    replacements = []
+    for compare in _nodes_on_line(tree, lineno, ast.Compare):
+        operands = [compare.left] + compare.comparators
+        columns = [operand for operand in operands if _is_column(operand) and _source(code, operand) is not None]
+        if columns and len(columns) < len(operands):
+            replacements.extend((column, f"pd.to_datetime({_source(code, column)}, errors='coerce')")
+                                for column in columns)
+    if not replacements:
+        return None
+    return _ensure_pandas_import(replace_nodes(code, replacements), tree)
@@ -0,0 +1,205 @@
+import asyncio
+import collections
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    from . import models, log_manager
+except ImportError:
+    import models, log_manager
+
+FIXTURE_FILE_PATH = 'insightai_fixtures.jsonl'
+
+def message_hash(messages):
+    """Hash the role and content of each message, ignoring SDK-specific extras."""
+    payload = json.dumps(
+        [{'role': message.get('role'), 'content': message.get('content')} for message in messages],
+        sort_keys=True, separators=(',', ':'), default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def load_fixtures(path):
+    """Read recorded calls from a run log (JSON list), a consolidated log (JSON object) or a JSON lines file."""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if not text.strip():
+        return []
+
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        # JSON lines, possibly a run log whose messages are kept in a blob file
+        return log_manager.read_run_log(path, legacy_path=None)
+
+    if isinstance(data, dict):
+        # Consolidated log: {chain_id: {'chain_details': [...], ...}}
+        return [entry for chain in data.values() for entry in chain.get('chain_details', [])]
+    return data
+
+class ReplayStore:
+    """Recorded responses indexed by agent and message hash.
+
+    A call whose messages match a recording exactly gets that recording; repeated identical
+    calls get their recordings in order. Prompts that embed the date or earlier results rarely
+    match exactly, so otherwise the agent's recordings are served in the order they were made.
+    """
+    def __init__(self, entries):
+        self._lock = threading.Lock()
+        self._exact = collections.defaultdict(collections.deque)
+        self._by_agent = collections.defaultdict(list)
+        self._next = collections.Counter()
+        for entry in entries:
+            self._exact[(entry.get('agent'), message_hash(entry.get('messages') or []))].append(entry)
+            self._by_agent[entry.get('agent')].append(entry)
+
+    def lookup(self, agent, messages):
+        with self._lock:
+            queue = self._exact.get((agent, message_hash(messages)))
+            if queue:
+                return queue.popleft() if len(queue) > 1 else queue[0]
+
+            recorded = self._by_agent.get(agent)
+            if not recorded:
+                raise LookupError(f"No recorded response for agent '{agent}'")
+            entry = recorded[self._next[agent] % len(recorded)]
+            self._next[agent] += 1
+            return entry
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_fixture_path():
+    return os.getenv('INSIGHTAI_FIXTURE_PATH', FIXTURE_FILE_PATH)
+
+def get_store():
+    """Load the fixture file named by INSIGHTAI_FIXTURE_PATH on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                path = get_fixture_path()
+                if not os.path.exists(path):
+                    raise FileNotFoundError(f"Replay fixture file not found: {path}. "
+                                            f"Record one with INSIGHTAI_LLM_MODE=record.")
+                _store = ReplayStore(load_fixtures(path))
+    return _store
+
+def reset_store():
+    """Forget the loaded fixtures so the next replayed call reloads them."""
+    global _store
+    with _store_lock:
+        _store = None
+
+_record_lock = threading.Lock()
+
+def record(agent, chain_id, timestamp, model, provider, result):
+    """Append a live call to the fixture file as one JSON line in the run log entry format."""
+    (content, messages, prompt_tokens, completion_tokens, total_tokens,
+     elapsed_time, tokens_per_second) = result[:7]
+    entry = {
+        'agent': agent,
+        'chain_id': chain_id,
+        'timestamp': timestamp,
+        'model': model,
+        'provider': provider,
+        'messages': messages,
+        'content': content,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': total_tokens,
+        'elapsed_time': elapsed_time,
+        'tokens_per_second': tokens_per_second,
+        'time_to_first_token': result[7] if len(result) > 7 else None,
+    }
+    line = json.dumps(entry, cls=log_manager.FlexibleJSONEncoder)
+    with _record_lock:
+        with open(get_fixture_path(), 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+def _latency_scale():
+    # 0 replays instantly, 1 reproduces the recorded latency, 0.5 halves it
+    return float(os.getenv('INSIGHTAI_REPLAY_LATENCY', 0))
+
+def _chunks(content):
+    return re.findall(r'\s*\S+', content) or [content]
+
+def _lookup(messages):
+    return get_store().lookup(models.current_agent.get(), messages)
+
+def _result(entry, messages, start_time, time_to_first_token=None, stream=False):
+    elapsed_time = time.time() - start_time
+    completion_tokens = entry.get('completion_tokens', 0)
+    result = (
+        entry.get('content', ''), messages, entry.get('prompt_tokens', 0),
+        completion_tokens, entry.get('total_tokens', 0),
+        elapsed_time, completion_tokens / elapsed_time if elapsed_time > 0 else 0
+    )
+    if stream:
+        result += (time_to_first_token,)
+    return result
+
+def _stream_delays(entry):
+    """Return (delay before the first token, delay between chunks, chunks) reproducing the recorded timing."""
+    scale = _latency_scale()
+    elapsed_time = (entry.get('elapsed_time') or 0) * scale
+    first_token = entry.get('time_to_first_token')
+    first_token = elapsed_time if first_token is None else first_token * scale
+    chunks = _chunks(entry.get('content', ''))
+    return min(first_token, elapsed_time), max(0, elapsed_time - first_token) / len(chunks), chunks
+
+def create_client(api_key, base_url, pool_limits):
+    """The replay provider has no client; present for the models.client_registry interface."""
+    return None
+
+def create_async_client(api_key, base_url, pool_limits):
+    return None
+
+def llm_call(messages: str, model: str, temperature: str, max_tokens: str):
+    """Serve a recorded response, sleeping for the recorded latency if INSIGHTAI_REPLAY_LATENCY is set."""
+    start_time = time.time()
+    entry = _lookup(messages)
+    time.sleep((entry.get('elapsed_time') or 0) * _latency_scale())
+    return _result(entry, messages, start_time)
+
+async def allm_call(messages: str, model: str, temperature: str, max_tokens: str):
+    """Coroutine counterpart of llm_call."""
+    start_time = time.time()
+    entry = _lookup(messages)
+    await asyncio.sleep((entry.get('elapsed_time') or 0) * _latency_scale())
+    return _result(entry, messages, start_time)
+
+def llm_stream(log_and_call_manager, chain_id: str, messages: str, model: str,
+               temperature: str, max_tokens: str, tools: str = None, on_token=None):
+    """Stream a recorded response word by word, spread over the recorded timing."""
+    stats = models.StreamStats(on_token)
+    entry = _lookup(messages)
+    first_token_delay, chunk_delay, chunks = _stream_delays(entry)
+
+    time.sleep(first_token_delay)
+    for chunk in chunks:
+        stats.emit(chunk)
+        if chunk_delay:
+            time.sleep(chunk_delay)
+    models.output_handler.print_wrapper("")
+
+    return _result(entry, messages, stats.start_time, stats.time_to_first_token, stream=True)
+
+async def allm_stream(log_and_call_manager, chain_id: str, messages: str, model: str,
+                      temperature: str, max_tokens: str, tools: str = None, on_token=None):
+    """Coroutine counterpart of llm_stream."""
+    stats = models.StreamStats(on_token)
+    entry = _lookup(messages)
+    first_token_delay, chunk_delay, chunks = _stream_delays(entry)
+
+    await asyncio.sleep(first_token_delay)
+    for chunk in chunks:
+        stats.emit(chunk)
+        if chunk_delay:
+            await asyncio.sleep(chunk_delay)
+    models.output_handler.print_wrapper("")
+
+    return _result(entry, messages, stats.start_time, stats.time_to_first_token, stream=True)
@@ -0,0 +1,66 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+REPLY_PRIMING_TOKENS = 3  # every reply is primed with <|start|>assistant<|message|>
+MAX_MEMO_ENTRIES = 4096
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+# Token count per message, keyed by a hash of the message's content
+_message_token_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+def get_encoding():
+    """Return the shared tiktoken encoder, loading it on first use."""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                import tiktoken
+                _encoding = tiktoken.encoding_for_model("gpt-4")
+    return _encoding
+
+def _message_key(message):
+    digest = hashlib.sha1()
+    for key, value in message.items():
+        if isinstance(value, str):
+            digest.update(key.encode('utf-8'))
+            digest.update(b'\0')
+            digest.update(value.encode('utf-8'))
+            digest.update(b'\0')
+    return digest.digest()
+
+def count_message_tokens(message):
+    """Count the tokens of a single chat message, encoding it only the first time its content is seen."""
+    key = _message_key(message)
+    with _memo_lock:
+        count = _message_token_memo.get(key)
+        if count is not None:
+            _message_token_memo.move_to_end(key)
+            return count
+
+    encoding = get_encoding()
+    count = TOKENS_PER_MESSAGE
+    for key_name, value in message.items():
+        if isinstance(value, str):
+            count += len(encoding.encode(value))
+        if key_name == "name":
+            count += TOKENS_PER_NAME
+
+    with _memo_lock:
+        _message_token_memo[key] = count
+        if len(_message_token_memo) > MAX_MEMO_ENTRIES:
+            _message_token_memo.popitem(last=False)
+    return count
+
+def count_prompt_tokens(messages):
+    """Count the prompt tokens of a message list using the OpenAI chat format overhead."""
+    return sum(count_message_tokens(message) for message in messages) + REPLY_PRIMING_TOKENS
+
+def count_text_tokens(text):
+    """Count the tokens in a plain string."""
+    return len(get_encoding().encode(text))
@@ -0,0 +1,133 @@
+import collections
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+# Chain the current code runs for; spans opened without an explicit chain_id are attributed to it
+current_chain = contextvars.ContextVar('insightai_chain_id', default=None)
+
+MAX_CHAINS = 100  # Chains whose spans are kept in memory, most recent first
+MAX_SPANS_PER_CHAIN = 10000
+
+Span = collections.namedtuple('Span', 'name chain_id start duration thread_id args')
+
+def tracing_enabled():
+    return os.getenv('INSIGHTAI_TRACE', '1').lower() not in ('0', 'false', 'no')
+
+class Tracer:
+    """Collects finished spans per chain_id.
+
+    Spans are plain tuples appended under a lock, cheap enough to leave on for every pipeline
+    stage and provider call. Only the most recent MAX_CHAINS chains are kept.
+    """
+    def __init__(self, max_chains=MAX_CHAINS, max_spans=MAX_SPANS_PER_CHAIN):
+        self.max_chains = max_chains
+        self.max_spans = max_spans
+        self._spans = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # perf_counter has no fixed epoch; anchor it to wall-clock time once
+        self._epoch = time.time() - time.perf_counter()
+
+    def add(self, span):
+        with self._lock:
+            spans = self._spans.get(span.chain_id)
+            if spans is None:
+                spans = self._spans[span.chain_id] = []
+                while len(self._spans) > self.max_chains:
+                    self._spans.popitem(last=False)
+            if len(spans) < self.max_spans:
+                spans.append(span)
+
+    def spans(self, chain_id=None):
+        """Spans of one chain, or of every chain if chain_id is None."""
+        with self._lock:
+            if chain_id is not None:
+                return list(self._spans.get(chain_id, ()))
+            return [span for spans in self._spans.values() for span in spans]
+
+    def clear(self, chain_id=None):
+        with self._lock:
+            if chain_id is None:
+                self._spans.clear()
+            else:
+                self._spans.pop(chain_id, None)
+
+    def stage_summary(self, chain_id):
+        """Return [(name, calls, total seconds, max seconds)] for a chain, slowest stage first."""
+        stages = {}
+        for span in self.spans(chain_id):
+            calls, total, longest = stages.get(span.name, (0, 0.0, 0.0))
+            stages[span.name] = (calls + 1, total + span.duration, max(longest, span.duration))
+        return sorted(((name,) + stats for name, stats in stages.items()), key=lambda row: row[2], reverse=True)
+
+    def chrome_trace(self, chain_id=None):
+        """The spans as a Chrome trace_event document (open in chrome://tracing or Perfetto)."""
+        pid = os.getpid()
+        events = []
+        for span in self.spans(chain_id):
+            events.append({
+                'name': span.name,
+                'cat': 'insightai',
+                'ph': 'X',
+                'ts': round((self._epoch + span.start) * 1e6),
+                'dur': round(span.duration * 1e6),
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': dict(span.args, chain_id=span.chain_id),
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, path, chain_id=None):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(chain_id), f, default=str)
+        return path
+
+tracer = Tracer()
+
+@contextlib.contextmanager
+def span(name, chain_id=None, **args):
+    """Time the enclosed block as a span named `name`, attributed to `chain_id` or the current chain."""
+    if not tracing_enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.add(Span(name, chain_id if chain_id is not None else current_chain.get(),
+                        start, time.perf_counter() - start, threading.get_ident(), args))
+
+def traced(name=None):
+    """Decorator recording each call of a function or coroutine function as a span."""
+    def decorator(function):
+        span_name = name or function.__name__
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def set_chain(chain_id):
+    """Attribute spans opened from here on in this context to `chain_id`."""
+    current_chain.set(chain_id)
+
+def export_chain_trace(chain_id):
+    """Write a chain's trace to INSIGHTAI_TRACE_DIR, if set. Returns the file path or None."""
+    directory = os.getenv('INSIGHTAI_TRACE_DIR')
+    if not directory or not tracing_enabled():
+        return None
+    os.makedirs(directory, exist_ok=True)
+    return tracer.export_chrome_trace(os.path.join(directory, f"trace_{chain_id}.json"), chain_id)
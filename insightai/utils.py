@@ -1,8 +1,31 @@
+import ast
+import sys
 from datetime import datetime, timezone
-import yaml
 import numpy as np
 import pandas as pd 
 
+try:
+    # Attempt package-relative import
+    from . import tracing
+except ImportError:
+    # Fall back to script-style import
+    import tracing
+
+
+def subscript_key(node):
+    """The key of an ast.Subscript as Python 3.9+ parses it.
+
+    Python 3.8 wraps the key in ast.Index, or in ast.ExtSlice when a tuple key holds a slice
+    (df.loc[:, 'a']); neither wrapper has a source position.
+    """
+    key = node.slice
+    if sys.version_info < (3, 9):
+        if isinstance(key, ast.Index):
+            key = key.value
+        elif isinstance(key, ast.ExtSlice):
+            key = ast.Tuple(elts=[dim.value if isinstance(dim, ast.Index) else dim for dim in key.dims],
+                            ctx=ast.Load())
+    return key
 
 def ordinal(n):
     return f"{n}{'th' if 11<=n<=13 else {1:'st',2:'nd',3:'rd'}.get(n%10, 'th')}"
@@ -16,6 +39,7 @@ def get_readable_date(date_obj=None, tz=None):
 
     return date_obj.strftime(f"%a {ordinal(date_obj.day)} of %b %Y")
 
+@tracing.traced()
 def inspect_dataframe(df, log_and_call_manager=None,chain_id=None,query=None):
     agent = "Dataframe Inspector"
     if log_and_call_manager:
@@ -85,6 +109,7 @@ def inspect_dataframe(df, log_and_call_manager=None,chain_id=None,query=None):
             stats_dict[column] = col_stats
             
         # Convert dictionary to YAML format
+        import yaml
         return yaml.dump(stats_dict, sort_keys=False, default_flow_style=False)
 
 def inspect_sql_schema(conn):
@@ -98,4 +123,30 @@ def inspect_sql_schema(conn):
             'nullable': not col[3],
             'pk': col[5]
         } for col in columns]
-    return schema
\ No newline at end of file
+    return schema
+
+
+def copy_on_write_enabled():
+    """True when pandas uses Copy-on-Write: always from pandas 3.0, opt-in on pandas 2.x."""
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    # pandas 2.x also accepts 'warn', which still behaves like the legacy mode
+    return pd.get_option('mode.copy_on_write') is True
+
+def enable_copy_on_write():
+    """Switch pandas 2.x to Copy-on-Write for the whole process; pandas 3 always uses it."""
+    if not copy_on_write_enabled():
+        pd.set_option('mode.copy_on_write', True)
+
+def snapshot_dataframe(df):
+    """Return a copy of df to roll back to after a failed code execution.
+
+    Under Copy-on-Write the snapshot is a lazy copy: it shares the data with df, and a column
+    is only copied when one of the two frames modifies it. Without Copy-on-Write a shallow copy
+    would see in-place changes, so the frame is copied in full as before.
+    """
+    if df is None:
+        return None
+    if copy_on_write_enabled():
+        return df.copy(deep=False)
+    return df.copy()
@@ -0,0 +1,66 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules that must not be loaded just by importing the package or the LLM layer
+HEAVY_MODULES = [
+    'openai', 'groq', 'google.generativeai', 'tiktoken',
+    'IPython', 'rich', 'yaml', 'termcolor',
+]
+
+# Statement to time -> budget for its median cold import time, in seconds
+TARGETS = {
+    'import insightai': 0.05,
+    'from insightai import models': 0.25,
+    'from insightai import InsightAI': 1.0,
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "modules": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+def measure(statement, repeat):
+    """Time `statement` in fresh interpreters; returns (timings, heavy modules it loaded)."""
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=repo_root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    timings = []
+    loaded = set()
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE.format(statement=statement, heavy=HEAVY_MODULES)],
+            check=True, capture_output=True, text=True, env=env
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result['elapsed'])
+        loaded.update(result['modules'])
+    return timings, sorted(loaded)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the cold import time of insightai against a budget.")
+    parser.add_argument('--repeat', type=int, default=5, help="fresh interpreters per statement")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiply every budget, e.g. for slow CI machines")
+    args = parser.parse_args()
+
+    success = True
+    print(f"{'statement':<36}{'median':>10}{'budget':>10}  heavy modules loaded")
+    for statement, budget in TARGETS.items():
+        timings, loaded = measure(statement, args.repeat)
+        median = statistics.median(timings)
+        budget *= args.scale
+        ok = median <= budget and not loaded
+        success = success and ok
+        print(f"{statement:<36}{median:>9.3f}s{budget:>9.3f}s  {', '.join(loaded) or '-'}{'' if ok else '  FAIL'}")
+
+    return success
+
+if __name__ == "__main__":
+    success = main()
+    if not success:
+        sys.exit(1)
@@ -0,0 +1,97 @@
+import pandas as pd
+import pytest
+
+from insightai import code_validator
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'Unit Price': [1.5, 2.0],
+        'Quantity': [3, 4],
+        'Order Date': ['2024-01-01', '2024-02-01'],
+        'Region': ['North', 'South'],
+    })
+
+
+def test_valid_code_is_unchanged(df):
+    code = "print(df['Unit Price'].mean())\nprint(df.groupby('Region')['Quantity'].sum())"
+    result = code_validator.validate_code(code, df)
+    assert result.code == code
+    assert result.fixes == []
+    assert result.problems == []
+
+
+def test_misspelled_column_is_fixed(df):
+    result = code_validator.validate_code("print(df['unit price'].mean())", df)
+    assert result.code == "print(df['Unit Price'].mean())"
+    assert result.fixes == [code_validator.Fix(1, 'unit price', 'Unit Price')]
+    assert result.problems == []
+
+
+def test_misspelled_attribute_and_column_arguments_are_fixed(df):
+    code = "df.sort_values(by='quantity')\nprint(df.Quantiy)\ndf.groupby('region').size()"
+    result = code_validator.validate_code(code, df)
+    assert result.code == "df.sort_values(by='Quantity')\nprint(df.Quantity)\ndf.groupby('Region').size()"
+    assert [fix.new for fix in result.fixes] == ['Quantity', 'Quantity', 'Region']
+
+
+def test_loc_column_is_fixed(df):
+    result = code_validator.validate_code("print(df.loc[:, 'quantity'])", df)
+    assert result.code == "print(df.loc[:, 'Quantity'])"
+
+
+def test_unknown_column_is_rejected_with_the_available_columns(df):
+    result = code_validator.validate_code("x = 1\nprint(df['Revenue'].sum())", df)
+    assert result.fixes == []
+    [problem] = result.problems
+    assert problem.lineno == 2
+    assert "column 'Revenue' is not a column of df" in problem.message
+    assert 'Columns: Order Date, Quantity, Region, Unit Price' in problem.message
+
+
+def test_columns_created_by_the_code_are_known(df):
+    code = "df['Revenue'] = df['Unit Price'] * df['Quantity']\nprint(df['Revenue'].sum())"
+    assert code_validator.validate_code(code, df).problems == []
+
+
+def test_columns_dropped_by_the_code_are_reported(df):
+    code = "df = df.drop(columns=['Region'])\nprint(df['Region'])"
+    [problem] = code_validator.validate_code(code, df).problems
+    assert problem.lineno == 2
+
+
+def test_renamed_columns_are_followed(df):
+    code = "df = df.rename(columns={'Quantity': 'Units'})\nprint(df['Units'].sum())"
+    assert code_validator.validate_code(code, df).problems == []
+
+
+def test_references_in_if_and_try_blocks_are_not_checked(df):
+    code = ("if 'Revenue' in df.columns:\n    print(df['Revenue'])\n"
+            "try:\n    print(df['Profit'])\nexcept KeyError:\n    pass")
+    result = code_validator.validate_code(code, df)
+    assert result.problems == []
+    assert result.fixes == []
+
+
+def test_dt_accessor_on_a_text_column_is_rejected(df):
+    [problem] = code_validator.validate_code("print(df['Order Date'].dt.year)", df).problems
+    assert problem.lineno == 1
+    assert 'which has no .dt accessor' in problem.message
+
+
+def test_accessor_on_a_converted_column_is_accepted(df):
+    code = "df['Order Date'] = pd.to_datetime(df['Order Date'])\nprint(df['Order Date'].dt.year)"
+    assert code_validator.validate_code(code, df).problems == []
+
+
+def test_syntax_errors_are_left_to_exec(df):
+    result = code_validator.validate_code("print(df['Quantity'", df)
+    assert result == code_validator.ValidationResult("print(df['Quantity'", [], [])
+
+
+def test_validation_error_lists_each_problem(df):
+    result = code_validator.validate_code("print(df['Revenue'])\nprint(df['Order Date'].dt.year)", df)
+    error = code_validator.CodeValidationError(result.problems)
+    assert str(error).splitlines()[0].startswith("line 1: column 'Revenue'")
+    assert str(error).splitlines()[1].startswith("line 2: column 'Order Date'")
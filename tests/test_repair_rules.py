@@ -0,0 +1,117 @@
+import traceback
+
+import pandas as pd
+import pytest
+
+from insightai import code_validator, repair_rules
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'name': ['a', 'b', 'c'],
+        'amount': [1.0, 2.0, 3.0],
+        'day': ['2024-01-01', '2024-02-01', '2024-03-01'],
+    })
+
+
+def run(code, df):
+    """exec code the way execute_code does; returns (exception type name, traceback) or None."""
+    try:
+        exec(compile(code, '<string>', 'exec'), {'df': df.copy(), 'pd': pd})
+    except Exception as error:
+        return type(error).__name__, traceback.format_exc()
+    return None
+
+
+def repair_and_rerun(code, df):
+    failure = run(code, df)
+    assert failure is not None, "the code was expected to fail"
+    repaired = repair_rules.repair(code, *failure)
+    if repaired is not None:
+        assert run(repaired[1], df) is None, repaired[1]
+    return repaired
+
+
+def test_error_line_is_the_last_generated_code_frame():
+    text = ('Traceback (most recent call last):\n'
+            '  File "/site-packages/insightai/insightai.py", line 640, in execute_code\n'
+            '  File "<string>", line 3, in <module>\n'
+            '  File "<string>", line 7, in helper\n'
+            '  File "/site-packages/pandas/core/frame.py", line 11000, in mean\n'
+            'TypeError: boom')
+    assert repair_rules.error_line(text) == 7
+    assert repair_rules.failing_calls(text) == ['mean']
+    assert repair_rules.error_line('TypeError: boom') is None
+
+
+def test_append_is_rewritten_to_concat(df):
+    code = "df = df.append({'name': 'd', 'amount': 4.0}, ignore_index=True)\nprint(len(df))"
+    rule, repaired = repair_and_rerun(code, df)
+    assert rule == 'append_to_concat'
+    assert repaired.splitlines()[1] == \
+        "df = pd.concat([df, pd.DataFrame([{'name': 'd', 'amount': 4.0}])], ignore_index=True)"
+
+
+def test_reduction_over_text_columns_gets_numeric_only(df):
+    rule, repaired = repair_and_rerun("print(df.mean())", df)
+    assert (rule, repaired) == ('numeric_only', "print(df.mean(numeric_only=True))")
+
+
+def test_groupby_reduction_gets_numeric_only(df):
+    rule, repaired = repair_and_rerun("print(df.groupby('name').mean())", df)
+    assert repaired == "print(df.groupby('name').mean(numeric_only=True))"
+
+
+def test_conversion_errors_are_not_given_numeric_only(df):
+    # Same messages as failing reductions, but the call that failed is not a reduction
+    assert repair_and_rerun("print(df['name'].astype(float).mean())", df) is None
+    assert repair_and_rerun("print(float(df['name'][0]), df['amount'].sum())", df) is None
+
+
+def test_dt_accessor_on_text_column_is_parsed_first(df):
+    rule, repaired = repair_and_rerun("print(df['day'].dt.month.max())", df)
+    assert rule == 'to_datetime'
+    assert repaired == "import pandas as pd\nprint(pd.to_datetime(df['day'], errors='coerce').dt.month.max())"
+
+
+def test_dt_accessor_rejected_by_the_validator_is_repaired(df):
+    code = "total = df['amount'].sum()\nprint(df.day.dt.year, total)"
+    problems = code_validator.validate_code(code, df).problems
+    error = code_validator.CodeValidationError(problems)
+    rule, repaired = repair_rules.repair(code, 'CodeValidationError', f"CodeValidationError: {error}")
+    assert rule == 'to_datetime'
+    assert repaired.splitlines()[2] == "print(pd.to_datetime(df.day, errors='coerce').dt.year, total)"
+    assert code_validator.validate_code(repaired, df).problems == []
+
+
+def test_other_validator_problems_are_not_repaired(df):
+    code = "print(df['revenue'].sum())"
+    error = code_validator.CodeValidationError(code_validator.validate_code(code, df).problems)
+    assert repair_rules.repair(code, 'CodeValidationError', f"CodeValidationError: {error}") is None
+
+
+def test_text_column_compared_with_a_date_is_parsed(df):
+    rule, repaired = repair_and_rerun("print(df[df['day'] > pd.Timestamp('2024-01-15')])", df)
+    assert rule == 'to_datetime_compare'
+    assert "pd.to_datetime(df['day'], errors='coerce') > pd.Timestamp('2024-01-15')" in repaired
+
+
+def test_unrelated_errors_are_left_to_the_error_corrector(df):
+    assert repair_and_rerun("print(df['missing'])", df) is None
+    assert repair_rules.repair("print(", 'SyntaxError', 'SyntaxError: bad') is None
+
+
+def test_custom_rules_receive_the_failing_line(df):
+    @repair_rules.rule('iteritems', ['AttributeError'], r"has no attribute 'iteritems'")
+    def iteritems(code, tree, lineno, error):
+        lines = code.splitlines()
+        lines[lineno - 1] = lines[lineno - 1].replace('.iteritems(', '.items(')
+        return '\n'.join(lines)
+
+    try:
+        rule, repaired = repair_and_rerun("for key, value in df['amount'].iteritems():\n    print(key, value)", df)
+    finally:
+        repair_rules.RULES.remove(repair_rules.RULES[-1])
+    assert rule == 'iteritems'
+    assert repaired.startswith("for key, value in df['amount'].items():")